@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+""" python benchmarks, run offline against the discovery documents bundled with googleapiclient """
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, DISCOVERY_URI
+
+from googleapi.api import GoogleApi, element_fields
+from googleapi.cache import MemoryCache
+from googleapi.credentials import CredentialCache
+from googleapi.discovery import DiscoveryStore, ServiceRegistry, discovery_document_url
+from googleapi.metrics import Metrics
+from googleapi.replay import Cassette, replay_pool
+from googleapi.retry import RetryPolicy
+
+
+def offline_cache(api, api_version):
+    """discovery cache prefilled with the static discovery document of an api"""
+    cache = MemoryCache()
+    cache.set(discovery_document_url(api, api_version, DISCOVERY_URI),
+              discovery_cache.get_static_doc(api, api_version))
+    return cache
+
+
+# results of the benchmarks run, name -> dict of values where lower is better
+RESULTS = {}
+
+
+def report(log, name, count, seconds):
+    """log the result of a benchmark"""
+    log.info("%-32s %8d calls %10.3f ms total %10.1f us/call %10.0f calls/s", name, count,
+             seconds * 1000, seconds / count * 1000000, count / seconds if seconds else 0)
+    RESULTS.setdefault(name, {})["us_per_call"] = seconds / count * 1000000
+
+
+def report_latency(log, name, method):
+    """log the latency percentiles of a method snapshot of googleapi.metrics.Metrics"""
+    log.info("%-32s p50 %8.3f ms p95 %8.3f ms p99 %8.3f ms %6d retries %8.3f s backoff", name,
+             method["p50"] * 1000, method["p95"] * 1000, method["p99"] * 1000, method["retries"],
+             method["backoff"])
+    RESULTS.setdefault(name, {}).update(p50_ms=method["p50"] * 1000, p95_ms=method["p95"] * 1000)
+
+
+def compare(log, baseline, tolerance):
+    """
+    compare the results with a baseline
+
+    :return: list of regressions (name, key, baseline value, value)
+    """
+    regressions = []
+    for name, values in sorted(RESULTS.items()):
+        for key, value in sorted(values.items()):
+            previous = baseline.get(name, {}).get(key)
+            if previous is None:
+                continue
+            change = (value - previous) / previous if previous else 0.0
+            if change > tolerance:
+                regressions.append((name, key, previous, value))
+                log.warning("REGRESSION %-32s %-12s %10.3f -> %10.3f (%+.0f%%)", name, key,
+                            previous, value, change * 100)
+            else:
+                log.info("%-32s %-12s %10.3f -> %10.3f (%+.0f%%)", name, key, previous, value,
+                         change * 100)
+    return regressions
+
+
+def bench_service_build(args, log):
+    """service build cost per delegated user with and without the service registry"""
+    cache = offline_cache(args.api, args.api_version)
+
+    start = time.perf_counter()
+    for _ in range(args.users):
+        build(args.api,
+              args.api_version,
+              credentials=AnonymousCredentials(),
+              discoveryServiceUrl=DISCOVERY_URI,
+              cache=cache)
+    report(log, "build() per user", args.users, time.perf_counter() - start)
+
+    api = GoogleApi(args.api,
+                    args.api_version, [],
+                    credentials=AnonymousCredentials(),
+                    discovery_cache=cache,
+                    service_registry=ServiceRegistry())
+    start = time.perf_counter()
+    for _ in range(args.users):
+        api.clone(credentials=AnonymousCredentials()).service
+    report(log, "registry clone().service", args.users, time.perf_counter() - start)
+
+
+def bench_discovery_store(args, log):
+    """cold service build from a local discovery store compared with a network fetch"""
+    store = DiscoveryStore(tempfile.mkdtemp(prefix="discovery_store"))
+    store.snapshot([(args.api, args.api_version)], static=True)
+
+    def cold_build(**kwargs):
+        """build with an empty registry and an empty discovery cache"""
+        ServiceRegistry().build(args.api,
+                                args.api_version,
+                                DISCOVERY_URI,
+                                cache=MemoryCache(),
+                                credentials=AnonymousCredentials(),
+                                **kwargs)
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        cold_build(store=store)
+    report(log, "cold build() from store", args.runs, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        for _ in range(args.runs):
+            cold_build()
+    except Exception as error:  # noqa
+        log.warning("network fetch failed: %s", error)
+    else:
+        report(log, "cold build() from network", args.runs, time.perf_counter() - start)
+    shutil.rmtree(store.path)
+
+
+def compute_instance(index):
+    """compute instance resource of a typical size"""
+    zone = "https://www.googleapis.com/compute/v1/projects/project/zones/europe-west1-b"
+    return {
+        "kind": "compute#instance",
+        "id": str(1000000000000000000 + index),
+        "creationTimestamp": "2024-01-01T00:00:00.000-07:00",
+        "name": "instance-{}".format(index),
+        "tags": {"items": ["http-server", "https-server"], "fingerprint": "42WmSpB8rSM="},
+        "machineType": zone + "/machineTypes/n1-standard-1",
+        "status": "RUNNING",
+        "zone": zone,
+        "canIpForward": False,
+        "networkInterfaces": [{
+            "network": zone + "/global/networks/default",
+            "subnetwork": zone + "/regions/europe-west1/subnetworks/default",
+            "networkIP": "10.132.0.{}".format(index % 250),
+            "name": "nic0",
+            "accessConfigs": [{"type": "ONE_TO_ONE_NAT", "name": "External NAT",
+                               "natIP": "35.0.0.{}".format(index % 250),
+                               "networkTier": "PREMIUM", "kind": "compute#accessConfig"}],
+            "fingerprint": "abcdefghijk=",
+            "kind": "compute#networkInterface",
+        }],
+        "disks": [{
+            "kind": "compute#attachedDisk", "type": "PERSISTENT", "mode": "READ_WRITE",
+            "source": zone + "/disks/instance-{}".format(index), "deviceName": "persistent-disk-0",
+            "index": 0, "boot": True, "autoDelete": True,
+            "licenses": ["https://www.googleapis.com/compute/v1/projects/debian-cloud/global/"
+                         "licenses/debian-12-bookworm"],
+            "interface": "SCSI", "guestOsFeatures": [{"type": "VIRTIO_SCSI_MULTIQUEUE"},
+                                                     {"type": "UEFI_COMPATIBLE"}],
+            "diskSizeGb": "10",
+        }],
+        "metadata": {"kind": "compute#metadata", "fingerprint": "abcdefghijk=",
+                     "items": [{"key": "startup-script", "value": "#!/bin/bash\n" * 20}]},
+        "serviceAccounts": [{"email": "1234-compute@developer.gserviceaccount.com",
+                             "scopes": ["https://www.googleapis.com/auth/cloud-platform"]}],
+        "selfLink": zone + "/instances/instance-{}".format(index),
+        "scheduling": {"onHostMaintenance": "MIGRATE", "automaticRestart": True,
+                       "preemptible": False, "provisioningModel": "STANDARD"},
+        "cpuPlatform": "Intel Haswell",
+        "labelFingerprint": "42WmSpB8rSM=",
+        "startRestricted": False,
+        "deletionProtection": False,
+        "fingerprint": "abcdefghijk=",
+        "lastStartTimestamp": "2024-01-01T00:00:00.000-07:00",
+    }
+
+
+def bench_field_paths(args, log):
+    """
+    field mask construction from field paths, response size and parse time of a compute
+    instance listing with and without field_paths
+    """
+    field_paths = ["name", "status", "zone", "disks.source", "disks.boot",
+                   "networkInterfaces.networkIP", "networkInterfaces.accessConfigs.natIP",
+                   "disks", "metadata.items.key"]
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        element_fields("items", field_paths=field_paths)
+    report(log, "field_mask {} paths".format(len(field_paths)), args.calls,
+           time.perf_counter() - start)
+
+    items = [compute_instance(index) for index in range(500)]
+    pages = {
+        "full": {"items": items},
+        "field_paths name, status": {"items": [{"name": item["name"], "status": item["status"]}
+                                               for item in items]},
+    }
+    for name, page in pages.items():
+        content = json.dumps(page)
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            json.loads(content)
+        log.info("%-32s %10d bytes %10.3f ms parse time", name, len(content),
+                 (time.perf_counter() - start) / args.runs * 1000)
+
+
+def drive_file(index):
+    """drive file resource of a typical size"""
+    return {
+        "kind": "drive#file",
+        "id": "1a2b3c4d5e6f7g8h9i0j{}".format(index),
+        "name": "report-{}.pdf".format(index),
+        "mimeType": "application/pdf",
+        "parents": ["0AbCdEfGhIjKlMnOpQrS"],
+        "webViewLink": "https://drive.google.com/file/d/1a2b3c4d5e6f7g8h9i0j{}/view".format(index),
+        "iconLink": "https://drive-thirdparty.googleusercontent.com/16/type/application/pdf",
+        "createdTime": "2024-01-01T00:00:00.000Z",
+        "modifiedTime": "2024-01-02T00:00:00.000Z",
+        "owners": [{"kind": "drive#user", "displayName": "User", "me": True,
+                    "permissionId": "01234567890123456789", "emailAddress": "user@example.com"}],
+        "size": str(index * 1024),
+        "md5Checksum": "d41d8cd98f00b204e9800998ecf8427e",
+        "capabilities": {name: True for name in ("canEdit", "canComment", "canCopy", "canDelete",
+                                                 "canDownload", "canRename", "canShare",
+                                                 "canTrash", "canReadRevisions")},
+    }
+
+
+def bench_json_model(args, log):
+    """parse time and peak memory of multi-MB list pages with the available json decoders"""
+    from googleapiclient.model import JsonModel
+
+    from googleapi import model
+
+    def incremental(content, return_element):
+        """consume the elements one by one"""
+        for _ in model.IncrementalPage(content, return_element).elements():
+            pass
+
+    pages = [
+        ("compute", "items", [compute_instance(index) for index in range(2000)]),
+        ("drive", "files", [drive_file(index) for index in range(10000)]),
+    ]
+    decoders = [
+        ("JsonModel", lambda content, return_element: JsonModel().deserialize(content)),
+        ("FastJsonModel{}".format("" if model.orjson else " (no orjson)"),
+         lambda content, return_element: model.FastJsonModel().deserialize(content)),
+        ("IncrementalPage", incremental),
+    ]
+    for api, return_element, items in pages:
+        content = json.dumps({return_element: items, "nextPageToken": "token"}).encode("utf-8")
+        for name, decode in decoders:
+            start = time.perf_counter()
+            for _ in range(args.runs):
+                decode(content, return_element)
+            seconds = (time.perf_counter() - start) / args.runs
+            tracemalloc.start()
+            decode(content, return_element)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            log.info("%-8s %5.1f MB %-26s %8.1f ms %8.1f MB peak", api, len(content) / 1e6, name,
+                     seconds * 1000, peak / 1e6)
+
+
+class FakeRequest(object):
+    """request of FakeResource"""
+
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+
+    def execute(self, num_retries=0):
+        """return the request parameters"""
+        return self.kwargs
+
+
+class FakeResource(object):
+    """minimal stand-in for a googleapiclient resource"""
+
+    def instances(self):
+        """nested resource"""
+        return self
+
+    def list(self, **kwargs):
+        """api method"""
+        return FakeRequest(kwargs)
+
+
+def bench_method_helper(args, log):
+    """per call overhead of GoogleApi/MethodHelper chaining compared to the plain service"""
+    service = FakeResource()
+    api = GoogleApi("compute", "v1", [])
+    api._service = service
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        service.instances().list(project="project", zone="zone").execute()
+    plain = time.perf_counter() - start
+    report(log, "service.instances().list()", args.calls, plain)
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        api.instances().list(project="project", zone="zone").execute()
+    helper = time.perf_counter() - start
+    report(log, "api.instances().list()", args.calls, helper)
+    log.info("overhead per call: %.1f us", (helper - plain) / args.calls * 1000000)
+
+
+def import_times(statement):
+    """
+    run a statement in a fresh interpreter with -X importtime
+
+    :return: dict module -> cumulative import time in microseconds
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            stderr=subprocess.PIPE,
+                            check=True,
+                            universal_newlines=True).stderr
+    times = {}
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def bench_startup(args, log):
+    """import time of googleapi and the modules loaded by the first use of GoogleApi"""
+    statements = [
+        ("import googleapi", "import googleapi"),
+        ("GoogleApi()", "from googleapi import GoogleApi; GoogleApi('{}', '{}', [])".format(
+            args.api, args.api_version)),
+    ]
+    for name, statement in statements:
+        best = None
+        for _ in range(args.runs):
+            times = import_times(statement)
+            if best is None or times.get("googleapi", 0) < best.get("googleapi", 0):
+                best = times
+        log.info("%-32s %10.1f ms (best of %d)", name, best.get("googleapi", 0) / 1000.0,
+                 args.runs)
+        RESULTS.setdefault(name, {})["import_ms"] = best.get("googleapi", 0) / 1000.0
+    heavy = ["httplib2", "googleapiclient.http", "googleapiclient.discovery", "google.auth",
+             "google.oauth2.service_account", "google_auth_oauthlib.flow"]
+    loaded = [module for module in heavy if module in import_times("import googleapi")]
+    log.info("heavy modules imported by import googleapi: %s", ", ".join(loaded) or "none")
+
+
+def synthetic_cassette(file_name, pages=10, page_size=500):
+    """
+    cassette with the compute v1 discovery document and synthetic instance responses
+
+    the requests are created by the service itself, so they match the requests of GoogleApi
+
+    :return: Cassette
+    """
+    content = discovery_cache.get_static_doc("compute", "v1")
+    cassette = Cassette(file_name)
+    ok = {"status": "200", "content-type": "application/json; charset=UTF-8"}
+    cassette.add(discovery_document_url("compute", "v1", DISCOVERY_URI), "GET", None, ok,
+                 content.encode("utf-8"))
+
+    service = ServiceRegistry().build("compute", "v1", DISCOVERY_URI, cache=offline_cache(
+        "compute", "v1"), credentials=AnonymousCredentials())
+    instances = service.instances()
+    request = instances.get(project="project", zone="zone", instance="instance-0")
+    cassette.add(request.uri, "GET", None, ok, json.dumps(compute_instance(0)).encode("utf-8"))
+    request = instances.list(project="project", zone="zone")
+    for page in range(pages):
+        items = [compute_instance(page * page_size + index) for index in range(page_size)]
+        response = {"kind": "compute#instanceList", "items": items}
+        if page < pages - 1:
+            response["nextPageToken"] = "page-{}".format(page + 1)
+        cassette.add(request.uri, "GET", None, ok, json.dumps(response).encode("utf-8"))
+        request = instances.list_next(request, response)
+    cassette.save()
+    return cassette
+
+
+def replay_api(cassette, args, **kwargs):
+    """compute api replaying a cassette with the latency and errors of args"""
+    pool = replay_pool(cassette,
+                       latency=args.latency,
+                       jitter=args.latency / 2,
+                       seed=1,
+                       errors=kwargs.pop("errors", None))
+    return GoogleApi("compute",
+                     "v1", [],
+                     credentials=AnonymousCredentials(),
+                     discovery_cache=MemoryCache(),
+                     service_registry=ServiceRegistry(),
+                     metrics=Metrics(),
+                     **kwargs).with_http_pool(pool)
+
+
+def bench_replay(args, log):
+    """execute, list_all and retry backoff against a replayed compute api"""
+    directory = tempfile.mkdtemp(prefix="replay")
+    try:
+        cassette = args.cassette and Cassette(args.cassette) or synthetic_cassette(
+            os.path.join(directory, "compute.json"))
+        calls = max(args.calls // 100, 1)
+
+        api = replay_api(cassette, args)
+        start = time.perf_counter()
+        api.service
+        report(log, "replay service build", 1, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            api.instances().get(project="project", zone="zone", instance="instance-0").execute()
+        report(log, "replay execute", calls, time.perf_counter() - start)
+        report_latency(log, "replay execute", api.metrics.snapshot()["compute.instances.get"])
+
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            api.instances().list_all(project="project", zone="zone")
+        report(log, "replay list_all", args.runs, time.perf_counter() - start)
+        report_latency(log, "replay list_all pages",
+                       api.metrics.snapshot()["compute.instances.list"])
+
+        api = replay_api(cassette,
+                         args,
+                         errors={429: 0.05, 503: 0.05},
+                         retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.01))
+        api.service
+        start = time.perf_counter()
+        for _ in range(calls):
+            api.instances().get(project="project", zone="zone", instance="instance-0").execute()
+        report(log, "replay retry", calls, time.perf_counter() - start)
+        report_latency(log, "replay retry", api.metrics.snapshot()["compute.instances.get"])
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_clone_delegate(args, log):
+    """cost of clone() and delegate() to new users of a service account"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    info = {
+        "type": "service_account",
+        "client_email": "benchmark@project.iam.gserviceaccount.com",
+        "private_key_id": "benchmark",
+        "private_key": key.private_bytes(serialization.Encoding.PEM,
+                                         serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption()).decode("ascii"),
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+    api = GoogleApi("admin",
+                    "directory_v1", ["https://www.googleapis.com/auth/admin.directory.user"],
+                    discovery_cache=offline_cache("admin", "directory_v1"),
+                    credential_cache=CredentialCache(background_refresh=False))
+    api.with_service_account(info)
+    api.service
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        api.clone()
+    report(log, "clone()", args.calls, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for index in range(args.users):
+        api.delegate("user{}@example.com".format(index)).service
+    report(log, "delegate(new user).service", args.users, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for index in range(args.users):
+        api.delegate("user{}@example.com".format(index)).service
+    report(log, "delegate(cached user).service", args.users, time.perf_counter() - start)
+
+
+BENCHMARKS = {
+    "build": bench_service_build,
+    "clone_delegate": bench_clone_delegate,
+    "discovery_store": bench_discovery_store,
+    "field_paths": bench_field_paths,
+    "json_model": bench_json_model,
+    "method_helper": bench_method_helper,
+    "replay": bench_replay,
+    "startup": bench_startup,
+}
+
+
+def main():
+    """ benchmarks """
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger("benchmark")
+    parser = ArgumentParser(description="Benchmarks for GoogleApi")
+    parser.add_argument("benchmarks",
+                        nargs="*",
+                        help="Benchmarks to run ({}), defaults to all".format(", ".join(
+                            sorted(BENCHMARKS))))
+    parser.add_argument("--api", default="compute", help="API name")
+    parser.add_argument("--api-version", default="v1", help="API version")
+    parser.add_argument("--users", type=int, default=200, help="number of delegated users")
+    parser.add_argument("--calls", type=int, default=100000, help="number of api calls")
+    parser.add_argument("--runs", type=int, default=5, help="number of repetitions")
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.0,
+                        help="seconds added to every replayed response")
+    parser.add_argument("--cassette", help="recorded cassette to replay instead of synthetic data")
+    parser.add_argument("--save", help="write the results to a json file")
+    parser.add_argument("--baseline", help="compare the results with a json file of --save")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=0.25,
+                        help="relative slowdown reported as regression")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {}".format(name))
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        log.info("running %s", name)
+        BENCHMARKS[name](args, log)
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(RESULTS, results_file, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(log, json.load(baseline_file), args.tolerance)
+        if regressions:
+            log.error("%d regressions", len(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+""" shared fixtures of the tests """
+
+import pytest
+
+from stubserver import StubServer
+
+
+@pytest.fixture
+def stub():
+    """local stub server, closed after the test"""
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,303 @@
+""" asyncio variant of the Google API helper """
+
+import asyncio
+import time
+
+import google_auth_httplib2
+import httplib2
+
+from googleapiclient import errors
+
+from .api import GoogleApi, MethodHelper, element_fields, field_mask, page_fields, set_fields
+from .retry import parse_http_error
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+class AsyncGoogleApi(GoogleApi):
+    """
+    Google API helper object with awaitable api calls
+
+    requests are built by the googleapiclient service as usual, but sent through a shared
+    aiohttp session, so one event loop can drive many concurrent calls. The service itself is
+    built synchronously on first use, the discovery document is cached for the process.
+
+    requires the async extra: pip install google-api-helper[async]
+    """
+
+    def __init__(self, api="oauth2", api_version="v2", scopes=['email'], *args, **kwargs):
+        """constructor"""
+        super(AsyncGoogleApi, self).__init__(api, api_version, scopes, *args, **kwargs)
+        self.session = kwargs.get('session')
+        self.connection_limit = kwargs.get('connection_limit', 100)
+        self._refresh_lock = None
+
+    def get_session(self):
+        """
+        get or create the aiohttp session used for api calls
+
+        clones created after this call share the session and its connection pool
+        """
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for AsyncGoogleApi, "
+                               "install google-api-helper[async]")
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit))
+        return self.session
+
+    async def close(self):
+        """close the aiohttp session"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        self.get_session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _authorize(self, request, headers):
+        """
+        add the authorization header, refreshing the credentials in an executor if needed
+
+        without explicit credentials the credentials of the service http are used, i.e.
+        application default credentials or the credentials moved into the http of a pool
+        """
+        credentials = self.credentials
+        if credentials is None:
+            credentials = getattr(request.http, "credentials", None)
+        if credentials is None:
+            return
+        if not credentials.valid:
+            if self._refresh_lock is None:
+                self._refresh_lock = asyncio.Lock()
+            async with self._refresh_lock:
+                if not credentials.valid:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(
+                        None, credentials.refresh,
+                        google_auth_httplib2.Request(httplib2.Http()))
+        credentials.apply(headers)
+
+    async def execute_request(self, request):
+        """
+        send a googleapiclient request through the aiohttp session
+
+        :param request: googleapiclient.http.HttpRequest
+        :return: deserialized response
+        """
+        headers = dict(request.headers)
+        await self._authorize(request, headers)
+        async with self.get_session().request(request.method,
+                                              request.uri,
+                                              data=request.body,
+                                              headers=headers) as response:
+            content = await response.read()
+            info = dict(response.headers)
+            info['status'] = response.status
+        resp = httplib2.Response(info)
+        if resp.status >= 300:
+            raise errors.HttpError(resp, content, uri=request.uri)
+        return request.postproc(resp, content)
+
+    async def retry(self, service_method, retry_count=0):
+        """
+        retry a google api call and check for rate limits
+
+        errors are retried according to the retry_policy
+
+        :param service_method: api call (googleapiclient.http.HttpRequest)
+        :param retry_count: number of attempts already made
+        """
+        metrics = self.metrics
+        if metrics is None:
+            return await self._retry_loop(service_method, retry_count)
+        path = metrics.track(service_method)
+        started = time.perf_counter()
+        try:
+            result = await self._retry_loop(service_method, retry_count, metrics, path)
+        except BaseException as error:
+            metrics.record_call(path, time.perf_counter() - started, error)
+            raise
+        metrics.record_call(path, time.perf_counter() - started)
+        return result
+
+    async def _retry_loop(self, service_method, retry_count, metrics=None, path=None):
+        """execute a request until it succeeds or must not be retried anymore"""
+        state = None
+        started = time.time()
+        self.retry_policy.record_call()
+        while True:
+            if self.rate_limiter is not None:
+                delay = self.rate_limiter.reserve(self, service_method)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                return await self.execute_request(service_method)
+            except errors.HttpError as error:
+                code, reason, message = parse_http_error(error)
+                state = state or self.retry_policy.start(retry_count, started)
+                delay = state.next_delay(error)
+                if delay is None:
+                    self.log.warn("got http error {} ({}): {}".format(code, reason, message))
+                    raise
+                self.log.info("got http error %s (%s), sleeping for %.1f seconds", code, reason,
+                              delay)
+                if metrics is not None:
+                    metrics.record_retry(path, delay)
+                await asyncio.sleep(delay)
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                raise
+            except Exception as error:
+                state = state or self.retry_policy.start(retry_count, started)
+                delay = state.next_delay(error)
+                if delay is None:
+                    self.log.exception("Failed to execute api method")
+                    raise
+                self.log.info("got %s, sleeping for %.1f seconds", error, delay)
+                if metrics is not None:
+                    metrics.record_retry(path, delay)
+                await asyncio.sleep(delay)
+
+    def operation_waiter(self, **kwargs):
+        """not supported, the operation waiter polls with blocking calls"""
+        raise TypeError("operation_waiter is not supported by AsyncGoogleApi, use GoogleApi")
+
+    def batch(self, *args, **kwargs):
+        """not supported, batch requests are sent with blocking httplib2 calls"""
+        raise TypeError("batch is not supported by AsyncGoogleApi, use GoogleApi")
+
+    def iter_batch(self, *args, **kwargs):
+        """not supported, see batch"""
+        raise TypeError("iter_batch is not supported by AsyncGoogleApi, use GoogleApi")
+
+    def __getattr__(self, name):
+        """ get attribute or service wrapper
+        :param name: attribute / service name
+        :return:
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+        service = self.service
+        method = self._methods.get(name)
+        if method is None or method.__self__.service is not service:
+            method = AsyncMethodHelper.resolve(self, service, name)
+            self._methods[name] = method
+        return method
+
+
+class AsyncMethodHelper(MethodHelper):
+    """ helper to streamline awaitable api calls"""
+
+    __slots__ = ()
+
+    async def execute(self, *args, field_paths=None, **kwargs):
+        """
+        execute service api
+
+        :param field_paths: only request these fields, i.e. ["name", "disks.source"]
+        """
+        if field_paths:
+            set_fields(self.service, field_mask(field_paths))
+        return await self._retry(self.service)
+
+    async def _retry(self, request):
+        """execute a request with retries, the response cache is not used by async calls"""
+        return await self.google_api.retry(request)
+
+    async def list_all(self, return_element="items", *args, **kwargs):
+        """
+        list all elements of a type
+        make sure you got enough memory to receive all elements
+
+        :param return_element name of the element containing a list of items
+        """
+        return [element async for element in self.iter_all(return_element, **kwargs)]
+
+    async def iter_pages(self, page_token=None, fields=None, **kwargs):
+        """
+        list all pages of a type, a page is yielded as soon as it has been received
+
+        :param page_token: resume listing at this page token
+        :param fields: partial response fields, nextPageToken is added if missing
+        :param kwargs: parameters of the list call, i.e. maxResults
+        """
+        if fields is not None:
+            kwargs["fields"] = page_fields(fields)
+        if page_token is not None:
+            kwargs["pageToken"] = page_token
+        request = self.service.list(**kwargs)
+        metrics = self.google_api.metrics
+        while request is not None:
+            page = await self._retry(request)
+            if metrics is not None:
+                metrics.record_page(request)
+            yield page
+            request = self.service.list_next(request, page)
+
+    async def iter_all(self,
+                       return_element="items",
+                       page_token=None,
+                       fields=None,
+                       field_paths=None,
+                       **kwargs):
+        """
+        list all elements of a type, elements are yielded page by page as they are received
+
+        :param return_element: name of the element containing a list of items
+        :param page_token: resume listing at this page token
+        :param fields: partial response fields, nextPageToken is added if missing
+        :param field_paths: only request these fields of the elements, i.e. ["name", "status"],
+            mutually exclusive with fields
+        :param kwargs: parameters of the list call, i.e. maxResults
+        """
+        fields = element_fields(return_element, fields, field_paths)
+        async for page in self.iter_pages(page_token, fields, **kwargs):
+            for element in page.get(return_element, []):
+                yield element
+
+    async def map_list_all(self, param_grid, return_element="items", workers=8, raise_errors=True,
+                           **kwargs):
+        """
+        run list_all for many parameter sets concurrently
+
+        i.e. async for params, items in compute.instances().map_list_all(zones)
+
+        :param param_grid: iterable of dicts with parameters of the list call
+        :param return_element: name of the element containing a list of items
+        :param workers: number of concurrent listings
+        :param raise_errors: raise the first failed listing, otherwise its exception is yielded
+        :param kwargs: parameters used for all list calls
+        :return: async generator of (params, items) in order of completion
+        """
+        semaphore = asyncio.Semaphore(workers)
+
+        async def list_all(params):
+            """list all elements of one parameter set"""
+            arguments = dict(kwargs)
+            arguments.update(params)
+            async with semaphore:
+                try:
+                    return params, await self.list_all(return_element, **arguments)
+                except Exception as error:  # noqa
+                    if raise_errors:
+                        raise
+                    return params, error
+
+        tasks = [asyncio.ensure_future(list_all(params)) for params in param_grid]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def sync(self, *args, **kwargs):
+        """not supported, the token store and sync generators are synchronous"""
+        raise TypeError("sync is not supported by AsyncGoogleApi, use GoogleApi")
@@ -1,37 +1,108 @@
 """ Google compute engine API """
 
+import itertools
 import logging
-import json
-import inspect
 import os
+import threading
 import time
-
-import google.auth
+import urllib.parse
 
 from googleapiclient import errors
-from googleapiclient.discovery import build, DISCOVERY_URI
-from googleapiclient.discovery_cache.base import Cache
-from google.oauth2 import service_account
+from .cache import MemoryCache, ResponseCache, directory_cache
+from .credentials import credential_cache
+from .discovery import DISCOVERY_URI, DiscoveryStore, default_discovery_store, service_registry
+from .metrics import Metrics
 from .oauth2 import authorize_application
+from .operations import OperationWaiter
+from .pool import HttpPool, PooledHttp
+from .retry import RetryPolicy, parse_http_error, retry_after
+from . import parallel
 
+program_memory_cache = MemoryCache()
 
-class MemoryCache(Cache):
-    """ in meory cache """
+# maximum number of calls in a single batch request, see the batch documentation of each api
+BATCH_SIZE_LIMITS = {
+    "admin": 1000,
+    "calendar": 50,
+    "compute": 1000,
+    "drive": 100,
+    "gmail": 50,
+}
+DEFAULT_BATCH_SIZE = 100
+
+
+def page_fields(fields):
+    """
+    add nextPageToken to a partial response field mask, otherwise pagination stops early
+
+    :param fields: fields parameter of a list call
+    :return: fields including nextPageToken
+    """
+    if fields == "*" or "nextPageToken" in fields:
+        return fields
+    return "nextPageToken," + fields
+
+
+def field_mask(field_paths):
+    """
+    build a partial response field mask from field paths
+
+    i.e. ["name", "disks.source", "disks.boot"] -> "name,disks(source,boot)"
+
+    :param field_paths: iterable of field paths, nested fields separated by dots
+    :return: fields parameter
+    """
+    tree = {}
+    for field_path in field_paths:
+        node = tree
+        names = field_path.split(".")
+        for index, name in enumerate(names):
+            if index == len(names) - 1:
+                # the whole field is selected, selections of its subfields are redundant
+                node[name] = None
+            elif node.get(name, {}) is None:
+                break
+            else:
+                node = node.setdefault(name, {})
 
-    def __init__(self):
-        """ init cache """
-        self.cache = {}
+    def render(node):
+        """render a level of the tree"""
+        return ",".join(name if children is None else "{}({})".format(name, render(children))
+                        for name, children in node.items())
 
-    def get(self, url):
-        """ get from caceh """
-        self.cache.get(url, None)
+    return render(tree)
 
-    def set(self, url, content):
-        """ set cache """
-        self.cache[url] = content
 
+def element_fields(return_element, fields=None, field_paths=None):
+    """
+    fields parameter of a list call selecting field_paths of the listed elements
+
+    :param return_element: name of the element containing a list of items
+    :param fields: partial response fields, returned as they are if field_paths is None
+    :param field_paths: field paths of the listed elements, None or empty for all fields
+    :return: fields parameter, i.e. items(name,status)
+    """
+    if not field_paths:
+        return fields
+    if fields is not None:
+        raise ValueError("fields and field_paths are mutually exclusive")
+    return "{}({})".format(return_element, field_mask(field_paths))
 
-program_memory_cache = MemoryCache()
+
+def set_fields(request, fields):
+    """
+    set the partial response fields of a request
+
+    :param request: googleapiclient.http.HttpRequest
+    :param fields: fields parameter
+    """
+    scheme, netloc, path, query, fragment = urllib.parse.urlsplit(request.uri)
+    params = [(name, value)
+              for name, value in urllib.parse.parse_qsl(query, keep_blank_values=True)
+              if name != "fields"]
+    params.append(("fields", fields))
+    request.uri = urllib.parse.urlunsplit(
+        (scheme, netloc, path, urllib.parse.urlencode(params), fragment))
 
 
 class GoogleApi(object):
@@ -45,58 +116,196 @@ class GoogleApi(object):
         self.credentials = kwargs.get('credentials')
         self.sub = kwargs.get('sub')
         self._service = None
+        self._methods = {}
         self.discovery_url = kwargs.get('discovery_url', DISCOVERY_URI)
         self.retries = kwargs.get('retries', 3)
         self.credential_cache_file = kwargs.get('credential_cache_file')
         self.log = logging.getLogger("GoogleApi")
         self.cache_dir = kwargs.get('cache_dir', ".cache")
+        self.discovery_cache = kwargs.get('discovery_cache', program_memory_cache)
+        self.service_registry = kwargs.get('service_registry', service_registry)
+        self.rate_limiter = kwargs.get('rate_limiter')
+        self.retry_policy = kwargs.get('retry_policy', RetryPolicy())
+        self.http_pool = kwargs.get('http_pool')
+        self.credential_cache = kwargs.get('credential_cache', credential_cache)
+        self.response_cache = kwargs.get('response_cache')
+        self.discovery_store = kwargs.get('discovery_store', default_discovery_store())
+        self.metrics = kwargs.get('metrics')
+        self.model = kwargs.get('model')
+        self.sync_store = kwargs.get('sync_store')
 
     def clone(self, **kwargs):
         """clone this object and overwrite some properties"""
+        # only copy instance attributes, properties like service must not be evaluated
         arguments = {}
-        for member in inspect.getmembers(self, lambda a: not (inspect.isroutine(a))):
-            if not member[0].startswith("_"):
-                arguments[member[0]] = kwargs.get(member[0], member[1])
-        return GoogleApi(**arguments)
+        for name, value in vars(self).items():
+            if not name.startswith("_"):
+                arguments[name] = kwargs.get(name, value)
+        return self.__class__(**arguments)
 
     @property
     def service(self):
         """get or create a api service"""
         if self._service is None:
-            self._service = build(self.api,
-                                  self.api_version,
-                                  credentials=self.credentials,
-                                  discoveryServiceUrl=self.discovery_url,
-                                  cache=program_memory_cache)
+            credentials = self.credentials
+            http = None
+            discovery_http = None
+            if self.http_pool is not None:
+                import google.auth
+                import google_auth_httplib2
+                if credentials is None:
+                    credentials, _ = google.auth.default(scopes=self.scopes)
+                http = google_auth_httplib2.AuthorizedHttp(credentials,
+                                                           http=PooledHttp(self.http_pool))
+                # the discovery document is fetched without credentials
+                discovery_http = PooledHttp(self.http_pool)
+                credentials = None
+            self._service = self.service_registry.build(self.api,
+                                                        self.api_version,
+                                                        self.discovery_url,
+                                                        cache=self.discovery_cache,
+                                                        credentials=credentials,
+                                                        http=http,
+                                                        store=self.discovery_store,
+                                                        model=self.model,
+                                                        discovery_http=discovery_http)
 
         return self._service
 
-    def with_service_account_file(self, service_account_file, sub=None):
-        """use service account credentials"""
-        credentials = service_account.Credentials.from_service_account_file(service_account_file)
-        if self.scopes:
-            credentials = credentials.with_scopes(self.scopes)
-        if sub:
-            credentials = credentials.with_subject(sub)
+    def with_discovery_cache(self, cache=None):
+        """
+        use a persistent discovery document cache
 
-        self.credentials = credentials
+        discovery documents are stored in the discovery subdirectory of cache_dir and shared
+        with all processes using the same directory
+
+        :param cache: discovery cache to use, defaults to a cache persisted in cache_dir
+        :return: GoogleApi self
+        """
+        if cache is None:
+            cache = directory_cache(os.path.join(self.cache_dir, "discovery"))
+        self.discovery_cache = cache
+        self._service = None
+        return self
+
+    def with_discovery_store(self, discovery_store=None):
+        """
+        build services from a local discovery store without network access
+
+        apis missing in the store are still fetched. Create the store with the
+        googleapi-prewarm command or DiscoveryStore.snapshot.
+
+        :param discovery_store: discovery.DiscoveryStore, defaults to the discovery_store
+            subdirectory of cache_dir
+        :return: GoogleApi self
+        """
+        if discovery_store is None:
+            discovery_store = DiscoveryStore(os.path.join(self.cache_dir, "discovery_store"))
+        self.discovery_store = discovery_store
+        self._service = None
+        return self
+
+    def with_http_pool(self, http_pool=None):
+        """
+        send requests through a shared connection pool
+
+        the pool is shared with all clones and delegated apis, so many api objects reuse a few
+        warm connections
+
+        :param http_pool: pool.HttpPool, defaults to a new pool
+        :return: GoogleApi self
+        """
+        self.http_pool = http_pool if http_pool is not None else HttpPool()
+        self._service = None
+        return self
+
+    def with_response_cache(self, response_cache=None):
+        """
+        cache GET responses of execute and list calls, revalidated with ETags
+
+        :param response_cache: cache.ResponseCache, defaults to an in memory cache
+        :return: GoogleApi self
+        """
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        return self
+
+    def with_model(self, model):
+        """
+        use a response model for the service
+
+        by default responses are parsed with model.FastJsonModel
+
+        :param model: googleapiclient.model.Model, i.e. googleapiclient.model.JsonModel()
+        :return: GoogleApi self
+        """
+        self.model = model
+        self._service = None
+        return self
+
+    def with_sync_store(self, sync_store=None):
+        """
+        keep the tokens of MethodHelper.sync in a token store
+
+        the sync store is shared with all clones and delegated apis
+
+        :param sync_store: sync.TokenStore, defaults to sync_tokens.json in cache_dir
+        :return: GoogleApi self
+        """
+        from .sync import TokenStore
+        if sync_store is None:
+            sync_store = TokenStore(os.path.join(self.cache_dir, "sync_tokens.json"))
+        self.sync_store = sync_store
+        return self
+
+    def with_metrics(self, metrics=None):
+        """
+        record call counts, latencies, retries, pages and response bytes per api method
+
+        the metrics are shared with all clones and delegated apis
+
+        :param metrics: metrics.Metrics, defaults to new metrics
+        :return: GoogleApi self
+        """
+        self.metrics = metrics if metrics is not None else Metrics()
+        return self
+
+    def with_rate_limiter(self, rate_limiter):
+        """
+        throttle requests before they are sent
+
+        the rate limiter is shared with all clones and delegated apis
+
+        :param rate_limiter: ratelimit.RateLimiter
+        :return: GoogleApi self
+        """
+        self.rate_limiter = rate_limiter
+        return self
+
+    def with_service_account_file(self, service_account_file, sub=None):
+        """use service account credentials, cached in credential_cache"""
+        self.credentials = self.credential_cache.service_account_file(
+            service_account_file, self.scopes, sub)
         self._service = None
         self.sub = sub
         return self
 
     def with_service_account(self, service_account, sub=None):
-        """use service account credentials"""
-        credentials = service_account.Credentials.from_service_account_info(service_account)
-        if self.scopes:
-            credentials = credentials.with_scopes(self.scopes)
-        if sub:
-            credentials = credentials.with_subject(sub)
-
-        self.credentials = credentials
+        """use service account credentials, cached in credential_cache"""
+        self.credentials = self.credential_cache.service_account(service_account, self.scopes, sub)
         self.sub = sub
         self._service = None
         return self
 
+    def with_credential_cache(self, credential_cache):
+        """
+        cache service account credentials and access tokens in credential_cache
+
+        :param credential_cache: credentials.CredentialCache
+        :return: GoogleApi self
+        """
+        self.credential_cache = credential_cache
+        return self
+
     def with_oauth2_flow(self, client_secret_file, local_webserver=False, **kwargs):
         """try to get credentials from oauth2 flow"""
         self.credential_cache_file = kwargs.get("credential_cache_file",
@@ -136,6 +345,7 @@ class GoogleApi(object):
 
     def with_application_credentials(self):
         """ use GCE or GAE default credentials"""
+        import google.auth
         credentials, _ = google.auth.default()
 
         self.credentials = credentials
@@ -144,12 +354,15 @@ class GoogleApi(object):
 
     def delegate(self, sub):
         """ create a credential delegation"""
-        if not hasattr(self.credentials, 'create_delegated'):
+        if hasattr(self.credentials, 'with_subject'):
+            credentials = self.credential_cache.delegated(self.credentials, sub)
+        elif hasattr(self.credentials, 'create_delegated'):
+            credentials = self.credentials.create_delegated(sub)
+        else:
             raise RuntimeError(("I do not know how to delegate the credentials, ",
-                                "create_delegated method is missing on credentials"))
+                                "with_subject method is missing on credentials"))
 
-        credentials = self.credentials.create_delegated(sub)
-        return self.clone(credentials=credentials)
+        return self.clone(credentials=credentials, sub=sub)
 
     def scoped(self, scopes):
         """
@@ -166,142 +379,288 @@ class GoogleApi(object):
     def retry(self, service_method, retry_count=0):
         """
         retry a google api call and check for rate limits
+
+        errors are retried according to the retry_policy
+
+        :param service_method: api call (googleapiclient.http.HttpRequest)
+        :param retry_count: number of attempts already made
         """
+        metrics = self.metrics
+        if metrics is None:
+            return self._retry_loop(service_method, retry_count)
+        path = metrics.track(service_method)
+        started = time.perf_counter()
         try:
-            ret = service_method.execute(num_retries=retry_count)
-        except errors.HttpError as error:
-            code = error.resp.get('code')
-
-            reason = ''
-            message = ''
+            result = self._retry_loop(service_method, retry_count, metrics, path)
+        except BaseException as error:
+            metrics.record_call(path, time.perf_counter() - started, error)
+            raise
+        metrics.record_call(path, time.perf_counter() - started)
+        return result
+
+    def _retry_loop(self, service_method, retry_count, metrics=None, path=None):
+        """execute a request until it succeeds or must not be retried anymore"""
+        state = None
+        started = time.time()
+        self.retry_policy.record_call()
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(self, service_method)
             try:
-                data = json.loads(error.content.decode('utf-8'))
-                code = data['error']["code"]
-                message = data['error']['message']
-                reason = data['error']['errors'][0]['reason']
-            except:  # noqa
-                pass
-
-            if code == 403 and "rate limit exceeded" in message.lower():
-                self.log.info("rate limit reached, sleeping for %s seconds", 2**retry_count)
-                time.sleep(2**retry_count)
-                ret = self.retry(service_method, retry_count + 1)
-            else:
-                self.log.warn("got http error {} ({}): {}".format(code, reason, message))
+                return service_method.execute()
+            except errors.HttpError as error:
+                code, reason, message = parse_http_error(error)
+                state = state or self.retry_policy.start(retry_count, started)
+                delay = state.next_delay(error)
+                if delay is None:
+                    if code != 304:
+                        self.log.warn("got http error {} ({}): {}".format(code, reason, message))
+                    raise
+                self.log.info("got http error %s (%s), sleeping for %.1f seconds", code, reason,
+                              delay)
+                if metrics is not None:
+                    metrics.record_retry(path, delay)
+                time.sleep(delay)
+            except KeyboardInterrupt:
                 raise
-        except KeyboardInterrupt:
-            raise
-        except:  # noqa
-            self.log.exception("Failed to execute api method")
-            raise
-        return ret
+            except Exception as error:
+                state = state or self.retry_policy.start(retry_count, started)
+                delay = state.next_delay(error)
+                if delay is None:
+                    self.log.exception("Failed to execute api method")
+                    raise
+                self.log.info("got %s, sleeping for %.1f seconds", error, delay)
+                if metrics is not None:
+                    metrics.record_retry(path, delay)
+                time.sleep(delay)
+
+    def with_retry_policy(self, retry_policy):
+        """
+        use a retry policy
+
+        the retry policy is shared with all clones and delegated apis
+
+        :param retry_policy: retry.RetryPolicy
+        :return: GoogleApi self
+        """
+        self.retry_policy = retry_policy
+        return self
+
+    def operation_waiter(self, **kwargs):
+        """
+        create a waiter polling the long running operations of this api
+
+        :param kwargs: arguments of operations.OperationWaiter, i.e. max_interval
+        :return: operations.OperationWaiter
+        """
+        return OperationWaiter(self, **kwargs)
+
+    def batch(self, requests, batch_size=None, raise_errors=True):
+        """
+        execute api calls in batch requests
+
+        :param requests: iterable of api calls, i.e. api.users().get(userKey=...)
+        :param batch_size: calls per batch request, defaults to the limit of the api
+        :param raise_errors: raise the first failed call, otherwise its HttpError is returned
+        :return: list of results in the order of requests
+        """
+        return list(self.iter_batch(requests, batch_size, raise_errors))
+
+    def iter_batch(self, requests, batch_size=None, raise_errors=True):
+        """
+        execute api calls in batch requests and yield the results in order
+
+        calls are split into batch requests of batch_size. Calls failing because of rate limits
+        are retried with exponential backoff, all other calls of the batch are not repeated.
+
+        :param requests: iterable of api calls, i.e. api.users().get(userKey=...)
+        :param batch_size: calls per batch request, defaults to the limit of the api
+        :param raise_errors: raise the first failed call, otherwise its HttpError is yielded
+        """
+        if batch_size is None:
+            batch_size = BATCH_SIZE_LIMITS.get(self.api, DEFAULT_BATCH_SIZE)
+        requests = iter(requests)
+        while True:
+            chunk = [
+                request.service if isinstance(request, MethodHelper) else request
+                for request in itertools.islice(requests, batch_size)
+            ]
+            if not chunk:
+                return
+            for result in self._execute_batch(chunk):
+                if raise_errors and isinstance(result, errors.HttpError):
+                    raise result
+                yield result
+
+    def _execute_batch(self, requests):
+        """
+        execute one batch request and retry failed calls according to the retry_policy
+
+        :param requests: list of googleapiclient.http.HttpRequest
+        :return: list of results or HttpErrors in the order of requests
+        """
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+        self.retry_policy.record_call()
+        state = self.retry_policy.start()
+        while pending:
+            retryable = []
+
+            def callback(request_id, response, exception):
+                """collect the result of a call"""
+                index = int(request_id)
+                if exception is not None and self.retry_policy.is_retryable(exception):
+                    retryable.append((index, exception))
+                    return
+                if exception is not None:
+                    self.log.warn("got http error {} ({}): {}".format(
+                        *parse_http_error(exception)))
+                results[index] = exception if exception is not None else response
+
+            batch = self.service.new_batch_http_request(callback=callback)
+            for index in pending:
+                batch.add(requests[index], request_id=str(index))
+            if self.rate_limiter is not None:
+                delay = max(self.rate_limiter.reserve(self, requests[index]) for index in pending)
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                batch.execute()
+            except errors.HttpError as error:
+                if not self.retry_policy.is_retryable(error):
+                    self.log.warn("got http error {} ({}): {}".format(*parse_http_error(error)))
+                    raise
+                retryable = [(index, error) for index in pending]
+
+            if not retryable:
+                return results
+            # one delay for all retried calls, the longest Retry-After wins
+            delay = state.next_delay(retryable[0][1])
+            if delay is None:
+                for index, error in retryable:
+                    self.log.warn("got http error {} ({}): {}".format(*parse_http_error(error)))
+                    results[index] = error
+                return results
+            delay = max([delay] + [retry_after(error) or 0.0 for _, error in retryable])
+            self.log.info("%s calls failed, sleeping for %.1f seconds", len(retryable), delay)
+            time.sleep(delay)
+            pending = sorted(index for index, _ in retryable)
+        return results
 
     def __getattr__(self, name):
         """ get attribute or service wrapper
         :param name: attribute / service name
         :return:
         """
-        return getattr(MethodHelper(self, self.service), name)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        service = self.service
+        # top level methods are cached per service, lower levels depend on the call arguments
+        method = self._methods.get(name)
+        if method is None or method.__self__.service is not service:
+            method = MethodHelper.resolve(self, service, name)
+            self._methods[name] = method
+        return method
 
     @classmethod
     def compute(cls, version="v1"):
         """compute v1 api"""
-        return GoogleApi("compute", version, ["https://www.googleapis.com/auth/compute"])
+        return cls("compute", version, ["https://www.googleapis.com/auth/compute"])
 
     @classmethod
     def drive(cls, version="v3"):
         """drive v3 api"""
-        return GoogleApi("drive", version, ["https://www.googleapis.com/auth/drive"])
+        return cls("drive", version, ["https://www.googleapis.com/auth/drive"])
 
     @classmethod
     def admin_sdk(cls):
         """Admin SDK v1"""
-        return GoogleApi("admin", "directory_v1",
-                         ["https://www.googleapis.com/auth/admin.directory.user"])
+        return cls("admin", "directory_v1",
+                   ["https://www.googleapis.com/auth/admin.directory.user"])
 
     @classmethod
     def gmail(cls, version="v1"):
         """Gmail v1"""
-        return GoogleApi("gmail", version, ["https://mail.google.com/"])
+        return cls("gmail", version, ["https://mail.google.com/"])
 
     @classmethod
     def calendar(cls, version="v3"):
         """calendar v3"""
-        return GoogleApi("calendar", version, ["https://www.googleapis.com/auth/calendar"])
+        return cls("calendar", version, ["https://www.googleapis.com/auth/calendar"])
 
     @classmethod
     def reseller(cls, version="v1"):
         """reseller v1"""
-        return GoogleApi("reseller", version, ["https://www.googleapis.com/auth/apps.order"])
+        return cls("reseller", version, ["https://www.googleapis.com/auth/apps.order"])
 
     @classmethod
     def licensing(cls, version="v1"):
         """license v1"""
-        return GoogleApi("licensing", version, ["https://www.googleapis.com/auth/apps.licensing"])
+        return cls("licensing", version, ["https://www.googleapis.com/auth/apps.licensing"])
 
     @classmethod
     def appengine(cls, version="v1"):
         """analytics v3"""
-        return GoogleApi("appengine", version, ["https://www.googleapis.com/auth/cloud-platform"])
+        return cls("appengine", version, ["https://www.googleapis.com/auth/cloud-platform"])
 
     @classmethod
     def scripts(cls, version="v1"):
         """scripts v1"""
-        return GoogleApi("scripts", version, ["https://www.googleapis.com/auth/userinfo.email"])
+        return cls("scripts", version, ["https://www.googleapis.com/auth/userinfo.email"])
 
     @classmethod
     def cloudbilling(cls, version="v1"):
         """cloudbilling v1"""
-        return GoogleApi("cloudbilling", version,
-                         ["https://www.googleapis.com/auth/cloud-billing"])
+        return cls("cloudbilling", version,
+                   ["https://www.googleapis.com/auth/cloud-billing"])
 
     @classmethod
     def cloudbuild(cls, version="v1"):
         """cloudbuild v1"""
-        return GoogleApi("cloudbuild", version, ["https://www.googleapis.com/auth/cloud-platform"])
+        return cls("cloudbuild", version, ["https://www.googleapis.com/auth/cloud-platform"])
 
     @classmethod
     def dns(cls, version="v1"):
         """dns v1"""
-        return GoogleApi("dns", version,
-                         ["https://www.googleapis.com/auth/ndev.clouddns.readwrite"])
+        return cls("dns", version,
+                   ["https://www.googleapis.com/auth/ndev.clouddns.readwrite"])
 
     @classmethod
     def deploymentmanager(cls, version="v2"):
         """deploymentmanager v2"""
-        return GoogleApi("deploymentmanager", version,
-                         ["https://www.googleapis.com/auth/cloud-platform"])
+        return cls("deploymentmanager", version,
+                   ["https://www.googleapis.com/auth/cloud-platform"])
 
     @classmethod
     def cloudfunctions(cls, version="v1beta2"):
         """cloudfunctions v1beta2"""
-        return GoogleApi("cloudfunctions", version,
-                         ["https://www.googleapis.com/auth/cloudfunctions"])
+        return cls("cloudfunctions", version,
+                   ["https://www.googleapis.com/auth/cloudfunctions"])
 
     @classmethod
     def cloudkms(cls, version="v1"):
         """cloudkms v1"""
-        return GoogleApi("cloudkms", version, ["https://www.googleapis.com/auth/cloudkms"])
+        return cls("cloudkms", version, ["https://www.googleapis.com/auth/cloudkms"])
 
     @classmethod
     def ml(cls, version="v1"):
         """ml v1"""
-        return GoogleApi("ml", version, ["https://www.googleapis.com/auth/cloud-platform"])
+        return cls("ml", version, ["https://www.googleapis.com/auth/cloud-platform"])
 
     @classmethod
     def container(cls, version="v1"):
         """container v1"""
-        return GoogleApi("container", version, ["https://www.googleapis.com/auth/cloud-platform"])
+        return cls("container", version, ["https://www.googleapis.com/auth/cloud-platform"])
 
     @classmethod
     def iam(cls, version="v1"):
         """iam v1"""
-        return GoogleApi("iam", version, ["https://www.googleapis.com/auth/iam"])
+        return cls("iam", version, ["https://www.googleapis.com/auth/iam"])
 
     @classmethod
     def oauth(cls, version="v2"):
         """oauth v2"""
-        return GoogleApi("oauth", version, [
+        return cls("oauth", version, [
             "https://www.googleapis.com/auth/userinfo.email",
             "https://www.googleapis.com/auth/userinfo.profile"
         ])
@@ -309,70 +668,112 @@ class GoogleApi(object):
     @classmethod
     def people(cls, version="v1"):
         """people v1"""
-        return GoogleApi("people", version,
-                         ["email", "profile", "https://www.googleapis.com/auth/contacts"])
+        return cls("people", version,
+                   ["email", "profile", "https://www.googleapis.com/auth/contacts"])
 
     @classmethod
     def sheets(cls, version="v4"):
         """sheets v4"""
-        return GoogleApi("sheets", version, ["https://www.googleapis.com/auth/spreadsheets"])
+        return cls("sheets", version, ["https://www.googleapis.com/auth/spreadsheets"])
 
     @classmethod
     def slides(cls, version="v1"):
         """slides v1"""
-        return GoogleApi("slides", version, ["https://www.googleapis.com/auth/presentations"])
+        return cls("slides", version, ["https://www.googleapis.com/auth/presentations"])
 
     @classmethod
     def plus(cls, version="v1"):
         """plus v1"""
-        return GoogleApi("plus", version, ["email", "profile"])
+        return cls("plus", version, ["email", "profile"])
 
     @classmethod
     def groupssettings(cls, version="v1"):
         """groupssettings v1"""
-        return GoogleApi("groupssettings", version,
-                         ["https://www.googleapis.com/auth/apps.groups.settings"])
+        return cls("groupssettings", version,
+                   ["https://www.googleapis.com/auth/apps.groups.settings"])
 
     @classmethod
     def tasks(cls, version="v1"):
         """tasks v1"""
-        return GoogleApi("tasks", version, ["https://www.googleapis.com/auth/tasks"])
+        return cls("tasks", version, ["https://www.googleapis.com/auth/tasks"])
 
     @classmethod
     def urlshortener(cls, version="v1"):
         """urlshortener v1"""
-        return GoogleApi("urlshortener", version, ["https://www.googleapis.com/auth/urlshortener"])
+        return cls("urlshortener", version, ["https://www.googleapis.com/auth/urlshortener"])
 
     @classmethod
     def youtube(cls, version="v3"):
         """youtube v3"""
-        return GoogleApi("youtube", version, ["https://www.googleapis.com/auth/youtube"])
+        return cls("youtube", version, ["https://www.googleapis.com/auth/youtube"])
+
+
+# api paths known to exist, (api, api_version, discovery_url, path)
+_resolved_methods = set()
 
 
 class MethodHelper(object):
     """ helper to streamline api calls"""
 
-    def __init__(self, google_api, service, name=None, path=None):
+    __slots__ = ("google_api", "service", "name", "path", "calls")
+
+    def __init__(self, google_api, service, name=None, path=(), calls=()):
         """
         create a method helper
         :param google_api GoogleApi instance of api
         :param service Google API service (GoogleApi.service) or method of it
         :param name method name
-        :param path API path i.e. for compute: instances.list
+        :param path API path i.e. for compute: ("instances", "list"), as tuple
+        :param calls resource calls (name, args, kwargs) leading from GoogleApi.service to service
         """
         self.google_api = google_api
         self.service = service
         self.name = name
-        self.path = path if path is not None else []
-        if name is not None:
-            self.path.append(name)
-        # self.log = logging.getLogger("MethodHelper")
-        # self.log.info("constructor %s", name)
-
-    def execute(self, *args, **kwargs):
-        """execute service api"""
+        self.calls = calls
+        if path.__class__ is not tuple:
+            path = tuple(path) if path is not None else ()
+        self.path = path + (name, ) if name is not None else path
+
+    @classmethod
+    def resolve(cls, google_api, service, name, path=(), calls=()):
+        """
+        get a wrapped service method
+
+        existence of the method is only checked once per api path
+
+        :param google_api GoogleApi instance of api
+        :param service Google API service (GoogleApi.service) or method of it
+        :param name method name
+        :param path API path leading to service
+        :param calls resource calls leading to service
+        :return: MethodHelper.call of the method
+        """
+        key = (google_api.api, google_api.api_version, google_api.discovery_url, path, name)
+        if key not in _resolved_methods:
+            if not hasattr(service, name):
+                err_msg = u"API method {} unknown on {} {}".format(u".".join(path + (name, )),
+                                                                   google_api.api,
+                                                                   google_api.api_version)
+                raise RuntimeError(err_msg)
+            _resolved_methods.add(key)
+        return cls(google_api, service, name, path, calls).call
+
+    def execute(self, *args, field_paths=None, **kwargs):
+        """
+        execute service api
+
+        :param field_paths: only request these fields, i.e. ["name", "disks.source"]
+        """
         # self.log.info("execute %s", self.name)
-        return self.google_api.retry(self.service)
+        if field_paths:
+            set_fields(self.service, field_mask(field_paths))
+        return self._retry(self.service)
+
+    def _retry(self, request):
+        """execute a request with retries, using the response cache of the api if configured"""
+        if self.google_api.response_cache is not None:
+            return self.google_api.response_cache.execute(self.google_api, request)
+        return self.google_api.retry(request)
 
     def call(self, *args, **kwargs):
         """
@@ -382,32 +783,175 @@ class MethodHelper(object):
         and will return a MethodHelper instance
         """
         # self.log.info("call %s", self.name)
-        return MethodHelper(self.google_api, getattr(self.service, self.name)(*args, **kwargs))
+        return self.__class__(self.google_api,
+                              getattr(self.service, self.name)(*args, **kwargs),
+                              path=self.path,
+                              calls=self.calls + ((self.name, args, kwargs), ))
 
     def list_all(self, return_element="items", *args, **kwargs):
         """
         list all elements of a type
         make sure you got enough memory to receive all elements
-        pagination (https://developers.google.com/api-client-library/python/guide/pagination)
+        iter_all or pagination
+        (https://developers.google.com/api-client-library/python/guide/pagination)
         should always be preferred over this helper
 
         :param return_element name of the element containing a list of items
         """
+        return list(self.iter_all(return_element, **kwargs))
+
+    def iter_pages(self,
+                   page_token=None,
+                   fields=None,
+                   prefetch=0,
+                   incremental=None,
+                   **kwargs):
+        """
+        list all pages of a type, a page is yielded as soon as it has been received
+
+        the nextPageToken of a page can be stored to resume listing later on.
+        With prefetch the next pages are requested in a background thread (using its own http
+        object) while the current page is processed.
+
+        :param page_token: resume listing at this page token
+        :param fields: partial response fields, nextPageToken is added if missing
+        :param prefetch: number of pages to fetch ahead, 0 to fetch the next page on demand
+        :param incremental: name of the element containing a list of items (i.e. items) to
+            parse element by element, pages are model.IncrementalPage objects then
+        :param kwargs: parameters of the list call, i.e. maxResults
+        """
+        if fields is not None:
+            kwargs["fields"] = page_fields(fields)
+        if page_token is not None:
+            kwargs["pageToken"] = page_token
+        if prefetch and incremental is not None:
+            # the next page request needs the nextPageToken, which is known after the elements
+            raise ValueError("incremental parsing does not support prefetch")
         request = self.service.list(**kwargs)
-        all_elements = []
+        if prefetch:
+            request.http = parallel.thread_http(request.http)
+            return parallel.prefetch(self._pages(request, incremental), prefetch)
+        return self._pages(request, incremental)
+
+    def _pages(self, request, incremental=None):
+        """execute a list request and all following pages"""
+        metrics = self.google_api.metrics
+        if incremental is not None:
+            from .model import IncrementalPage, raw_content
+            # the next page requests are copies and keep the postproc
+            request.postproc = raw_content
         while request is not None:
-            elements = self.google_api.retry(request)
-            all_elements.extend(elements.get(return_element, []))
-            request = self.service.list_next(request, elements)
+            if incremental is None:
+                page = self._retry(request)
+            else:
+                # bypass the response cache, it stores parsed responses
+                page = IncrementalPage(self.google_api.retry(request), incremental)
+            if metrics is not None:
+                metrics.record_page(request)
+            yield page
+            request = self.service.list_next(request, page)
+
+    def iter_all(self,
+                 return_element="items",
+                 page_token=None,
+                 fields=None,
+                 prefetch=0,
+                 field_paths=None,
+                 incremental=False,
+                 **kwargs):
+        """
+        list all elements of a type, elements are yielded page by page as they are received
+
+        :param return_element: name of the element containing a list of items
+        :param page_token: resume listing at this page token
+        :param fields: partial response fields, nextPageToken is added if missing
+        :param prefetch: number of pages to fetch ahead, 0 to fetch the next page on demand
+        :param field_paths: only request these fields of the elements, i.e. ["name", "status"],
+            mutually exclusive with fields
+        :param incremental: parse the elements of a page one by one while they are consumed
+            instead of parsing the whole page at once
+        :param kwargs: parameters of the list call, i.e. maxResults
+        """
+        fields = element_fields(return_element, fields, field_paths)
+        for page in self.iter_pages(page_token, fields, prefetch,
+                                    return_element if incremental else None, **kwargs):
+            for element in page.get(return_element, []):
+                yield element
+
+    def sync(self, return_element=None, full=False, **kwargs):
+        """
+        list the changes since the last sync of this listing
+
+        drive files use drive changes, calendar events and people connections sync tokens,
+        other listings (i.e. admin users) compare the etags of all items. The token of every
+        (api, resource, parameters) is kept in the sync store of the api and only updated
+        when the generator is exhausted. Expired tokens start a full listing.
+
+        i.e. for kind, event in calendar.events().sync(calendarId="primary")
+
+        :param return_element: name of the element containing a list of items, for listings
+            synced by etags
+        :param full: ignore the stored token and list everything
+        :param kwargs: parameters of the list call
+        :return: generator of (kind, item), kind is sync.CHANGED or sync.DELETED. A full listing
+            starts with (sync.RESET, None), all earlier synced items are obsolete then.
+        """
+        from .sync import TokenStore, sync
+        store = self.google_api.sync_store
+        if store is None:
+            store = TokenStore(os.path.join(self.google_api.cache_dir, "sync_tokens.json"))
+        return sync(self, store, return_element, full, **kwargs)
+
+    def bind(self, google_api):
+        """
+        repeat the resource calls of this helper on another GoogleApi, i.e. a clone
+
+        :param google_api: GoogleApi to use
+        :return: MethodHelper
+        """
+        service = google_api.service
+        for name, args, kwargs in self.calls:
+            service = getattr(service, name)(*args, **kwargs)
+        return self.__class__(google_api, service, path=self.path, calls=self.calls)
+
+    def map_list_all(self, param_grid, return_element="items", workers=8, raise_errors=True,
+                     **kwargs):
+        """
+        run list_all for many parameter sets concurrently
+
+        every worker thread uses its own clone of the GoogleApi (and therefore its own http
+        object). The number of concurrent calls per api is limited by
+        parallel.API_CONCURRENCY for the whole process.
 
-        return all_elements
+        i.e. compute.instances().map_list_all([{"project": p, "zone": z} for p, z in zones])
+
+        :param param_grid: iterable of dicts with parameters of the list call
+        :param return_element: name of the element containing a list of items
+        :param workers: number of worker threads
+        :param raise_errors: raise the first failed listing, otherwise its exception is yielded
+        :param kwargs: parameters used for all list calls
+        :return: generator of (params, items) in order of completion
+        """
+        semaphore = parallel.api_semaphore(self.google_api.api)
+        local = threading.local()
+
+        def list_all(params):
+            """list all elements of one parameter set on the thread's api clone"""
+            if not hasattr(local, "helper"):
+                local.helper = self.bind(self.google_api.clone())
+            arguments = dict(kwargs)
+            arguments.update(params)
+            with semaphore:
+                return local.helper.list_all(return_element, **arguments)
+
+        for params, future in parallel.map_unordered(list_all, param_grid, workers):
+            error = future.exception()
+            if error is not None and raise_errors:
+                raise error
+            yield params, error if error is not None else future.result()
 
     def __getattr__(self, name):
         """ get service method """
-        # self.log.info("getattr %s", name)
-        if not hasattr(self.service, name):
-            err_msg = u"API method {} unknown on {} {}".format(u".".join(self.path + [name]),
-                                                               self.google_api.api,
-                                                               self.google_api.api_version)
-            raise RuntimeError(err_msg)
-        return MethodHelper(self.google_api, self.service, name, self.path).call
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.resolve(self.google_api, self.service, name, self.path, self.calls)
@@ -0,0 +1,167 @@
+""" multi process bulk execution of api calls with checkpointing """
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
+from . import parallel
+from .ratelimit import RateLimiter
+
+# GoogleApi of the current worker process
+_worker_api = None
+
+
+def _init_worker(api_factory, rate_limiter):
+    """create the GoogleApi of a worker process"""
+    global _worker_api
+    _worker_api = api_factory()
+    if rate_limiter is not None:
+        _worker_api.with_rate_limiter(rate_limiter)
+
+
+def _run_item(item):
+    """execute one work item in a worker process"""
+    subject, method, params = item
+    google_api = _worker_api.delegate(subject) if subject else _worker_api
+    names = method.split(".")
+    resource = google_api
+    for name in names[:-1]:
+        resource = getattr(resource, name)()
+    return getattr(resource, names[-1])(**(params or {})).execute()
+
+
+def item_key(item):
+    """
+    key of a work item in the checkpoint
+
+    :param item: tuple (subject, method, params)
+    :return: string
+    """
+    subject, method, params = item
+    return json.dumps([subject, method, params], sort_keys=True)
+
+
+class BulkRunner(object):
+    """
+    execute many api calls on a pool of processes
+
+    a work item is a tuple (subject, method, params), i.e.
+    ("user@example.com", "users.settings.filters.create", {"userId": "me", "body": {...}}).
+    The method is called on api_factory().delegate(subject), or on the api itself if subject
+    is None. Every process creates its own GoogleApi (and therefore its own service and
+    credentials) with api_factory, which must be picklable, i.e. a module level function.
+
+    Finished items are appended to a checkpoint file, so a crashed or interrupted run skips
+    them when it is started again with the same checkpoint. Items in flight during a crash are
+    executed again, so calls should be idempotent.
+    """
+
+    def __init__(self,
+                 api_factory,
+                 checkpoint_file,
+                 processes=None,
+                 rate_limiter=None,
+                 retry_errors=False):
+        """
+        create a bulk runner
+
+        :param api_factory: picklable function returning the GoogleApi of a worker process
+        :param checkpoint_file: file recording finished items
+        :param processes: number of worker processes, defaults to the number of cpus
+        :param rate_limiter: ratelimit.RateLimiter shared by all processes. A limiter without
+            state_dir gets a temporary one, so the rate limit is global.
+        :param retry_errors: run failed items of an earlier run again
+        """
+        self.api_factory = api_factory
+        self.checkpoint_file = checkpoint_file
+        self.processes = processes or os.cpu_count() or 1
+        self.rate_limiter = rate_limiter
+        self.retry_errors = retry_errors
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.log = logging.getLogger("GoogleApi")
+
+    def finished(self):
+        """
+        read the checkpoint
+
+        :return: dict item key -> error message or None for successful items
+        """
+        finished = {}
+        if not os.path.isfile(self.checkpoint_file):
+            return finished
+        with open(self.checkpoint_file) as checkpoint:
+            for line in checkpoint:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a crashed run may be incomplete
+                    continue
+                finished[entry["key"]] = entry.get("error")
+        return finished
+
+    def run(self, items, raise_errors=False):
+        """
+        execute all items which are not finished according to the checkpoint
+
+        :param items: iterable of (subject, method, params)
+        :param raise_errors: raise the first failed item, otherwise its exception is yielded
+        :return: generator of (item, result or exception) in order of completion
+        """
+        finished = self.finished()
+
+        def pending():
+            """items to execute"""
+            for item in items:
+                key = item_key(item)
+                if key in finished and (finished[key] is None or not self.retry_errors):
+                    self.skipped += 1
+                    continue
+                yield item
+
+        rate_limiter = self.rate_limiter
+        state_dir = None
+        if rate_limiter is not None and rate_limiter.state_dir is None:
+            state_dir = tempfile.mkdtemp(prefix="googleapi-ratelimit")
+            rate_limiter = RateLimiter(rate_limiter.rate, rate_limiter.capacity, rate_limiter.key,
+                                       state_dir)
+
+        checkpoint_dir = os.path.dirname(os.path.abspath(self.checkpoint_file))
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        try:
+            with open(self.checkpoint_file, "a") as checkpoint, ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.api_factory, rate_limiter)) as executor:
+                for item, future in parallel.submit_unordered(executor, _run_item, pending(),
+                                                              2 * self.processes):
+                    error = future.exception()
+                    entry = {"key": item_key(item), "error": None}
+                    if error is None:
+                        self.done += 1
+                    else:
+                        self.failed += 1
+                        entry["error"] = "{}: {}".format(type(error).__name__, error)
+                        self.log.warning("%s %s failed: %s", item[0], item[1], error)
+                    checkpoint.write(json.dumps(entry) + "\n")
+                    checkpoint.flush()
+                    if error is not None and raise_errors:
+                        raise error
+                    yield item, error if error is not None else future.result()
+        finally:
+            if state_dir is not None:
+                shutil.rmtree(state_dir, ignore_errors=True)
+
+    def stats(self):
+        """
+        run statistics
+
+        :return: dict with done, failed and skipped items
+        """
+        return {"done": self.done, "failed": self.failed, "skipped": self.skipped}
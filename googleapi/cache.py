@@ -0,0 +1,354 @@
+""" caches used by the Google API helper """
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient import errors
+from googleapiclient.discovery_cache.base import Cache
+
+
+def atomic_write(file_name, content):
+    """
+    write content to a file atomically
+
+    the content is written to a temporary file in the same directory and renamed afterwards,
+    so concurrent readers (also in other processes) never see a partially written file
+
+    :param file_name: target file
+    :param content: text or bytes to write
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    handle, tmp_name = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        if isinstance(content, bytes):
+            tmp_file = os.fdopen(handle, "wb")
+        else:
+            tmp_file = os.fdopen(handle, "w", encoding="utf-8")
+        with tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+class LRUCache(object):
+    """
+    thread safe least recently used cache with optional time to live and disk tier
+
+    entries are kept in memory up to max_entries. If a cache_dir is given, values (which must be
+    strings) are also written to disk, so other processes and later runs can pick them up.
+    """
+
+    def __init__(self, max_entries=128, ttl=None, cache_dir=None):
+        """
+        create a cache
+
+        :param max_entries: maximum number of entries kept in memory
+        :param ttl: seconds an entry stays valid, None for no expiry
+        :param cache_dir: directory for the on disk tier, None to only cache in memory
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, timestamp):
+        """check if an entry stored at timestamp is expired"""
+        return self.ttl is not None and time.time() - timestamp > self.ttl
+
+    def _file_name(self, key):
+        """file name of the disk entry for key"""
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest)
+
+    def _read_disk(self, key):
+        """read an entry from the disk tier, returns (timestamp, value) or None"""
+        if self.cache_dir is None:
+            return None
+        file_name = self._file_name(key)
+        try:
+            timestamp = os.path.getmtime(file_name)
+            if self._expired(timestamp):
+                return None
+            with open(file_name, encoding="utf-8") as cache_file:
+                return timestamp, cache_file.read()
+        except (IOError, OSError):
+            return None
+
+    def _store(self, key, timestamp, value):
+        """store an entry in memory and evict the least recently used ones, lock must be held"""
+        self._entries[key] = (timestamp, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """
+        get a value from the cache
+
+        :param key: cache key
+        :return: cached value or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._store(key, entry[0], entry[1])
+            self.hits += 1
+            self.disk_hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        """
+        put a value into the cache
+
+        :param key: cache key
+        :param value: value, needs to be a string if a cache_dir is used
+        """
+        with self._lock:
+            self._store(key, time.time(), value)
+        if self.cache_dir is not None:
+            try:
+                atomic_write(self._file_name(key), value)
+            except (IOError, OSError) as error:
+                # the memory tier still works, so a read only disk should not fail the call
+                logging.getLogger("GoogleApi").warning("failed to write cache entry: %s", error)
+
+    def delete(self, key):
+        """remove an entry from memory and disk"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.cache_dir is not None:
+            try:
+                os.remove(self._file_name(key))
+            except (IOError, OSError):
+                pass
+
+    def clear(self):
+        """remove all entries from memory, the disk tier is left untouched"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        cache statistics
+
+        :return: dict with hits, misses, disk_hits, evictions and size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+
+class MemoryCache(LRUCache, Cache):
+    """ discovery document cache, in memory and optionally on disk """
+
+    def __init__(self, max_entries=64, ttl=24 * 60 * 60, cache_dir=None):
+        """
+        create a discovery document cache
+
+        :param max_entries: maximum number of discovery documents kept in memory
+        :param ttl: seconds a discovery document stays valid, defaults to one day
+        :param cache_dir: directory to share discovery documents between processes
+        """
+        super(MemoryCache, self).__init__(max_entries, ttl, cache_dir)
+
+
+_directory_caches = {}
+_directory_caches_lock = threading.Lock()
+
+
+def directory_cache(cache_dir, **kwargs):
+    """
+    get the discovery cache persisted in cache_dir
+
+    all callers using the same directory share one memory tier
+
+    :param cache_dir: directory of the on disk tier
+    :param kwargs: additional arguments for MemoryCache if the cache is created
+    :return: MemoryCache
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    with _directory_caches_lock:
+        if cache_dir not in _directory_caches:
+            _directory_caches[cache_dir] = MemoryCache(cache_dir=cache_dir, **kwargs)
+        return _directory_caches[cache_dir]
+
+
+def credential_identity(credentials):
+    """
+    identity of the principal of credentials, i.e. the service account email and scopes
+
+    :param credentials: google.auth credentials or None
+    :return: string, None if the principal is unknown
+    """
+    if credentials is None:
+        return None
+    if isinstance(credentials, AnonymousCredentials):
+        return "anonymous"
+    email = getattr(credentials, "service_account_email", None) or getattr(
+        credentials, "signer_email", None)
+    if email:
+        identity = [email]
+    else:
+        # oauth user credentials
+        refresh_token = getattr(credentials, "refresh_token", None)
+        if not refresh_token:
+            return None
+        identity = [getattr(credentials, "client_id", None),
+                    hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()]
+    return json.dumps(identity + sorted(getattr(credentials, "scopes", None) or ()))
+
+
+class ResponseCache(object):
+    """
+    cache of GET responses, revalidated with ETags
+
+    a cached response is returned without a request for ttl seconds. Afterwards the request is
+    sent with If-None-Match, so an unchanged resource is answered with 304 Not Modified and no
+    body. Responses are cached per api, principal of the credentials, user and request url,
+    requests with credentials of an unknown principal are not cached.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60, cache_dir=None):
+        """
+        create a response cache
+
+        :param max_entries: maximum number of responses kept in memory
+        :param ttl: seconds a response is used without revalidation
+        :param cache_dir: directory to persist responses, None to keep them in memory only
+        """
+        self.ttl = ttl
+        self.store = LRUCache(max_entries, cache_dir=cache_dir)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(google_api, request):
+        """
+        cache key of a request
+
+        :param google_api: GoogleApi executing the request
+        :param request: googleapiclient.http.HttpRequest
+        :return: string, None if the request must not be cached
+        """
+        credentials = google_api.credentials
+        if credentials is None:
+            # application default credentials or credentials of a pooled http
+            credentials = getattr(request.http, "credentials", None)
+        identity = credential_identity(credentials)
+        if identity is None:
+            return None
+        return json.dumps(
+            [google_api.api, google_api.api_version, identity, google_api.sub, request.method,
+             request.uri])
+
+    def _count(self, counter, size=0):
+        """increment a counter and the bytes saved"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.bytes_saved += size
+
+    def execute(self, google_api, request):
+        """
+        execute a request with google_api.retry or answer it from the cache
+
+        :param google_api: GoogleApi executing the request
+        :param request: googleapiclient.http.HttpRequest
+        :return: deserialized response
+        """
+        if request.method != "GET":
+            return google_api.retry(request)
+
+        key = self.key(google_api, request)
+        if key is None:
+            return google_api.retry(request)
+        entry = self.store.get(key)
+        entry = json.loads(entry) if entry is not None else None
+        if entry is not None and time.time() - entry["time"] <= self.ttl:
+            self._count("hits", entry["size"])
+            return json.loads(entry["body"])
+
+        # list_next copies the executed request shallowly for the next page, so the etag and
+        # callback are only set on copies of the headers and callbacks during this request
+        headers, callbacks = request.headers, request.response_callbacks
+        request.headers = dict(headers)
+        request.response_callbacks = list(callbacks)
+        response_headers = {}
+        request.add_response_callback(response_headers.update)
+        if entry is not None and entry.get("etag"):
+            request.headers["If-None-Match"] = entry["etag"]
+        try:
+            response = google_api.retry(request)
+        except errors.HttpError as error:
+            if entry is None or error.resp.status != 304:
+                raise
+            self._count("revalidated", entry["size"])
+            entry["time"] = time.time()
+            self.store.set(key, json.dumps(entry))
+            return json.loads(entry["body"])
+        finally:
+            request.headers, request.response_callbacks = headers, callbacks
+
+        self._count("misses")
+        body = json.dumps(response)
+        self.store.set(
+            key,
+            json.dumps({
+                "time": time.time(),
+                "etag": response_headers.get("etag"),
+                "size": len(body),
+                "body": body
+            }))
+        return response
+
+    def stats(self):
+        """
+        cache statistics
+
+        :return: dict with hits, revalidated, misses, hit_ratio and bytes_saved
+        """
+        with self._lock:
+            lookups = self.hits + self.revalidated + self.misses
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_ratio": float(self.hits + self.revalidated) / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+            }
@@ -0,0 +1,267 @@
+""" credential and access token cache for service accounts """
+
+import atexit
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .cache import atomic_write
+
+
+class CredentialCache(object):
+    """
+    thread safe cache of service account credentials
+
+    credentials are cached per (service account, scopes, subject), so delegating to the same
+    user again reuses the access token instead of signing a new JWT and exchanging it. Key files
+    are parsed once. A background thread refreshes tokens of credentials which authorized a
+    request within max_idle seconds shortly before they expire and, if a cache_dir is given,
+    persists them so they survive process restarts. Tokens are persisted at exit too.
+    """
+
+    def __init__(self,
+                 max_entries=10000,
+                 refresh_margin=300,
+                 refresh_interval=30,
+                 cache_dir=None,
+                 background_refresh=True,
+                 max_idle=600):
+        """
+        create a credential cache
+
+        :param max_entries: maximum number of cached credentials, least recently used are evicted
+        :param refresh_margin: seconds before expiry a token is refreshed
+        :param refresh_interval: seconds between checks of the background refresh
+        :param cache_dir: directory to persist access tokens, None to keep them in memory only
+        :param background_refresh: refresh used tokens in a background thread
+        :param max_idle: seconds since the last request a token is kept fresh, well below the
+            token lifetime, otherwise credentials used once are refreshed once more
+        """
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval
+        self.cache_dir = cache_dir
+        self.background_refresh = background_refresh
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.log = logging.getLogger("GoogleApi")
+        self._entries = collections.OrderedDict()
+        self._used = {}
+        self._persisted = {}
+        self._files = {}
+        self._signers = {}
+        self._lock = threading.RLock()
+        self._refresher = None
+        self._exit_hook = False
+        self._stopped = threading.Event()
+
+    def service_account_file(self, file_name, scopes=None, subject=None):
+        """
+        get credentials of a service account key file
+
+        :param file_name: service account json key file
+        :param scopes: scopes to authorize
+        :param subject: user to impersonate (domain wide delegation)
+        :return: google.oauth2.service_account.Credentials
+        """
+        mtime = os.path.getmtime(file_name)
+        with self._lock:
+            cached = self._files.get(file_name)
+        if cached is None or cached[0] != mtime:
+            with open(file_name) as json_file:
+                cached = (mtime, json.load(json_file))
+            with self._lock:
+                self._files[file_name] = cached
+        return self.service_account(cached[1], scopes, subject)
+
+    def service_account(self, info, scopes=None, subject=None):
+        """
+        get credentials of service account info
+
+        :param info: service account key as dict
+        :param scopes: scopes to authorize
+        :param subject: user to impersonate (domain wide delegation)
+        :return: google.oauth2.service_account.Credentials
+        """
+        key = (info["client_email"], info.get("private_key_id"), tuple(sorted(scopes or ())),
+               subject)
+
+        def create():
+            """parse the private key once per key id and derive scoped credentials"""
+            signer_key = (info["client_email"], info.get("private_key_id"))
+            with self._lock:
+                base = self._signers.get(signer_key)
+            if base is None:
+                from google.oauth2 import service_account
+                base = service_account.Credentials.from_service_account_info(info)
+                with self._lock:
+                    self._signers[signer_key] = base
+            credentials = base.with_scopes(list(scopes)) if scopes else base
+            return credentials.with_subject(subject) if subject else credentials
+
+        return self._get(key, create)
+
+    def delegated(self, credentials, subject):
+        """
+        get credentials delegated to a user
+
+        :param credentials: service account credentials
+        :param subject: user to impersonate
+        :return: google.oauth2.service_account.Credentials
+        """
+        key_id = getattr(getattr(credentials, "signer", None), "key_id", None)
+        key = (credentials.service_account_email, key_id, tuple(sorted(credentials.scopes or ())),
+               subject)
+        return self._get(key, lambda: credentials.with_subject(subject))
+
+    def _get(self, key, create):
+        """get cached credentials or create them"""
+        with self._lock:
+            credentials = self._entries.get(key)
+            if credentials is not None:
+                self._entries.move_to_end(key)
+                self._used[key] = time.time()
+                self.hits += 1
+                return credentials
+            self.misses += 1
+
+        credentials = create()
+        self._load_token(key, credentials)
+        with self._lock:
+            # keep the credentials of a concurrent caller, they may already hold a token
+            created = credentials
+            credentials = self._entries.setdefault(key, credentials)
+            if credentials is created:
+                self._track(key, credentials)
+            self._entries.move_to_end(key)
+            self._used[key] = time.time()
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._persisted.pop(evicted, None)
+                self._used.pop(evicted, None)
+            if self.cache_dir is not None and not self._exit_hook:
+                atexit.register(self.persist)
+                self._exit_hook = True
+            if self.background_refresh and self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop,
+                                                   name="googleapi-credential-refresh",
+                                                   daemon=True)
+                self._refresher.start()
+        return credentials
+
+    def _track(self, key, credentials):
+        """record the last use of credentials whenever they authorize a request"""
+        apply = getattr(credentials, "apply", None)
+        if apply is None:
+            return
+
+        def tracked_apply(*args, **kwargs):
+            """apply the token and record the use"""
+            if key in self._entries:
+                self._used[key] = time.time()
+            return apply(*args, **kwargs)
+
+        credentials.apply = tracked_apply
+
+    def _file_name(self, key):
+        """file name of a persisted token"""
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".json")
+
+    def _expires_soon(self, credentials):
+        """check if a token expires within the refresh margin"""
+        if credentials.expiry is None:
+            return False
+        remaining = credentials.expiry - datetime.datetime.utcnow()
+        return remaining.total_seconds() < self.refresh_margin
+
+    def _load_token(self, key, credentials):
+        """load a persisted, not yet expiring access token into credentials"""
+        if self.cache_dir is None:
+            return
+        try:
+            with open(self._file_name(key)) as token_file:
+                data = json.load(token_file)
+            credentials.token = data["token"]
+            credentials.expiry = datetime.datetime.strptime(data["expiry"],
+                                                            "%Y-%m-%dT%H:%M:%S")
+        except (IOError, OSError, ValueError, KeyError):
+            return
+        if self._expires_soon(credentials):
+            credentials.token = None
+            credentials.expiry = None
+        else:
+            self._persisted[key] = credentials.token
+
+    def persist(self):
+        """write all access tokens changed since the last call to cache_dir"""
+        if self.cache_dir is None:
+            return
+        with self._lock:
+            entries = list(self._entries.items())
+        for key, credentials in entries:
+            token, expiry = credentials.token, credentials.expiry
+            if not token or expiry is None or self._persisted.get(key) == token:
+                continue
+            atomic_write(self._file_name(key),
+                         json.dumps({
+                             "token": token,
+                             "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%S")
+                         }))
+            self._persisted[key] = token
+
+    def refresh_expiring(self):
+        """refresh tokens used within max_idle seconds and expiring within the refresh margin"""
+        used_since = time.time() - self.max_idle
+        with self._lock:
+            entries = [credentials for key, credentials in self._entries.items()
+                       if self._used.get(key, 0) >= used_since]
+        import google_auth_httplib2
+        from googleapiclient.http import build_http
+        request = google_auth_httplib2.Request(build_http())
+        for credentials in entries:
+            if credentials.token and self._expires_soon(credentials):
+                try:
+                    credentials.refresh(request)
+                    with self._lock:
+                        self.refreshes += 1
+                except Exception as error:  # noqa
+                    self.log.warning("failed to refresh credentials: %s", error)
+        self.persist()
+
+    def _refresh_loop(self):
+        """background refresh"""
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh_expiring()
+            except Exception:  # noqa
+                self.log.exception("credential refresh failed")
+
+    def stop(self):
+        """stop the background refresh and persist the tokens"""
+        self._stopped.set()
+        self.persist()
+
+    def stats(self):
+        """
+        cache statistics
+
+        :return: dict with hits, misses, refreshes and size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "size": len(self._entries),
+            }
+
+
+credential_cache = CredentialCache()
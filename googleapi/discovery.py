@@ -0,0 +1,275 @@
+""" discovery document handling and the process wide service registry """
+
+import gzip
+import json
+import os
+import threading
+
+from .cache import atomic_write
+
+# same as googleapiclient.discovery.DISCOVERY_URI, which is expensive to import
+DISCOVERY_URI = "https://www.googleapis.com/discovery/v1/apis/{api}/{apiVersion}/rest"
+
+# environment variable with the directory of the discovery store used by default
+DISCOVERY_STORE_ENV = "GOOGLEAPI_DISCOVERY_STORE"
+
+
+def discovery_document_url(api, api_version, discovery_url):
+    """
+    expand the discovery url template for an api
+
+    :param api: api name i.e. compute
+    :param api_version: api version i.e. v1
+    :param discovery_url: discovery url template containing {api} and {apiVersion}
+    :return: url of the discovery document
+    """
+    import uritemplate
+    return uritemplate.expand(discovery_url, {"api": api, "apiVersion": api_version})
+
+
+def fetch_discovery_document(api, api_version, discovery_url, cache=None, http=None):
+    """
+    get a discovery document from the cache or the network
+
+    :param api: api name i.e. compute
+    :param api_version: api version i.e. v1
+    :param discovery_url: discovery url template containing {api} and {apiVersion}
+    :param cache: discovery cache (googleapiclient.discovery_cache.base.Cache)
+    :param http: http object used to fetch the document
+    :return: discovery document as string
+    """
+    url = discovery_document_url(api, api_version, discovery_url)
+    content = cache.get(url) if cache is not None else None
+    if content:
+        return content
+
+    from googleapiclient.http import HttpRequest, build_http
+    discovery_http = http if http is not None else build_http()
+    try:
+        _, content = HttpRequest(discovery_http, HttpRequest.null_postproc, url).execute()
+    finally:
+        if http is None:
+            discovery_http.close()
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    if cache is not None:
+        cache.set(url, content)
+    return content
+
+
+class DiscoveryStore(object):
+    """
+    local store of discovery documents
+
+    every (api, api_version) is kept as a compact, gzip compressed json file in one directory.
+    Services of apis in the store are built without any network access, so the store can be
+    created ahead of time (see googleapi.prewarm) and shipped with an application.
+    """
+
+    def __init__(self, path):
+        """
+        create a store
+
+        :param path: directory of the store
+        """
+        self.path = path
+
+    def file_name(self, api, api_version):
+        """
+        file of a discovery document
+
+        :param api: api name i.e. compute
+        :param api_version: api version i.e. v1
+        :return: file name
+        """
+        return os.path.join(self.path, "{}.{}.json.gz".format(api, api_version))
+
+    def get(self, api, api_version):
+        """
+        read a discovery document
+
+        :param api: api name i.e. compute
+        :param api_version: api version i.e. v1
+        :return: discovery document as string or None if it is not in the store
+        """
+        try:
+            with gzip.open(self.file_name(api, api_version), "rb") as document_file:
+                return document_file.read().decode("utf-8")
+        except (IOError, OSError):
+            return None
+
+    def set(self, api, api_version, content):
+        """
+        add or replace a discovery document
+
+        :param api: api name i.e. compute
+        :param api_version: api version i.e. v1
+        :param content: discovery document as string
+        :return: file name of the document
+        """
+        compact = json.dumps(json.loads(content), separators=(",", ":"), sort_keys=True)
+        file_name = self.file_name(api, api_version)
+        # mtime=0 keeps the files reproducible
+        atomic_write(file_name, gzip.compress(compact.encode("utf-8"), mtime=0))
+        return file_name
+
+    def snapshot(self, apis, discovery_url=DISCOVERY_URI, static=False, http=None):
+        """
+        add the current discovery documents of apis to the store
+
+        :param apis: list of (api, api_version)
+        :param discovery_url: discovery url template to fetch the documents from
+        :param static: use the documents bundled with googleapiclient instead of fetching them
+        :param http: http object used to fetch the documents
+        :return: list of file names
+        """
+        file_names = []
+        for api, api_version in apis:
+            if static:
+                from googleapiclient.discovery_cache import get_static_doc
+                content = get_static_doc(api, api_version)
+                if content is None:
+                    raise ValueError("no bundled discovery document for {} {}".format(
+                        api, api_version))
+            else:
+                content = fetch_discovery_document(api, api_version, discovery_url, http=http)
+            file_names.append(self.set(api, api_version, content))
+        return file_names
+
+    def apis(self):
+        """
+        list the stored apis
+
+        :return: sorted list of (api, api_version)
+        """
+        if not os.path.isdir(self.path):
+            return []
+        apis = []
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".json.gz"):
+                api, _, api_version = file_name[:-len(".json.gz")].partition(".")
+                apis.append((api, api_version))
+        return sorted(apis)
+
+
+_discovery_stores = {}
+_discovery_stores_lock = threading.Lock()
+
+
+def default_discovery_store():
+    """
+    get the discovery store configured by the GOOGLEAPI_DISCOVERY_STORE environment variable
+
+    :return: DiscoveryStore or None if the variable is not set
+    """
+    path = os.environ.get(DISCOVERY_STORE_ENV)
+    if not path:
+        return None
+    with _discovery_stores_lock:
+        if path not in _discovery_stores:
+            _discovery_stores[path] = DiscoveryStore(path)
+        return _discovery_stores[path]
+
+
+class ServiceRegistry(object):
+    """
+    process wide registry of parsed discovery documents
+
+    parsing a discovery document is the expensive part of googleapiclient.discovery.build.
+    The registry parses every (api, api_version, discovery_url) once and binds the parsed
+    document to the http transport of each GoogleApi instance.
+    """
+
+    def __init__(self):
+        """create an empty registry"""
+        self.parsed = 0
+        self.reused = 0
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def document(self, api, api_version, discovery_url, cache=None, store=None, http=None):
+        """
+        get the parsed discovery document
+
+        :param api: api name i.e. compute
+        :param api_version: api version i.e. v1
+        :param discovery_url: discovery url template
+        :param cache: discovery cache used if the document has not been parsed yet
+        :param store: DiscoveryStore read before the cache and the network
+        :param http: http object used to fetch the document
+        :return: discovery document as dict
+        """
+        key = (api, api_version, discovery_url)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self.reused += 1
+                return document
+
+        content = store.get(api, api_version) if store is not None else None
+        if content is None:
+            content = fetch_discovery_document(api, api_version, discovery_url, cache, http)
+        document = json.loads(content)
+        with self._lock:
+            # another thread may have parsed the document in the meantime, keep the first one
+            if key not in self._documents:
+                self._documents[key] = document
+                self.parsed += 1
+            return self._documents[key]
+
+    def build(self,
+              api,
+              api_version,
+              discovery_url,
+              cache=None,
+              credentials=None,
+              http=None,
+              store=None,
+              model=None,
+              discovery_http=None):
+        """
+        build a service from the parsed discovery document
+
+        :param api: api name i.e. compute
+        :param api_version: api version i.e. v1
+        :param discovery_url: discovery url template
+        :param cache: discovery cache used if the document has not been parsed yet
+        :param credentials: credentials of the service, mutually exclusive with http
+        :param http: http transport of the service
+        :param store: DiscoveryStore read before the cache and the network
+        :param model: response model (googleapiclient.model.Model), defaults to
+            model.FastJsonModel
+        :param discovery_http: http object used to fetch the discovery document
+        :return: googleapiclient resource
+        """
+        from googleapiclient.discovery import build_from_document
+        from .model import FastJsonModel
+        document = self.document(api, api_version, discovery_url, cache, store, discovery_http)
+        if model is None:
+            model = FastJsonModel("dataWrapper" in document.get("features", []))
+        return build_from_document(document,
+                                   base=discovery_url,
+                                   credentials=credentials,
+                                   http=http,
+                                   model=model)
+
+    def clear(self):
+        """forget all parsed documents"""
+        with self._lock:
+            self._documents.clear()
+
+    def stats(self):
+        """
+        registry statistics
+
+        :return: dict with number of documents, parsed and reused
+        """
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "parsed": self.parsed,
+                "reused": self.reused
+            }
+
+
+service_registry = ServiceRegistry()
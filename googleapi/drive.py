@@ -0,0 +1,236 @@
+""" resumable, chunked and parallel file transfers for the drive api """
+
+import mimetypes
+import mmap
+import os
+import threading
+
+from googleapiclient.http import MediaInMemoryUpload, MediaUpload
+
+from . import parallel
+
+# resumable upload chunks must be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+DEFAULT_CHUNK_SIZE = 32 * CHUNK_GRANULARITY
+
+
+class MmapUpload(MediaUpload):
+    """
+    resumable upload of a memory mapped file
+
+    chunks are sliced from the mapping, so only the chunk being sent is copied into memory
+    """
+
+    def __init__(self, file_name, mimetype=None, chunksize=DEFAULT_CHUNK_SIZE):
+        """
+        map a file
+
+        :param file_name: file to upload, must not be empty
+        :param mimetype: mime type, guessed from the file name if None
+        :param chunksize: bytes per request, a multiple of 256 KiB
+        """
+        if chunksize % CHUNK_GRANULARITY:
+            raise ValueError("chunksize must be a multiple of {}".format(CHUNK_GRANULARITY))
+        self._file_name = file_name
+        self._mimetype = mimetype or mimetypes.guess_type(file_name)[0] or \
+            "application/octet-stream"
+        self._chunksize = chunksize
+        with open(file_name, "rb") as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunksize(self):
+        """bytes per request"""
+        return self._chunksize
+
+    def mimetype(self):
+        """mime type of the file"""
+        return self._mimetype
+
+    def size(self):
+        """size of the file"""
+        return len(self._map)
+
+    def resumable(self):
+        """always resumable"""
+        return True
+
+    def getbytes(self, begin, length):
+        """get a chunk of the file"""
+        return self._map[begin:begin + length]
+
+    def close(self):
+        """unmap the file"""
+        self._map.close()
+
+
+class _UploadChunk(object):
+    """resumable upload request sending one chunk per execute, for GoogleApi.retry"""
+
+    def __init__(self, request):
+        self.request = request
+        self.uri = request.uri
+        self.methodId = request.methodId
+        self.postproc = request.postproc
+
+    def execute(self):
+        """send the next chunk, after a failed chunk next_chunk resumes at the server's offset"""
+        return self.request.next_chunk()
+
+
+def _pwrite(handle, data, offset, lock):
+    """write data at offset"""
+    if hasattr(os, "pwrite"):
+        os.pwrite(handle, data, offset)
+        return
+    with lock:
+        os.lseek(handle, offset, os.SEEK_SET)
+        os.write(handle, data)
+
+
+class DriveTransfer(object):
+    """
+    upload and download files with the drive api
+
+    uploads are resumable and send chunks of memory mapped files, downloads fetch byte ranges
+    in parallel and write them directly to their position in the target file. Every chunk is
+    sent through GoogleApi.retry, so failed chunks are retried according to the retry policy
+    and the rate limiter of the api applies. upload_files and download_files transfer many
+    files concurrently.
+    """
+
+    def __init__(self, google_api, chunk_size=DEFAULT_CHUNK_SIZE, range_workers=4, workers=4):
+        """
+        create a transfer helper
+
+        :param google_api: GoogleApi of the drive api (v3), i.e. GoogleApi.drive()
+        :param chunk_size: bytes per upload chunk or download range, a multiple of 256 KiB
+        :param range_workers: concurrent ranges per download
+        :param workers: concurrent files of upload_files and download_files
+        """
+        if chunk_size % CHUNK_GRANULARITY:
+            raise ValueError("chunk_size must be a multiple of {}".format(CHUNK_GRANULARITY))
+        self.google_api = google_api
+        self.chunk_size = chunk_size
+        self.range_workers = range_workers
+        self.workers = workers
+
+    def upload(self, file_name, metadata=None, mimetype=None, file_id=None, **kwargs):
+        """
+        upload a file with a resumable upload
+
+        :param file_name: local file
+        :param metadata: file resource, defaults to the name of the local file
+        :param mimetype: mime type of the content, guessed from the file name if None
+        :param file_id: update the content of this file instead of creating a new file
+        :param kwargs: additional parameters of files.create or files.update, i.e. fields
+        :return: file resource
+        """
+        if metadata is None and file_id is None:
+            metadata = {"name": os.path.basename(file_name)}
+        if os.path.getsize(file_name) == 0:
+            # an empty file can not be mapped and has no chunks
+            media = MediaInMemoryUpload(b"", mimetype or "application/octet-stream")
+        else:
+            media = MmapUpload(file_name, mimetype, self.chunk_size)
+        files = self.google_api.service.files()
+        try:
+            if file_id is None:
+                request = files.create(body=metadata, media_body=media, **kwargs)
+            else:
+                request = files.update(fileId=file_id, body=metadata, media_body=media, **kwargs)
+            if not media.resumable():
+                return self.google_api.retry(request)
+            response = None
+            while response is None:
+                _, response = self.google_api.retry(_UploadChunk(request))
+            return response
+        finally:
+            if isinstance(media, MmapUpload):
+                media.close()
+
+    def download(self, file_id, file_name, size=None):
+        """
+        download the content of a file
+
+        the file is written to file_name + ".part" and renamed when it is complete
+
+        :param file_id: drive file id
+        :param file_name: local file
+        :param size: size of the file, requested if None
+        :return: number of bytes written
+        """
+        files = self.google_api.service.files()
+        if size is None:
+            size = int(self.google_api.retry(files.get(fileId=file_id, fields="size"))["size"])
+        part_name = file_name + ".part"
+        handle = os.open(part_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        lock = threading.Lock()
+        local = threading.local()
+        service_http = files._http
+
+        def download_range(start):
+            """download one range and write it to the file"""
+            if not hasattr(local, "http"):
+                local.http = parallel.thread_http(service_http)
+            request = files.get_media(fileId=file_id)
+            request.http = local.http
+            end = min(start + self.chunk_size, size) - 1
+            request.headers["range"] = "bytes={}-{}".format(start, end)
+            content = self.google_api.retry(request)
+            if len(content) != end - start + 1:
+                raise IOError("got {} bytes for range {}-{} of {}".format(
+                    len(content), start, end, file_id))
+            _pwrite(handle, content, start, lock)
+            return len(content)
+
+        try:
+            os.ftruncate(handle, size)
+            written = 0
+            for _, future in parallel.map_unordered(download_range,
+                                                    range(0, size, self.chunk_size),
+                                                    self.range_workers):
+                written += future.result()
+        finally:
+            os.close(handle)
+        os.replace(part_name, file_name)
+        return written
+
+    def upload_files(self, uploads, raise_errors=False):
+        """
+        upload many files concurrently
+
+        :param uploads: iterable of dicts with the arguments of upload, i.e.
+            {"file_name": "a.pdf", "metadata": {"name": "a.pdf", "parents": [folder_id]}}
+        :param raise_errors: raise the first failed upload, otherwise its exception is yielded
+        :return: generator of (upload, file resource or exception) in order of completion
+        """
+        return self._map(lambda transfer, upload: transfer.upload(**upload), uploads,
+                         raise_errors)
+
+    def download_files(self, downloads, raise_errors=False):
+        """
+        download many files concurrently
+
+        :param downloads: iterable of (file_id, file_name)
+        :param raise_errors: raise the first failed download, otherwise its exception is yielded
+        :return: generator of ((file_id, file_name), bytes written or exception)
+        """
+        return self._map(lambda transfer, download: transfer.download(*download), downloads,
+                         raise_errors)
+
+    def _map(self, function, arguments, raise_errors):
+        """run transfers on a thread pool, every thread uses its own clone of the api"""
+        local = threading.local()
+
+        def transfer(argument):
+            """run one transfer on the thread's clone"""
+            if not hasattr(local, "transfer"):
+                local.transfer = DriveTransfer(self.google_api.clone(), self.chunk_size,
+                                               self.range_workers, self.workers)
+            return function(local.transfer, argument)
+
+        for argument, future in parallel.map_unordered(transfer, arguments, self.workers):
+            error = future.exception()
+            if error is not None and raise_errors:
+                raise error
+            yield argument, error if error is not None else future.result()
@@ -0,0 +1,34 @@
+""" inter process file locks """
+
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(file_name, shared=False):
+    """
+    lock a file for all processes on this host
+
+    the lock is held on a separate file_name + ".lock", so the locked file itself can be
+    replaced atomically. On platforms without fcntl the lock is a no op.
+
+    :param file_name: file to lock
+    :param shared: acquire a shared (read) lock instead of an exclusive one
+    """
+    lock_name = file_name + ".lock"
+    directory = os.path.dirname(os.path.abspath(lock_name))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    with open(lock_name, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,321 @@
+""" instrumentation of api calls """
+
+import bisect
+import logging
+import threading
+
+from .cache import atomic_write
+
+# latency histogram buckets in seconds, 4 per power of two from 1 ms to about 2 minutes
+LATENCY_BUCKETS = tuple(0.001 * 2**(index / 4.0) for index in range(69))
+# buckets exported to prometheus, every power of two
+EXPORTED_BUCKETS = LATENCY_BUCKETS[::4]
+
+
+def method_path(request):
+    """
+    method path of a request
+
+    :param request: googleapiclient.http.HttpRequest
+    :return: method id i.e. compute.instances.list
+    """
+    return getattr(request, "methodId", None) or "unknown"
+
+
+class _CountingPostproc(object):
+    """postproc of a request counting the response bytes"""
+
+    __slots__ = ("metrics", "path", "postproc")
+
+    def __init__(self, metrics, path, postproc):
+        self.metrics = metrics
+        self.path = path
+        self.postproc = postproc
+
+    def __call__(self, resp, content):
+        self.metrics.record_bytes(self.path, len(content) if content else 0)
+        return self.postproc(resp, content)
+
+
+class MethodMetrics(object):
+    """ metrics of one api method """
+
+    __slots__ = ("calls", "errors", "retries", "backoff", "pages", "bytes", "latency_sum",
+                 "latency_max", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.backoff = 0.0
+        self.pages = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def percentile(self, fraction):
+        """
+        estimate a latency percentile from the histogram
+
+        :param fraction: percentile as fraction, i.e. 0.95
+        :return: seconds
+        """
+        if not self.calls:
+            return 0.0
+        rank = fraction * self.calls
+        count = 0
+        for index, bucket_count in enumerate(self.histogram):
+            if count + bucket_count >= rank and bucket_count:
+                lower = LATENCY_BUCKETS[index - 1] if index > 0 else 0.0
+                upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else \
+                    self.latency_max
+                # interpolate within the bucket
+                value = lower + (upper - lower) * (rank - count) / bucket_count
+                return min(value, self.latency_max)
+            count += bucket_count
+        return self.latency_max
+
+    def snapshot(self):
+        """
+        metrics as dict
+
+        :return: dict with calls, errors, retries, backoff, pages, bytes, latency_sum,
+            p50, p95, p99, max and cumulative buckets [(upper bound, count)]
+        """
+        buckets = []
+        count = 0
+        index = 0
+        for bound in EXPORTED_BUCKETS:
+            while index < len(LATENCY_BUCKETS) and LATENCY_BUCKETS[index] <= bound:
+                count += self.histogram[index]
+                index += 1
+            buckets.append((bound, count))
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "backoff": self.backoff,
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "latency_sum": self.latency_sum,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.latency_max,
+            "buckets": buckets,
+        }
+
+
+class Metrics(object):
+    """
+    call counts, latency histograms, retries, pages and response bytes per api method
+
+    GoogleApi.retry records every call if the api has metrics (see GoogleApi.with_metrics),
+    without metrics nothing is recorded. Metrics are shared by all clones of an api.
+    """
+
+    def __init__(self, exporters=None):
+        """
+        create metrics
+
+        :param exporters: exporters used by export, i.e. [LoggingExporter()]
+        """
+        self.exporters = list(exporters or [])
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def _method(self, path):
+        """get the metrics of a method"""
+        method = self._methods.get(path)
+        if method is None:
+            with self._lock:
+                method = self._methods.setdefault(path, MethodMetrics())
+        return method
+
+    def track(self, request):
+        """
+        count the response bytes of a request
+
+        :param request: googleapiclient.http.HttpRequest
+        :return: method path of the request
+        """
+        path = method_path(request)
+        postproc = request.postproc
+        # requests of the next page are copies of the previous request
+        if isinstance(postproc, _CountingPostproc):
+            postproc = postproc.postproc
+        request.postproc = _CountingPostproc(self, path, postproc)
+        return path
+
+    def record_call(self, path, seconds, error=None):
+        """
+        record a finished call including its retries
+
+        :param path: method path
+        :param seconds: duration of the call
+        :param error: exception raised by the call
+        """
+        method = self._method(path)
+        with self._lock:
+            method.calls += 1
+            if error is not None:
+                method.errors += 1
+            method.latency_sum += seconds
+            method.latency_max = max(method.latency_max, seconds)
+            method.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_retry(self, path, delay):
+        """
+        record a retry
+
+        :param path: method path
+        :param delay: seconds waited before the retry
+        """
+        method = self._method(path)
+        with self._lock:
+            method.retries += 1
+            method.backoff += delay
+
+    def record_bytes(self, path, size):
+        """
+        record a response
+
+        :param path: method path
+        :param size: response size in bytes
+        """
+        method = self._method(path)
+        with self._lock:
+            method.bytes += size
+
+    def record_page(self, request):
+        """
+        record a page of a list call
+
+        :param request: googleapiclient.http.HttpRequest of the page
+        """
+        method = self._method(method_path(request))
+        with self._lock:
+            method.pages += 1
+
+    def snapshot(self):
+        """
+        current metrics
+
+        :return: dict method path -> dict (see MethodMetrics.snapshot)
+        """
+        with self._lock:
+            return {path: method.snapshot() for path, method in self._methods.items()}
+
+    def reset(self):
+        """forget all metrics"""
+        with self._lock:
+            self._methods.clear()
+
+    def export(self):
+        """
+        export a snapshot with all exporters
+
+        :return: list of the exporter results
+        """
+        snapshot = self.snapshot()
+        return [exporter.export(snapshot) for exporter in self.exporters]
+
+
+class MemoryExporter(object):
+    """ keep the last snapshot in memory """
+
+    def __init__(self):
+        self.snapshot = {}
+
+    def export(self, snapshot):
+        """
+        store a snapshot
+
+        :param snapshot: Metrics.snapshot
+        :return: snapshot
+        """
+        self.snapshot = snapshot
+        return snapshot
+
+
+class LoggingExporter(object):
+    """ log one line per api method, slowest methods first """
+
+    def __init__(self, log=None, level=logging.INFO):
+        """
+        create a logging exporter
+
+        :param log: logger, defaults to the GoogleApi logger
+        :param level: log level
+        """
+        self.log = log or logging.getLogger("GoogleApi")
+        self.level = level
+
+    def export(self, snapshot):
+        """
+        log a snapshot
+
+        :param snapshot: Metrics.snapshot
+        """
+        for path, method in sorted(snapshot.items(), key=lambda item: -item[1]["latency_sum"]):
+            self.log.log(
+                self.level, "%s: %d calls, %d errors, p50 %.3fs, p95 %.3fs, p99 %.3fs, "
+                "%d retries (%.1fs backoff), %d pages, %d bytes", path, method["calls"],
+                method["errors"], method["p50"], method["p95"], method["p99"], method["retries"],
+                method["backoff"], method["pages"], method["bytes"])
+
+
+class PrometheusExporter(object):
+    """ prometheus text format, optionally written to a file for the node exporter """
+
+    COUNTERS = (
+        ("calls", "calls_total", "api calls"),
+        ("errors", "errors_total", "failed api calls"),
+        ("retries", "retries_total", "retried api calls"),
+        ("backoff", "backoff_seconds_total", "seconds waited before retries"),
+        ("pages", "pages_total", "pages of list calls"),
+        ("bytes", "response_bytes_total", "response bytes"),
+    )
+
+    def __init__(self, prefix="googleapi", file_name=None):
+        """
+        create a prometheus exporter
+
+        :param prefix: prefix of the metric names
+        :param file_name: file to write, i.e. for the textfile collector of the node exporter
+        """
+        self.prefix = prefix
+        self.file_name = file_name
+
+    def export(self, snapshot):
+        """
+        format a snapshot
+
+        :param snapshot: Metrics.snapshot
+        :return: metrics in prometheus text format
+        """
+        lines = []
+        paths = sorted(snapshot)
+        for key, name, description in self.COUNTERS:
+            name = "{}_{}".format(self.prefix, name)
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} counter".format(name))
+            for path in paths:
+                lines.append('{}{{method="{}"}} {}'.format(name, path, snapshot[path][key]))
+        name = "{}_call_duration_seconds".format(self.prefix)
+        lines.append("# HELP {} duration of api calls including retries".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for path in paths:
+            method = snapshot[path]
+            for bound, count in method["buckets"]:
+                lines.append('{}_bucket{{method="{}",le="{:g}"}} {}'.format(
+                    name, path, bound, count))
+            lines.append('{}_bucket{{method="{}",le="+Inf"}} {}'.format(
+                name, path, method["calls"]))
+            lines.append('{}_sum{{method="{}"}} {}'.format(name, path, method["latency_sum"]))
+            lines.append('{}_count{{method="{}"}} {}'.format(name, path, method["calls"]))
+        text = "\n".join(lines) + "\n"
+        if self.file_name is not None:
+            atomic_write(self.file_name, text)
+        return text
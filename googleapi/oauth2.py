@@ -3,9 +3,10 @@
 helper functions for oauth2
 """
 import json
+import os
 
-from google.oauth2 import service_account
-from google_auth_oauthlib.flow import InstalledAppFlow
+from .cache import atomic_write
+from .filelock import file_lock
 
 
 def authorize_service_account(json_credentials, scope, sub=None):
@@ -18,6 +19,7 @@ def authorize_service_account(json_credentials, scope, sub=None):
     :param sub: User ID to authorize the application for (if needed)
     :return Credentials to be used for http object
     """
+    from google.oauth2 import service_account
     credentials = service_account.Credentials.from_service_account_info(json_credentials)
     if scope:
         credentials = credentials.with_scopes(scope)
@@ -40,6 +42,48 @@ def authorize_service_account_file(json_file_name, scope, sub=None):
     return authorize_service_account(json_credentials, scope, sub)
 
 
+def load_cached_credentials(credential_cache_file, scope):
+    """
+    load user credentials from a cache file and refresh them if they are expired
+
+    :param credential_cache_file: file written by save_cached_credentials
+    :param scope: scope(s) the credentials need to be authorized for
+    :return google.oauth2.credentials.Credentials or None if there are no usable credentials
+    """
+    if not os.path.isfile(credential_cache_file):
+        return None
+    import google_auth_httplib2
+    import httplib2
+    from google.auth.exceptions import RefreshError
+    from google.oauth2.credentials import Credentials
+    scopes = [scope] if isinstance(scope, str) else list(scope or [])
+    try:
+        credentials = Credentials.from_authorized_user_file(credential_cache_file)
+    except (ValueError, KeyError):
+        return None
+    if scopes and not credentials.has_scopes(scopes):
+        return None
+    if not credentials.valid:
+        if not credentials.refresh_token:
+            return None
+        try:
+            credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+        except RefreshError:
+            return None
+        save_cached_credentials(credential_cache_file, credentials)
+    return credentials
+
+
+def save_cached_credentials(credential_cache_file, credentials):
+    """
+    store user credentials in a cache file
+
+    :param credential_cache_file: cache file
+    :param credentials: google.oauth2.credentials.Credentials
+    """
+    atomic_write(credential_cache_file, credentials.to_json())
+
+
 def authorize_application(client_secret_file,
                           scope,
                           credential_cache_file='credentials_cache.json',
@@ -55,7 +99,21 @@ def authorize_application(client_secret_file,
     :param flow_params: oauth2 flow parameters deprecated
     :return OAuth2Credentials object
     """
+    if not credential_cache_file:
+        return _run_flow(client_secret_file, scope, flow_params, local_web_server)
+
+    # hold the lock during the flow, so concurrent processes wait and use the new credentials
+    with file_lock(credential_cache_file):
+        credentials = load_cached_credentials(credential_cache_file, scope)
+        if credentials is None:
+            credentials = _run_flow(client_secret_file, scope, flow_params, local_web_server)
+            save_cached_credentials(credential_cache_file, credentials)
+    return credentials
+
 
+def _run_flow(client_secret_file, scope, flow_params, local_web_server):
+    """run the installed application flow"""
+    from google_auth_oauthlib.flow import InstalledAppFlow
     flow = InstalledAppFlow.from_client_secrets_file(client_secret_file, scopes=scope)
 
     if local_web_server or '--auth_local_webserver' in flow_params:
@@ -0,0 +1,408 @@
+""" wait for many long running operations with coalesced, adaptive polling """
+
+import abc
+import logging
+import re
+import threading
+import time
+
+from concurrent.futures import Future
+
+# projects/{project}/zones/{zone}/operations/{operation}, also regions and global operations
+_COMPUTE_OPERATION = re.compile(r"projects/(?P<project>[^/]+)/(?:zones/(?P<zone>[^/]+)/|"
+                                r"regions/(?P<region>[^/]+)/|global/)operations/(?P<name>[^/?]+)")
+_PROJECT = re.compile(r"projects/(?P<project>[^/]+)/")
+
+
+class OperationError(RuntimeError):
+    """ an operation finished with an error """
+
+    def __init__(self, message, operation):
+        super(OperationError, self).__init__(message)
+        self.operation = operation
+
+
+def _project(operation):
+    """project of an operation from its selfLink"""
+    match = _PROJECT.search(operation.get("selfLink", ""))
+    if match is None:
+        raise ValueError("no project in selfLink of operation {}".format(operation.get("name")))
+    return match.group("project")
+
+
+class OperationAdapter(abc.ABC):
+    """
+    operation format and polling of an api
+
+    the default polls every operation with its own get request
+    """
+
+    def key(self, operation):
+        """unique key of an operation"""
+        return operation.get("selfLink") or operation["name"]
+
+    def done(self, operation):
+        """check if an operation is finished"""
+        return operation.get("status") == "DONE"
+
+    def error(self, operation):
+        """
+        error of a finished operation
+
+        :return: error message or None if the operation succeeded
+        """
+        error = operation.get("error")
+        if not error:
+            return None
+        if "errors" in error:
+            return "; ".join("{}: {}".format(entry.get("code"), entry.get("message"))
+                             for entry in error["errors"])
+        return "{}: {}".format(error.get("code"), error.get("message"))
+
+    @abc.abstractmethod
+    def get(self, service, operation):
+        """
+        request getting the current state of an operation
+
+        :param service: GoogleApi.service
+        :param operation: operation dict
+        :return: googleapiclient.http.HttpRequest
+        """
+
+    def poll(self, google_api, operations):
+        """
+        get the current state of operations
+
+        :param google_api: GoogleApi used by the waiter thread
+        :param operations: list of operation dicts
+        :return: list of operations or exceptions in the order of operations
+        """
+        results = []
+        for operation in operations:
+            try:
+                results.append(google_api.retry(self.get(google_api.service, operation)))
+            except Exception as error:
+                results.append(error)
+        return results
+
+
+class ComputeOperations(OperationAdapter):
+    """ zone, region and global operations of compute, polled in batch requests """
+
+    def get(self, service, operation):
+        match = _COMPUTE_OPERATION.search(operation.get("selfLink", ""))
+        if match is None:
+            raise ValueError("unknown selfLink of operation {}".format(operation.get("name")))
+        project, zone, region, name = match.group("project", "zone", "region", "name")
+        if zone is not None:
+            return service.zoneOperations().get(project=project, zone=zone, operation=name)
+        if region is not None:
+            return service.regionOperations().get(project=project, region=region, operation=name)
+        return service.globalOperations().get(project=project, operation=name)
+
+    def poll(self, google_api, operations):
+        if len(operations) == 1:
+            return super(ComputeOperations, self).poll(google_api, operations)
+        requests = [self.get(google_api.service, operation) for operation in operations]
+        return list(google_api.iter_batch(requests, raise_errors=False))
+
+
+class ListedOperations(OperationAdapter):
+    """
+    operations polled with one list call per project
+
+    projects with fewer than list_threshold pending operations are polled with get requests,
+    as are operations missing in the list (i.e. finished operations filtered by the list call)
+    """
+
+    list_threshold = 3
+
+    @abc.abstractmethod
+    def list(self, service, project):
+        """
+        request listing the operations of a project
+
+        :return: (resource, googleapiclient.http.HttpRequest)
+        """
+
+    def poll(self, google_api, operations):
+        projects = {}
+        for index, operation in enumerate(operations):
+            projects.setdefault(_project(operation), []).append(index)
+        results = [None] * len(operations)
+        single = []
+        for project, indexes in projects.items():
+            if len(indexes) < self.list_threshold:
+                single.extend(indexes)
+                continue
+            try:
+                listed = self._list_all(google_api, project)
+            except Exception as error:
+                for index in indexes:
+                    results[index] = error
+                continue
+            for index in indexes:
+                results[index] = listed.get(self.key(operations[index]))
+                if results[index] is None:
+                    single.append(index)
+        single.sort()
+        polled = super(ListedOperations, self).poll(google_api,
+                                                    [operations[index] for index in single])
+        for index, result in zip(single, polled):
+            results[index] = result
+        return results
+
+    def _list_all(self, google_api, project):
+        """all listed operations of a project, key -> operation"""
+        listed = {}
+        resource, request = self.list(google_api.service, project)
+        while request is not None:
+            response = google_api.retry(request)
+            for operation in response.get("operations", response.get("items", [])):
+                listed[self.key(operation)] = operation
+            list_next = getattr(resource, "list_next", None)
+            request = list_next(request, response) if list_next is not None else None
+        return listed
+
+
+class DeploymentManagerOperations(ListedOperations):
+    """ global operations of deployment manager """
+
+    def get(self, service, operation):
+        return service.operations().get(project=_project(operation),
+                                        operation=operation["name"])
+
+    def list(self, service, project):
+        resource = service.operations()
+        return resource, resource.list(project=project, filter="status ne DONE", maxResults=500)
+
+
+class ContainerOperations(ListedOperations):
+    """ cluster and node pool operations of kubernetes engine """
+
+    def _name(self, operation):
+        """full resource name of an operation"""
+        location = operation.get("location") or operation.get("zone")
+        return "projects/{}/locations/{}/operations/{}".format(_project(operation), location,
+                                                               operation["name"])
+
+    def get(self, service, operation):
+        return service.projects().locations().operations().get(name=self._name(operation))
+
+    def list(self, service, project):
+        resource = service.projects().locations().operations()
+        return resource, resource.list(parent="projects/{}/locations/-".format(project))
+
+
+class LongRunningOperations(OperationAdapter):
+    """ google.longrunning operations, i.e. of cloud build """
+
+    def key(self, operation):
+        return operation["name"]
+
+    def done(self, operation):
+        return bool(operation.get("done"))
+
+    def get(self, service, operation):
+        name = operation["name"]
+        if "/locations/" in name:
+            return service.projects().locations().operations().get(name=name)
+        return service.operations().get(name=name)
+
+
+# operation adapter per api
+ADAPTERS = {
+    "cloudbuild": LongRunningOperations(),
+    "compute": ComputeOperations(),
+    "container": ContainerOperations(),
+    "deploymentmanager": DeploymentManagerOperations(),
+}
+
+
+class _Pending(object):
+    """an operation waiting to be polled"""
+
+    __slots__ = ("operation", "future", "interval", "due", "deadline")
+
+    def __init__(self, operation, future, interval, deadline):
+        self.operation = operation
+        self.future = future
+        self.interval = interval
+        self.due = time.monotonic() + interval
+        self.deadline = deadline
+
+
+class OperationWaiter(object):
+    """
+    wait for long running operations on a single background thread
+
+    submit returns a future which resolves to the finished operation or raises OperationError.
+    Every operation is polled with an interval growing from min_interval to max_interval, and
+    all operations due within coalesce seconds are polled together: compute operations in batch
+    requests, deployment manager and container operations with one list call per project.
+
+    The waiter thread uses its own clone of the api, so retry policy, rate limiter and metrics
+    of the api apply to the polls.
+    """
+
+    def __init__(self,
+                 google_api,
+                 min_interval=1.0,
+                 max_interval=30.0,
+                 backoff=1.5,
+                 coalesce=None,
+                 adapter=None):
+        """
+        create an operation waiter
+
+        :param google_api: GoogleApi of compute, deploymentmanager, container or cloudbuild
+        :param min_interval: seconds before the first poll of an operation
+        :param max_interval: maximum seconds between two polls of an operation
+        :param backoff: factor of the poll interval after each poll
+        :param coalesce: operations due within these seconds are polled early, together with
+            the due operations, defaults to min_interval / 2
+        :param adapter: OperationAdapter, defaults to the adapter of the api
+        """
+        if adapter is None:
+            adapter = ADAPTERS.get(google_api.api)
+            if adapter is None:
+                raise ValueError("no operation adapter for api {}".format(google_api.api))
+        self.google_api = google_api
+        self.adapter = adapter
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.coalesce = min_interval / 2.0 if coalesce is None else coalesce
+        self.polls = 0
+        self.log = logging.getLogger("GoogleApi")
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, operation, timeout=None):
+        """
+        wait for an operation
+
+        :param operation: operation returned by an api call, i.e. instances().insert()
+        :param timeout: seconds after which the future raises TimeoutError
+        :return: concurrent.futures.Future of the finished operation
+        """
+        future = Future()
+        if self.adapter.done(operation):
+            self._finish(future, operation)
+            return future
+        key = self.adapter.key(operation)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("operation waiter is closed")
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending.future
+            self._pending[key] = _Pending(operation, future, self.min_interval, deadline)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="googleapi-operations",
+                                                daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def wait(self, operations, timeout=None):
+        """
+        wait for operations
+
+        :param operations: iterable of operations
+        :param timeout: seconds per operation
+        :return: list of finished operations, raises the first OperationError
+        """
+        futures = [self.submit(operation, timeout) for operation in operations]
+        return [future.result() for future in futures]
+
+    def pending(self):
+        """number of operations not finished yet"""
+        with self._condition:
+            return len(self._pending)
+
+    def close(self):
+        """stop polling, futures of pending operations are cancelled"""
+        with self._condition:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._condition.notify()
+        for entry in pending:
+            entry.future.cancel()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _finish(self, future, operation):
+        """resolve the future of a finished operation"""
+        message = self.adapter.error(operation)
+        if message is None:
+            future.set_result(operation)
+        else:
+            future.set_exception(OperationError(message, operation))
+
+    def _due(self):
+        """wait until operations are due, None if the waiter is closed"""
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                if self._pending:
+                    first = min(entry.due for entry in self._pending.values())
+                    if first <= now:
+                        return [(key, entry) for key, entry in self._pending.items()
+                                if entry.due <= now + self.coalesce]
+                    self._condition.wait(first - now)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _run(self):
+        """poll operations until the waiter is closed"""
+        google_api = self.google_api.clone()
+        while True:
+            due = self._due()
+            if due is None:
+                return
+            try:
+                results = self.adapter.poll(google_api, [entry.operation for _, entry in due])
+            except Exception as error:
+                self.log.exception("polling %d operations failed", len(due))
+                results = [error] * len(due)
+            self.polls += 1
+            now = time.monotonic()
+            finished = []
+            with self._condition:
+                for (key, entry), result in zip(due, results):
+                    if self._pending.get(key) is not entry:
+                        continue
+                    if isinstance(result, Exception) or self.adapter.done(result) or \
+                            entry.future.cancelled() or \
+                            (entry.deadline is not None and now >= entry.deadline):
+                        del self._pending[key]
+                        finished.append((entry, result))
+                        continue
+                    entry.interval = min(entry.interval * self.backoff, self.max_interval)
+                    entry.due = now + entry.interval
+                    if entry.deadline is not None:
+                        entry.due = min(entry.due, entry.deadline)
+            # resolve outside of the lock, callbacks of the futures may submit operations
+            for entry, result in finished:
+                if entry.future.cancelled():
+                    continue
+                if isinstance(result, Exception):
+                    entry.future.set_exception(result)
+                elif self.adapter.done(result):
+                    self._finish(entry.future, result)
+                else:
+                    entry.future.set_exception(
+                        TimeoutError("operation {} is not done".format(result.get("name"))))
@@ -0,0 +1,142 @@
+""" helpers to run api calls concurrently """
+
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .pool import PooledHttp
+
+
+def thread_http(http):
+    """
+    create a new http object with the same credentials
+
+    httplib2 is not thread safe, every thread needs its own http object. Http objects using a
+    connection pool are thread safe and returned as they are.
+
+    :param http: http object of a request or service
+    :return: new (authorized) http object
+    """
+    if isinstance(getattr(http, "http", http), PooledHttp):
+        return http
+    import google_auth_httplib2
+    from googleapiclient.http import build_http
+    credentials = getattr(http, "credentials", None)
+    if credentials is None:
+        return build_http()
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+
+
+def prefetch(iterable, depth=1):
+    """
+    iterate in a background thread, up to depth elements ahead of the consumer
+
+    exceptions of the background thread are raised in the consumer, closing the generator
+    stops the background thread after its current element
+
+    :param iterable: iterable to consume in the background
+    :param depth: maximum number of buffered elements
+    """
+    buffer = queue.Queue(maxsize=max(depth, 1))
+    stopped = threading.Event()
+
+    def put(entry):
+        """put an entry into the buffer unless the consumer stopped"""
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        """fetch elements into the buffer"""
+        try:
+            for element in iterable:
+                if not put((element, None)):
+                    return
+        except BaseException as error:  # noqa
+            put((None, error))
+            return
+        put((StopIteration, None))
+
+    thread = threading.Thread(target=produce, name="googleapi-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            element, error = buffer.get()
+            if error is not None:
+                raise error
+            if element is StopIteration:
+                return
+            yield element
+    finally:
+        stopped.set()
+
+
+# maximum number of concurrent calls per api in this process
+API_CONCURRENCY = {}
+DEFAULT_API_CONCURRENCY = 16
+
+_api_semaphores = {}
+_api_semaphores_lock = threading.Lock()
+
+
+def api_semaphore(api):
+    """
+    get the semaphore limiting concurrent calls to an api in this process
+
+    :param api: api name i.e. compute
+    :return: threading.BoundedSemaphore
+    """
+    with _api_semaphores_lock:
+        if api not in _api_semaphores:
+            _api_semaphores[api] = threading.BoundedSemaphore(
+                API_CONCURRENCY.get(api, DEFAULT_API_CONCURRENCY))
+        return _api_semaphores[api]
+
+
+def map_unordered(function, iterable, workers):
+    """
+    run function for all elements of iterable on a thread pool
+
+    at most 2 * workers calls are in flight, so iterable may be a long generator
+
+    :param function: function called with one element of iterable
+    :param iterable: arguments
+    :param workers: number of threads
+    :return: generator of (argument, future) in order of completion
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="googleapi") as executor:
+        for argument, future in submit_unordered(executor, function, iterable, 2 * workers):
+            yield argument, future
+
+
+def submit_unordered(executor, function, iterable, max_pending):
+    """
+    submit function for all elements of iterable to an executor
+
+    :param executor: concurrent.futures.Executor
+    :param function: function called with one element of iterable
+    :param iterable: arguments
+    :param max_pending: maximum number of submitted, not yet completed calls
+    :return: generator of (argument, future) in order of completion
+    """
+    arguments = iter(iterable)
+    pending = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_pending:
+            try:
+                argument = next(arguments)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[executor.submit(function, argument)] = argument
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
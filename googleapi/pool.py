@@ -0,0 +1,142 @@
+""" shared http connection pool """
+
+import collections
+import threading
+
+
+class HttpPool(object):
+    """
+    thread safe pool of httplib2.Http objects
+
+    every httplib2.Http keeps its connections alive, so borrowing one from the pool reuses a
+    warm TCP/TLS connection to googleapis.com instead of opening a new one per api object.
+    """
+
+    def __init__(self, max_size=10, timeout=None, factory=None):
+        """
+        create a pool
+
+        :param max_size: maximum number of http objects, callers wait if all are in use
+        :param timeout: seconds to wait for a free http object, None to wait forever
+        :param factory: function creating a new http object, defaults to
+            googleapiclient.http.build_http
+        """
+        if factory is None:
+            from googleapiclient.http import build_http
+            factory = build_http
+        self.max_size = max_size
+        self.timeout = timeout
+        self.factory = factory
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+        self._idle = collections.deque()
+        self._open = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        borrow an http object, it must be given back with release
+
+        :return: httplib2.Http
+        """
+        with self._condition:
+            while not self._idle and self._open >= self.max_size:
+                self.waits += 1
+                if not self._condition.wait(self.timeout):
+                    raise RuntimeError("no http connection available within {} seconds".format(
+                        self.timeout))
+            if self._idle:
+                self.reused += 1
+                # the most recently used object has the warmest connections
+                return self._idle.pop()
+            self._open += 1
+            self.created += 1
+        try:
+            return self.factory()
+        except BaseException:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, http, discard=False):
+        """
+        give back a borrowed http object
+
+        :param http: http object returned by acquire
+        :param discard: close the http object instead of reusing it, i.e. after an error
+        """
+        with self._condition:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append(http)
+            self._condition.notify()
+        if discard:
+            http.close()
+
+    def close(self):
+        """close all idle http objects"""
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for http in idle:
+            http.close()
+
+    def stats(self):
+        """
+        pool statistics
+
+        :return: dict with open, idle, in_use, created, reused and waits
+        """
+        with self._condition:
+            return {
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "created": self.created,
+                "reused": self.reused,
+                "waits": self.waits,
+            }
+
+
+class PooledHttp(object):
+    """
+    httplib2.Http compatible object sending every request with an http object of a pool
+
+    it can be shared by many threads and api objects
+    """
+
+    def __init__(self, pool):
+        """
+        create a pooled http object
+
+        :param pool: HttpPool
+        """
+        self.pool = pool
+        self.connections = {}
+        self.follow_redirects = True
+        self.redirect_codes = frozenset((300, 301, 302, 303, 307, 308))
+        self.timeout = None
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """
+        send a request, see httplib2.Http.request
+
+        :return: tuple (response, content)
+        """
+        http = self.pool.acquire()
+        try:
+            response = http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        except BaseException:
+            self.pool.release(http, discard=True)
+            raise
+        self.pool.release(http)
+        return response
+
+    def close(self):
+        """connections belong to the pool, nothing to close"""
+        pass
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+""" pre-warm a local discovery store, so services are built without network access """
+import logging
+import os
+
+from argparse import ArgumentParser
+
+from .api import GoogleApi
+from .discovery import DISCOVERY_STORE_ENV, DISCOVERY_URI, DiscoveryStore
+
+
+def factory_apis():
+    """
+    apis and versions of the GoogleApi factory methods (GoogleApi.compute, GoogleApi.drive, ...)
+
+    :return: sorted list of (api, api_version)
+    """
+    apis = set()
+    for name, member in vars(GoogleApi).items():
+        if isinstance(member, classmethod):
+            google_api = getattr(GoogleApi, name)()
+            apis.add((google_api.api, google_api.api_version))
+    return sorted(apis)
+
+
+def parse_api(value):
+    """parse api:version"""
+    api, _, api_version = value.partition(":")
+    if not api or not api_version:
+        raise ValueError("expected api:version, got {}".format(value))
+    return api, api_version
+
+
+def main():
+    """ store discovery documents """
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger("GoogleApi")
+    parser = ArgumentParser(description="Store discovery documents for offline service builds")
+    parser.add_argument("apis",
+                        nargs="*",
+                        help="apis as api:version, i.e. compute:v1, defaults to all factory apis")
+    parser.add_argument("--store",
+                        default=os.environ.get(DISCOVERY_STORE_ENV,
+                                               os.path.join(".cache", "discovery_store")),
+                        help="store directory, defaults to ${} or .cache/discovery_store".format(
+                            DISCOVERY_STORE_ENV))
+    parser.add_argument("--static",
+                        action="store_true",
+                        help="use the discovery documents bundled with googleapiclient")
+    parser.add_argument("--discovery-url", default=DISCOVERY_URI, help="discovery url template")
+    args = parser.parse_args()
+    try:
+        apis = [parse_api(value) for value in args.apis]
+    except ValueError as error:
+        parser.error(str(error))
+    # some factory apis are retired, they are skipped unless requested explicitly
+    explicit = bool(apis)
+    apis = apis or factory_apis()
+
+    store = DiscoveryStore(args.store)
+    failed = 0
+    for api, api_version in apis:
+        try:
+            file_name, = store.snapshot([(api, api_version)], args.discovery_url, args.static)
+        except Exception as error:  # noqa
+            if explicit:
+                log.error("%s %s: %s", api, api_version, error)
+                failed += 1
+            else:
+                log.warning("skipping unavailable api %s %s: %s", api, api_version, error)
+            continue
+        log.info("%s %s: %s (%d bytes)", api, api_version, file_name,
+                 os.path.getsize(file_name))
+    log.info("export %s=%s to use the store", DISCOVERY_STORE_ENV, os.path.abspath(args.store))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,214 @@
+""" client side rate limiting """
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from .cache import atomic_write
+from .filelock import file_lock
+
+PROJECT_PATTERN = re.compile(r"/projects/([^/?]+)")
+USER_PATTERN = re.compile(r"/users/([^/?]+)")
+
+
+class TokenBucket(object):
+    """
+    thread safe token bucket
+
+    tokens are reserved in advance, so the bucket may go negative. The caller is told how long
+    to wait until its reservation is covered, which keeps waiting callers in order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        create a bucket
+
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (burst size), defaults to rate
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._timestamp = time.time()
+
+    @staticmethod
+    def _take(tokens, timestamp, rate, capacity, count, now):
+        """
+        refill and take count tokens
+
+        :return: tuple (tokens, timestamp, delay)
+        """
+        tokens = min(capacity, tokens + (now - timestamp) * rate) - count
+        delay = -tokens / rate if tokens < 0 else 0.0
+        return tokens, now, delay
+
+    def reserve(self, count=1):
+        """
+        reserve tokens
+
+        :param count: number of tokens
+        :return: seconds to wait before the tokens may be used
+        """
+        with self._lock:
+            self._tokens, self._timestamp, delay = self._take(self._tokens, self._timestamp,
+                                                              self.rate, self.capacity, count,
+                                                              time.time())
+        return delay
+
+    def acquire(self, count=1):
+        """
+        wait until tokens are available
+
+        :param count: number of tokens
+        :return: seconds waited
+        """
+        delay = self.reserve(count)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    token bucket shared by all processes on a host
+
+    the bucket state is kept in a file and updated under an exclusive file lock
+    """
+
+    def __init__(self, file_name, rate, capacity=None):
+        """
+        create a bucket
+
+        :param file_name: file storing the bucket state
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (burst size), defaults to rate
+        """
+        super(FileTokenBucket, self).__init__(rate, capacity)
+        self.file_name = file_name
+
+    def reserve(self, count=1):
+        """
+        reserve tokens
+
+        :param count: number of tokens
+        :return: seconds to wait before the tokens may be used
+        """
+        with self._lock, file_lock(self.file_name):
+            now = time.time()
+            tokens, timestamp = self.capacity, now
+            try:
+                with open(self.file_name) as state_file:
+                    state = json.load(state_file)
+                tokens, timestamp = state["tokens"], state["timestamp"]
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+            tokens, timestamp, delay = self._take(tokens, timestamp, self.rate, self.capacity,
+                                                  count, now)
+            atomic_write(self.file_name, json.dumps({"tokens": tokens, "timestamp": timestamp}))
+        return delay
+
+
+def quota_key(google_api, request):
+    """
+    quota bucket of a request
+
+    gmail quotas are per user, cloud apis are limited per project, everything else per api
+
+    :param google_api: GoogleApi executing the request
+    :param request: googleapiclient.http.HttpRequest
+    :return: tuple identifying the bucket
+    """
+    uri = getattr(request, "uri", "") or ""
+    if google_api.api == "gmail":
+        match = USER_PATTERN.search(uri)
+        return (google_api.api, google_api.sub or (match.group(1) if match else None))
+    match = PROJECT_PATTERN.search(uri)
+    if match:
+        return (google_api.api, match.group(1))
+    return (google_api.api, )
+
+
+class RateLimiter(object):
+    """
+    proactive rate limiter for GoogleApi
+
+    requests are throttled before they are sent, instead of reacting to rate limit errors.
+    Every quota bucket (see quota_key) gets its own token bucket. With a state_dir the buckets
+    are shared between all processes using the same directory.
+    """
+
+    def __init__(self, rate, capacity=None, key=quota_key, state_dir=None):
+        """
+        create a rate limiter
+
+        :param rate: requests per second per quota bucket
+        :param capacity: burst size, defaults to rate
+        :param key: function (google_api, request) returning the quota bucket of a request
+        :param state_dir: directory to share buckets between processes
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.key = key
+        self.state_dir = state_dir
+        self.waited = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """pickle the configuration only, i.e. to pass the limiter to worker processes"""
+        return {"rate": self.rate, "capacity": self.capacity, "key": self.key,
+                "state_dir": self.state_dir}
+
+    def __setstate__(self, state):
+        """restore a pickled rate limiter"""
+        self.__init__(**state)
+
+    def bucket(self, key):
+        """
+        get the token bucket of a quota bucket
+
+        :param key: quota bucket
+        :return: TokenBucket
+        """
+        with self._lock:
+            if key not in self._buckets:
+                if self.state_dir is None:
+                    self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                else:
+                    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+                    self._buckets[key] = FileTokenBucket(os.path.join(self.state_dir, digest),
+                                                         self.rate, self.capacity)
+            return self._buckets[key]
+
+    def reserve(self, google_api, request, count=1):
+        """
+        reserve tokens for a request without waiting
+
+        :param google_api: GoogleApi executing the request
+        :param request: googleapiclient.http.HttpRequest
+        :param count: number of api calls
+        :return: seconds to wait before sending the request
+        """
+        delay = self.bucket(self.key(google_api, request)).reserve(count)
+        if delay > 0:
+            with self._lock:
+                self.waited += delay
+        return delay
+
+    def acquire(self, google_api, request, count=1):
+        """
+        wait until a request may be sent
+
+        :param google_api: GoogleApi executing the request
+        :param request: googleapiclient.http.HttpRequest
+        :param count: number of api calls
+        :return: seconds waited
+        """
+        delay = self.reserve(google_api, request, count)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
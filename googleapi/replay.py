@@ -0,0 +1,307 @@
+""" record and replay http traffic, i.e. for offline benchmarks """
+
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from .cache import atomic_write
+from .pool import HttpPool
+
+# requests which are never recorded, their responses contain credentials
+UNRECORDED_URIS = (
+    "https://oauth2.googleapis.com/token",
+    "https://accounts.google.com/o/oauth2/",
+    "https://www.googleapis.com/oauth2/v4/token",
+    "https://sts.googleapis.com/",
+    "https://iamcredentials.googleapis.com/",
+    "http://metadata.google.internal/",
+    "http://metadata/",
+    "http://169.254.169.254/",
+)
+# json responses with one of these top level keys are never recorded, whatever their uri is
+CREDENTIAL_KEYS = ("access_token", "accessToken", "id_token", "refresh_token")
+# response headers which are not recorded
+UNRECORDED_HEADERS = ("set-cookie", "date", "expires", "alt-svc", "server-timing")
+
+ERROR_REASONS = {
+    403: ("rateLimitExceeded", "Rate Limit Exceeded"),
+    429: ("rateLimitExceeded", "Resource has been exhausted"),
+    500: ("backendError", "Internal Error"),
+    502: ("backendError", "Bad Gateway"),
+    503: ("backendError", "Service Unavailable"),
+    504: ("backendError", "Deadline Exceeded"),
+}
+
+
+class ReplayMissError(RuntimeError):
+    """ a request has not been recorded """
+
+
+def request_key(uri, method="GET", body=None):
+    """
+    key of a request in a cassette
+
+    :param uri: request uri
+    :param method: http method
+    :param body: request body
+    :return: string
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:16] if body else ""
+    return "{} {} {}".format(method, uri, digest)
+
+
+def is_credential(uri, content):
+    """
+    check if a response contains credentials, i.e. the response of a token refresh
+
+    :param uri: request uri
+    :param content: response body
+    :return: bool
+    """
+    if uri.startswith(UNRECORDED_URIS):
+        return True
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    # only parse responses which may contain a key, i.e. not media downloads
+    if not content or not any(key in content for key in CREDENTIAL_KEYS):
+        return False
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return False
+    return isinstance(body, dict) and any(key in body for key in CREDENTIAL_KEYS)
+
+
+def error_response(status):
+    """
+    google api error response
+
+    :param status: http status
+    :return: tuple (headers, content)
+    """
+    reason, message = ERROR_REASONS.get(status, ("backendError", "Error"))
+    content = json.dumps({
+        "error": {
+            "code": status,
+            "message": message,
+            "errors": [{"reason": reason, "message": message}]
+        }
+    })
+    return {"status": str(status), "content-type": "application/json"}, content.encode("utf-8")
+
+
+class Cassette(object):
+    """
+    recorded http interactions, stored as a json file
+
+    repeated requests (i.e. polling) keep all their responses, which are replayed in order
+    """
+
+    def __init__(self, file_name):
+        """
+        open a cassette
+
+        :param file_name: json file, loaded if it exists
+        """
+        self.file_name = file_name
+        self.interactions = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(file_name):
+            with open(file_name) as cassette_file:
+                self.interactions = json.load(cassette_file)
+
+    def add(self, uri, method, body, response, content):
+        """
+        record an interaction
+
+        :param uri: request uri
+        :param method: http method
+        :param body: request body
+        :param response: httplib2.Response or dict of headers including status
+        :param content: response body as bytes
+        """
+        headers = {
+            name: value
+            for name, value in dict(response).items()
+            if name.lower() not in UNRECORDED_HEADERS and not name.startswith("-")
+        }
+        headers["status"] = str(getattr(response, "status", None) or response["status"])
+        entry = {"headers": headers, "content": base64.b64encode(content or b"").decode("ascii")}
+        with self._lock:
+            self.interactions.setdefault(request_key(uri, method, body), []).append(entry)
+
+    def responses(self, uri, method="GET", body=None):
+        """
+        recorded responses of a request
+
+        :param uri: request uri
+        :param method: http method
+        :param body: request body
+        :return: list of (headers, content)
+        """
+        entries = self.interactions.get(request_key(uri, method, body), [])
+        return [(entry["headers"], base64.b64decode(entry["content"])) for entry in entries]
+
+    def save(self):
+        """write the cassette"""
+        with self._lock:
+            content = json.dumps(self.interactions, indent=1, sort_keys=True)
+        atomic_write(self.file_name, content)
+
+    def recording_http(self, http=None):
+        """
+        create an http object recording into this cassette
+
+        :param http: http object sending the requests, defaults to a new httplib2.Http
+        :return: RecordingHttp
+        """
+        return RecordingHttp(self, http)
+
+    def replay_http(self, **kwargs):
+        """
+        create an http object replaying this cassette
+
+        :param kwargs: arguments of ReplayHttp
+        :return: ReplayHttp
+        """
+        return ReplayHttp(self, **kwargs)
+
+
+class RecordingHttp(object):
+    """
+    httplib2.Http compatible object recording all responses into a cassette
+
+    credential refreshes of AuthorizedHttp go through the same http object, responses
+    containing credentials (see is_credential) are therefore skipped
+    """
+
+    def __init__(self, cassette, http=None):
+        """
+        create a recording http object
+
+        :param cassette: Cassette
+        :param http: http object sending the requests, defaults to a new httplib2.Http
+        """
+        if http is None:
+            from googleapiclient.http import build_http
+            http = build_http()
+        self.cassette = cassette
+        self.http = http
+        self.skipped = 0
+        self.connections = {}
+        self.follow_redirects = True
+        self.redirect_codes = frozenset((300, 301, 302, 303, 307, 308))
+        self.timeout = None
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """send a request and record its response, see httplib2.Http.request"""
+        response, content = self.http.request(uri, method=method, body=body, headers=headers,
+                                              **kwargs)
+        if is_credential(uri, content):
+            self.skipped += 1
+        else:
+            self.cassette.add(uri, method, body, response, content)
+        return response, content
+
+    def close(self):
+        """close the connections"""
+        self.http.close()
+
+
+class ReplayHttp(object):
+    """
+    httplib2.Http compatible object answering requests from a cassette
+
+    a latency can be added to every response and errors can be injected with a probability
+    per status, i.e. errors={429: 0.05, 503: 0.01}. Injected errors are google api error
+    responses, so they are retried like real ones.
+    """
+
+    def __init__(self, cassette, latency=0.0, jitter=0.0, errors=None, seed=None):
+        """
+        create a replaying http object
+
+        :param cassette: Cassette
+        :param latency: seconds added to every response
+        :param jitter: maximum random seconds added to the latency
+        :param errors: dict http status -> probability of injecting it
+        :param seed: seed of the random latency and errors, for reproducible runs
+        """
+        self.cassette = cassette
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors or {}
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.injected = 0
+        self.connections = {}
+        self.follow_redirects = True
+        self.redirect_codes = frozenset((300, 301, 302, 303, 307, 308))
+        self.timeout = None
+        self._replayed = {}
+        self._lock = threading.Lock()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """answer a request from the cassette, see httplib2.Http.request"""
+        import httplib2
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            injected = None
+            for status, probability in sorted(self.errors.items()):
+                if self.random.random() < probability:
+                    injected = status
+                    break
+            if injected is None:
+                responses = self.cassette.responses(uri, method, body)
+                if not responses:
+                    raise ReplayMissError("{} {} has not been recorded".format(method, uri))
+                key = request_key(uri, method, body)
+                index = self._replayed.get(key, 0)
+                self._replayed[key] = index + 1
+                # repeat the last response once all have been replayed
+                response_headers, content = responses[min(index, len(responses) - 1)]
+            else:
+                self.injected += 1
+                response_headers, content = error_response(injected)
+        if delay > 0:
+            time.sleep(delay)
+        response = httplib2.Response(response_headers)
+        response.status = int(response_headers["status"])
+        return response, content
+
+    def close(self):
+        """nothing to close"""
+        pass
+
+
+def recording_pool(cassette, max_size=10):
+    """
+    connection pool recording all requests, use with GoogleApi.with_http_pool
+
+    :param cassette: Cassette
+    :param max_size: maximum number of http objects
+    :return: pool.HttpPool
+    """
+    return HttpPool(max_size, factory=cassette.recording_http)
+
+
+def replay_pool(cassette, max_size=10, **kwargs):
+    """
+    connection pool replaying a cassette, use with GoogleApi.with_http_pool
+
+    all http objects of the pool share one ReplayHttp
+
+    :param cassette: Cassette
+    :param max_size: maximum number of http objects
+    :param kwargs: arguments of ReplayHttp, i.e. latency or errors
+    :return: pool.HttpPool
+    """
+    http = cassette.replay_http(**kwargs)
+    return HttpPool(max_size, factory=lambda: http)
@@ -0,0 +1,206 @@
+""" retry policies for api calls """
+
+import email.utils
+import json
+import random
+import socket
+import threading
+import time
+
+from googleapiclient import errors
+
+RETRY_CODES = (429, 500, 502, 503, 504)
+RETRY_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "backendError", "internalError")
+
+
+def parse_http_error(error):
+    """
+    extract code, reason and message of a google api error
+
+    :param error: googleapiclient.errors.HttpError
+    :return: tuple (code, reason, message)
+    """
+    code = error.resp.get('code', getattr(error.resp, 'status', None))
+    reason = ''
+    message = ''
+    try:
+        data = json.loads(error.content.decode('utf-8'))
+        code = data['error']["code"]
+        message = data['error']['message']
+        reason = data['error']['errors'][0]['reason']
+    except:  # noqa
+        pass
+    return code, reason, message
+
+
+def is_rate_limit_error(code, message):
+    """check if an api error was caused by a rate limit"""
+    return code == 403 and "rate limit exceeded" in message.lower()
+
+
+def retry_after(error):
+    """
+    seconds to wait according to the Retry-After header of an error response
+
+    :param error: googleapiclient.errors.HttpError
+    :return: seconds or None if the header is missing
+    """
+    value = error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(time.mktime(email.utils.parsedate(value)) - time.mktime(time.gmtime()), 0.0)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class RetryPolicy(object):
+    """
+    decides which errors are retried and how long to wait in between
+
+    rate limits (403 rate limit exceeded, 429), backend errors and 5xx responses as well as
+    connection errors are retried. Delays use decorrelated jitter, so concurrent workers do not
+    retry in lockstep, and a Retry-After header is honoured. A call is given up after
+    max_attempts or when the deadline would be exceeded.
+    """
+
+    def __init__(self,
+                 max_attempts=10,
+                 deadline=None,
+                 base_delay=1.0,
+                 max_delay=64.0,
+                 retry_codes=RETRY_CODES,
+                 retry_reasons=RETRY_REASONS):
+        """
+        create a retry policy
+
+        :param max_attempts: maximum number of attempts per call, including the first one
+        :param deadline: maximum seconds per call including all retries, None for no deadline
+        :param base_delay: minimum delay between attempts
+        :param max_delay: maximum delay between attempts
+        :param retry_codes: http status codes to retry
+        :param retry_reasons: error reasons to retry
+        """
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_codes = retry_codes
+        self.retry_reasons = retry_reasons
+        self.calls = 0
+        self.retried_calls = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.sleep_time = 0.0
+        self._lock = threading.Lock()
+
+    def is_retryable(self, error):
+        """
+        check if an error should be retried
+
+        :param error: exception raised by a call
+        :return: bool
+        """
+        if isinstance(error, errors.HttpError):
+            code, reason, message = parse_http_error(error)
+            return (code in self.retry_codes or reason in self.retry_reasons
+                    or is_rate_limit_error(code, message))
+        return isinstance(error, (ConnectionError, socket.timeout))
+
+    def backoff(self, previous_delay):
+        """
+        next delay using decorrelated jitter
+
+        :param previous_delay: previous delay or None for the first retry
+        :return: seconds
+        """
+        previous_delay = previous_delay or self.base_delay
+        return min(self.max_delay, random.uniform(self.base_delay, previous_delay * 3))
+
+    def record_call(self):
+        """count a call executed with this policy"""
+        with self._lock:
+            self.calls += 1
+
+    def start(self, attempt=0, started=None):
+        """
+        start retrying a call, called after the first failed attempt
+
+        :param attempt: number of attempts already made
+        :param started: time the call started, defaults to now
+        :return: RetryState
+        """
+        return RetryState(self, attempt, started)
+
+    def _record(self, delay, first):
+        """record a retry"""
+        with self._lock:
+            if first:
+                self.retried_calls += 1
+            self.retries += 1
+            self.sleep_time += delay
+
+    def _record_give_up(self):
+        """record a call given up while retryable"""
+        with self._lock:
+            self.gave_up += 1
+
+    def stats(self):
+        """
+        retry statistics
+
+        :return: dict with calls, retried_calls, retries, gave_up and sleep_time in seconds
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retried_calls": self.retried_calls,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "sleep_time": self.sleep_time,
+            }
+
+
+class RetryState(object):
+    """ retry state of a single call """
+
+    def __init__(self, policy, attempt=0, started=None):
+        """
+        create a retry state
+
+        :param policy: RetryPolicy
+        :param attempt: number of attempts already made
+        :param started: time the call started, defaults to now
+        """
+        self.policy = policy
+        self.attempt = attempt
+        self.delay = None
+        self.started = started if started is not None else time.time()
+
+    def next_delay(self, error):
+        """
+        delay before the next attempt
+
+        the delay is recorded as slept in the policy statistics
+
+        :param error: exception raised by the last attempt
+        :return: seconds to wait or None if the error must not be retried
+        """
+        self.attempt += 1
+        if not self.policy.is_retryable(error):
+            return None
+        delay = self.policy.backoff(self.delay)
+        if isinstance(error, errors.HttpError):
+            delay = max(delay, retry_after(error) or 0.0)
+        if self.attempt >= self.policy.max_attempts or (
+                self.policy.deadline is not None
+                and time.time() + delay - self.started > self.policy.deadline):
+            self.policy._record_give_up()
+            return None
+        self.policy._record(delay, self.delay is None)
+        self.delay = delay
+        return delay
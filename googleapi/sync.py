@@ -0,0 +1,304 @@
+""" incremental sync of listings with the change tokens of the apis """
+
+import json
+import logging
+import os
+
+from googleapiclient import errors
+
+from .cache import atomic_write
+from .filelock import file_lock
+
+# kinds of sync results
+RESET = "reset"
+CHANGED = "changed"
+DELETED = "deleted"
+
+log = logging.getLogger("GoogleApi")
+
+
+class TokenStore(object):
+    """
+    sync tokens stored in a json file
+
+    updates are serialized with a file lock, so the store can be shared by processes
+    """
+
+    def __init__(self, file_name):
+        """
+        open a token store
+
+        :param file_name: json file, created on the first update
+        """
+        self.file_name = file_name
+
+    def _load(self):
+        """read all tokens"""
+        if not os.path.isfile(self.file_name):
+            return {}
+        with open(self.file_name) as store_file:
+            return json.load(store_file)
+
+    def get(self, key):
+        """
+        get a token
+
+        :param key: sync key
+        :return: token or None
+        """
+        return self._load().get(key)
+
+    def set(self, key, token):
+        """
+        store a token, None removes it
+
+        :param key: sync key
+        :param token: json serializable token
+        """
+        with file_lock(self.file_name):
+            tokens = self._load()
+            if token is None:
+                tokens.pop(key, None)
+            else:
+                tokens[key] = token
+            atomic_write(self.file_name, json.dumps(tokens, sort_keys=True))
+
+
+def sync_key(google_api, path, params):
+    """
+    key of a listing in the token store
+
+    :param google_api: GoogleApi
+    :param path: api path of the resource, i.e. ("events", )
+    :param params: parameters of the list call
+    :return: string
+    """
+    return json.dumps([google_api.api, google_api.api_version, google_api.sub, ".".join(path),
+                       params], sort_keys=True)
+
+
+def _expired(error):
+    """check if a sync token expired, people reports it with status 400"""
+    return error.resp.status == 410 or b"EXPIRED_SYNC_TOKEN" in (error.content or b"")
+
+
+class TokenSync(object):
+    """
+    sync with sync tokens of list calls, i.e. calendar events and people connections
+
+    a full listing returns a nextSyncToken on its last page, listing with syncToken returns
+    the changes since then
+    """
+
+    def __init__(self, return_element, deleted, forbidden=(), sync_params=None):
+        """
+        create a token sync
+
+        :param return_element: name of the element containing a list of items
+        :param deleted: function returning True for deleted items
+        :param forbidden: parameters which can not be combined with syncToken
+        :param sync_params: additional parameters of all list calls
+        """
+        self.return_element = return_element
+        self.deleted = deleted
+        self.forbidden = forbidden
+        self.sync_params = sync_params or {}
+
+    def sync(self, helper, token, params):
+        """
+        list the changes since token, or everything if token is None
+
+        :param helper: MethodHelper of the resource
+        :param token: stored token
+        :param params: parameters of the list call
+        :return: generator of (kind, item), the return value is the new token
+        """
+        for name in self.forbidden:
+            if name in params:
+                raise ValueError("{} can not be used with sync tokens".format(name))
+        params = dict(params, **self.sync_params)
+        if token is not None:
+            try:
+                return (yield from self._list(helper, dict(params, syncToken=token)))
+            except errors.HttpError as error:
+                if not _expired(error):
+                    raise
+                log.info("sync token of %s expired, listing everything", ".".join(helper.path))
+        yield RESET, None
+        return (yield from self._list(helper, params))
+
+    def _list(self, helper, params):
+        """list all pages, yield the items and return the nextSyncToken"""
+        token = None
+        for page in helper.iter_pages(**params):
+            for item in page.get(self.return_element, []):
+                yield (DELETED if self.deleted(item) else CHANGED), item
+            token = page.get("nextSyncToken", token)
+        return token
+
+
+class DriveSync(object):
+    """
+    sync drive files (v3) with the changes of drive
+
+    the start page token is requested before the full listing, so changes during the listing
+    are returned by the next sync. The fields of files are selected with the fields parameter
+    of files.list, i.e. fields="files(id,name,parents)", trashed is always requested.
+    Parameters changes.list can not apply, i.e. q, are rejected.
+    """
+
+    # parameters of files.list which are valid for changes.list too
+    CHANGE_PARAMS = ("driveId", "includeItemsFromAllDrives", "pageSize", "spaces",
+                     "supportsAllDrives")
+    # fields of files returned without a fields parameter, and trashed
+    FILE_FIELDS = "kind,id,name,mimeType,trashed"
+
+    def file_fields(self, fields):
+        """
+        fields of the files selected by the fields parameter of files.list
+
+        :param fields: fields parameter, i.e. "nextPageToken,files(id,name)", or None
+        :return: fields of a file including trashed, i.e. "id,name,trashed"
+        """
+        if fields is None:
+            return self.FILE_FIELDS
+        # split the top level of the field mask, selections may be nested
+        depth = 0
+        start = 0
+        selected = []
+        for index, char in enumerate(fields + ","):
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "," and depth == 0:
+                selected.append(fields[start:index].strip())
+                start = index + 1
+        for field in selected:
+            if field in ("files", "files(*)", "*"):
+                return "*"
+            if field.startswith("files(") and field.endswith(")"):
+                file_fields = field[len("files("):-1]
+                if "trashed" not in file_fields.split(","):
+                    file_fields += ",trashed"
+                return file_fields
+        raise ValueError("fields must select files, i.e. files(id,name), got {}".format(fields))
+
+    def sync(self, helper, token, params):
+        """see TokenSync.sync"""
+        for name in params:
+            if name not in self.CHANGE_PARAMS and name not in ("corpora", "fields", "orderBy"):
+                raise ValueError("{} can not be used with drive changes".format(name))
+        file_fields = self.file_fields(params.get("fields"))
+        params = dict(params, fields="files({})".format(file_fields))
+        change_params = {name: value for name, value in params.items()
+                         if name in self.CHANGE_PARAMS}
+        change_params["fields"] = ("newStartPageToken,changes(fileId,removed,changeType,"
+                                   "file({}))".format(file_fields))
+        changes = helper.google_api.changes()
+        if token is not None:
+            try:
+                return (yield from self._changes(changes, token, change_params))
+            except errors.HttpError as error:
+                if not _expired(error):
+                    raise
+                log.info("drive changes token expired, listing all files")
+        start_params = {name: value for name, value in change_params.items()
+                        if name in ("driveId", "supportsAllDrives")}
+        token = helper.google_api.retry(
+            changes.service.getStartPageToken(**start_params))["startPageToken"]
+        yield RESET, None
+        for page in helper.iter_pages(**params):
+            for drive_file in page.get("files", []):
+                yield (DELETED if drive_file.get("trashed") else CHANGED), drive_file
+        return token
+
+    def _changes(self, changes, token, params):
+        """list all changes since token, return the new start page token"""
+        for page in changes.iter_pages(page_token=token, **params):
+            for change in page.get("changes", []):
+                # changes of shared drives themselves are not file changes
+                if change.get("changeType", "file") != "file":
+                    continue
+                drive_file = change.get("file") or {"id": change.get("fileId")}
+                yield (DELETED if change.get("removed") or drive_file.get("trashed") else
+                       CHANGED), drive_file
+            token = page.get("newStartPageToken", token)
+        return token
+
+
+class EtagSync(object):
+    """
+    sync of listings without change tokens, i.e. admin users and groups
+
+    all items are listed, but only items with a new etag are returned. The token is the map
+    of item ids to etags, deleted items are the ids missing in the listing.
+    """
+
+    def __init__(self, return_element="items"):
+        """
+        create an etag sync
+
+        :param return_element: name of the element containing a list of items
+        """
+        self.return_element = return_element
+
+    def sync(self, helper, token, params):
+        """see TokenSync.sync"""
+        if token is None:
+            yield RESET, None
+        previous = token or {}
+        etags = {}
+        for item in helper.iter_all(self.return_element, **params):
+            etag = etags[item["id"]] = item.get("etag")
+            if item["id"] not in previous or previous[item["id"]] != etag:
+                yield CHANGED, item
+        for item_id in previous:
+            if item_id not in etags:
+                yield DELETED, {"id": item_id}
+        return etags
+
+
+# sync of (api, api version, resource path)
+SYNCS = {
+    ("admin", "directory_v1", ("groups", )): EtagSync("groups"),
+    ("admin", "directory_v1", ("members", )): EtagSync("members"),
+    ("admin", "directory_v1", ("users", )): EtagSync("users"),
+    ("calendar", "v3", ("events", )): TokenSync(
+        "items",
+        lambda event: event.get("status") == "cancelled",
+        forbidden=("iCalUID", "orderBy", "privateExtendedProperty", "q", "sharedExtendedProperty",
+                   "timeMin", "timeMax", "updatedMin")),
+    ("calendar", "v3", ("calendarList", )): TokenSync(
+        "items", lambda entry: entry.get("deleted", False), forbidden=("minAccessRole", )),
+    ("drive", "v3", ("files", )): DriveSync(),
+    ("people", "v1", ("people", "connections")): TokenSync(
+        "connections",
+        lambda person: person.get("metadata", {}).get("deleted", False),
+        forbidden=("sortOrder", ),
+        sync_params={"requestSyncToken": True}),
+}
+
+
+def sync(helper, store, return_element=None, full=False, **params):
+    """
+    list the changes of a resource since the last sync
+
+    :param helper: MethodHelper of the resource, i.e. calendar.events()
+    :param store: TokenStore
+    :param return_element: name of the element containing a list of items, for resources
+        without a registered sync which are synced by etags
+    :param full: ignore the stored token and list everything
+    :param params: parameters of the list call
+    :return: generator of (kind, item)
+    """
+    google_api = helper.google_api
+    synchronizer = SYNCS.get((google_api.api, google_api.api_version, helper.path))
+    if synchronizer is None:
+        synchronizer = EtagSync(return_element or "items")
+    key = sync_key(google_api, helper.path, params)
+    token = None if full else store.get(key)
+    token = yield from synchronizer.sync(helper, token, params)
+    # the token is only stored when all changes have been consumed
+    if token is not None:
+        store.set(key, token)
@@ -40,28 +40,33 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
     keywords='google api python',
+    python_requires='>=3.7',
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
 
     #   py_modules=["my_module"],
     install_requires=['google-api-python-client', 'google-auth', 'google-auth-oauthlib'],
     extras_require={
+        'async': ['aiohttp'],
+        'fast': ['orjson'],
         'dev': [],
         'test': [],
     },
     package_data={},
     data_files=[],
 
-    # entry_points={
-    #     'console_scripts': [
-    #         'sample=sample:main',
-    #     ],
-    # },
+    entry_points={
+        'console_scripts': [
+            'googleapi-prewarm=googleapi.prewarm:main',
+        ],
+    },
 )
@@ -0,0 +1,193 @@
+""" local http server answering google api requests, used by the tests """
+
+import email.parser
+import http.client
+import json
+import threading
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient import discovery_cache
+
+from googleapi.api import GoogleApi
+from googleapi.cache import MemoryCache
+from googleapi.discovery import ServiceRegistry
+
+
+class StubRequest(object):
+    """ request received by the stub server """
+
+    def __init__(self, method, path, headers, body):
+        """
+        :param headers: dict of request headers, names are lower case
+        """
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        parsed = urllib.parse.urlsplit(path)
+        self.route = parsed.path
+        self.query = dict(urllib.parse.parse_qsl(parsed.query))
+
+    def json(self):
+        """parsed request body"""
+        return json.loads(self.body.decode("utf-8"))
+
+
+def error(code, reason, message="error"):
+    """
+    google api error response
+
+    :return: (status, headers, content)
+    """
+    return code, {}, {"error": {"code": code, "message": message,
+                                "errors": [{"reason": reason, "message": message}]}}
+
+
+def service_account_info(token_uri, key_id="test"):
+    """
+    service account key with a new private key
+
+    :param token_uri: token endpoint, i.e. the /token route of a stub server
+    :param key_id: private_key_id of the key
+    :return: service account key as dict
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return {
+        "type": "service_account",
+        "client_email": "test@project.iam.gserviceaccount.com",
+        "private_key_id": key_id,
+        "private_key": key.private_bytes(serialization.Encoding.PEM,
+                                         serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption()).decode("ascii"),
+        "token_uri": token_uri,
+    }
+
+
+class StubServer(object):
+    """
+    http server on localhost answering requests with handlers
+
+    a handler is registered for a path prefix, the longest matching prefix wins. It gets a
+    StubRequest and returns (status, headers, content), content may be bytes or json data.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("content-length") or 0)
+                body = self.rfile.read(length) if length else b""
+                headers = {name.lower(): value for name, value in self.headers.items()}
+                request = StubRequest(self.command, self.path, headers, body)
+                stub.requests.append(request)
+                status, headers, content = stub.handle(request)
+                if not isinstance(content, bytes):
+                    content = json.dumps(content).encode("utf-8")
+                self.send_response(status)
+                headers = dict(headers)
+                headers.setdefault("content-type", "application/json")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("content-length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def handle(self, request):
+        """answer a request with the handler of the longest matching prefix"""
+        prefixes = [prefix for prefix in self.handlers if request.route.startswith(prefix)]
+        if not prefixes:
+            return error(404, "notFound", "{} not found".format(request.route))
+        return self.handlers[max(prefixes, key=len)](request)
+
+    def route(self, prefix, handler):
+        """
+        register a handler
+
+        :param prefix: path prefix, i.e. /compute/v1/projects/p/zones/z/instances
+        :param handler: function StubRequest -> (status, headers, content)
+        """
+        self.handlers[prefix] = handler
+
+    def batch(self, request):
+        """
+        handler of batch requests, every call is answered by the handler of its path
+
+        i.e. stub.route("/batch/compute/v1", stub.batch)
+        """
+        message = email.parser.BytesParser().parsebytes(
+            b"content-type: " + request.headers["content-type"].encode("ascii") + b"\r\n\r\n" +
+            request.body)
+        boundary = "stub_batch_boundary"
+        parts = []
+        for part in message.get_payload():
+            request_line, payload = part.get_payload().split("\n", 1)
+            method, path, _ = request_line.split(" ", 2)
+            call = email.parser.Parser().parsestr(payload)
+            headers = {name.lower(): value for name, value in call.items()}
+            call_request = StubRequest(method, path, headers,
+                                       (call.get_payload() or "").encode("utf-8"))
+            self.requests.append(call_request)
+            status, headers, content = self.handle(call_request)
+            if not isinstance(content, bytes):
+                content = json.dumps(content).encode("utf-8")
+            headers = dict(headers)
+            headers.setdefault("content-type", "application/json")
+            lines = ["--" + boundary,
+                     "Content-Type: application/http",
+                     "Content-ID: <response-{}>".format(part["Content-ID"][1:-1]),
+                     "",
+                     "HTTP/1.1 {} {}".format(status, http.client.responses.get(status, ""))]
+            lines.extend("{}: {}".format(name, value) for name, value in headers.items())
+            parts.append("\r\n".join(lines + ["", content.decode("utf-8")]))
+        body = "\r\n".join(parts + ["--" + boundary + "--", ""]).encode("utf-8")
+        return 200, {"content-type": "multipart/mixed; boundary=" + boundary}, body
+
+    def serve_discovery(self, api, api_version):
+        """serve the discovery document bundled with googleapiclient, pointing to this server"""
+        document = json.loads(discovery_cache.get_static_doc(api, api_version))
+        document["rootUrl"] = self.url
+        if document.get("baseUrl"):
+            document["baseUrl"] = self.url + document.get("servicePath", "")
+        self.route("/discovery/{}/{}".format(api, api_version),
+                   lambda request: (200, {}, document))
+
+    def google_api(self, api, api_version, api_class=GoogleApi, **kwargs):
+        """
+        GoogleApi using this server, with its own discovery cache and service registry
+
+        :param api_class: GoogleApi or a subclass, i.e. aio.AsyncGoogleApi
+        :param kwargs: additional arguments of GoogleApi, i.e. credentials
+        """
+        self.serve_discovery(api, api_version)
+        kwargs.setdefault("credentials", AnonymousCredentials())
+        return api_class(api,
+                         api_version, [],
+                         discovery_url=self.url + "discovery/{api}/{apiVersion}",
+                         discovery_cache=MemoryCache(),
+                         service_registry=ServiceRegistry(),
+                         **kwargs)
+
+    def close(self):
+        """stop the server"""
+        self.server.shutdown()
+        self.server.server_close()
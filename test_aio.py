@@ -0,0 +1,167 @@
+""" tests of googleapi.aio against a local stub server """
+
+import asyncio
+import threading
+import time
+
+import google.auth
+import pytest
+
+from google.oauth2 import credentials as oauth2_credentials
+from googleapiclient import errors
+
+from googleapi.aio import AsyncGoogleApi
+from googleapi.pool import HttpPool
+from googleapi.retry import RetryPolicy
+from stubserver import error
+
+INSTANCES = "/compute/v1/projects/p/zones/{}/instances"
+
+
+def compute_api(stub):
+    """async compute api of the stub server, the service is built before the event loop runs"""
+    compute = stub.google_api("compute", "v1", api_class=AsyncGoogleApi,
+                              retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.002))
+    compute.service
+    return compute
+
+
+def list_instances(request):
+    """compute instances.list with two pages"""
+    zone = request.route.split("/")[-2]
+    if request.query.get("pageToken") == "2":
+        return 200, {}, {"items": [{"name": zone + "-b"}]}
+    return 200, {}, {"items": [{"name": zone + "-a"}], "nextPageToken": "2"}
+
+
+def test_list_all_and_execute(stub):
+    stub.route(INSTANCES.format("z"), list_instances)
+    stub.route(INSTANCES.format("z") + "/a", lambda request: (200, {}, {
+        "name": "a", "fields": request.query.get("fields")}))
+    compute = compute_api(stub)
+
+    async def run():
+        async with compute:
+            instances = await compute.instances().list_all(project="p", zone="z")
+            instance = await compute.instances().get(project="p", zone="z",
+                                                     instance="a").execute(field_paths=["name"])
+            return instances, instance
+
+    instances, instance = asyncio.run(run())
+    assert instances == [{"name": "z-a"}, {"name": "z-b"}]
+    assert instance == {"name": "a", "fields": "name"}
+    assert compute.session is None
+
+
+def test_gather(stub):
+    delay = 0.2
+
+    def slow_instance(request):
+        """instances.get taking delay seconds"""
+        time.sleep(delay)
+        return 200, {}, {"name": request.route.rsplit("/", 1)[1]}
+
+    stub.route(INSTANCES.format("z") + "/", slow_instance)
+    compute = compute_api(stub)
+
+    async def run():
+        async with compute:
+            return await asyncio.gather(*[
+                compute.instances().get(project="p", zone="z", instance="i{}".format(n)).execute()
+                for n in range(20)])
+
+    started = time.time()
+    instances = asyncio.run(run())
+    assert [instance["name"] for instance in instances] == ["i{}".format(n) for n in range(20)]
+    # the calls are sent concurrently
+    assert time.time() - started < 10 * delay
+
+
+def test_retry(stub, monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def flaky(request):
+        """fail twice with a retryable error, then fail with a permanent one"""
+        with lock:
+            calls.append(request)
+            if len(calls) <= 2:
+                return error(503, "backendError")
+            if len(calls) == 3:
+                return 200, {}, {"name": "a"}
+            return error(404, "notFound")
+
+    stub.route(INSTANCES.format("z") + "/a", flaky)
+    compute = compute_api(stub)
+
+    def blocking_sleep(seconds):
+        raise AssertionError("backoff must not block the event loop")
+
+    monkeypatch.setattr(time, "sleep", blocking_sleep)
+
+    async def run():
+        async with compute:
+            instance = await compute.instances().get(project="p", zone="z",
+                                                     instance="a").execute()
+            with pytest.raises(errors.HttpError):
+                await compute.instances().get(project="p", zone="z", instance="a").execute()
+            return instance
+
+    assert asyncio.run(run()) == {"name": "a"}
+    assert len(calls) == 4
+    stats = compute.retry_policy.stats()
+    assert stats["calls"] == 2
+    assert stats["retries"] == 2
+
+
+def test_map_list_all(stub):
+    for zone in ("x", "y", "z"):
+        stub.route(INSTANCES.format(zone), list_instances)
+    stub.route(INSTANCES.format("broken"), lambda request: error(403, "forbidden"))
+    compute = compute_api(stub)
+    zones = [{"zone": zone} for zone in ("x", "y", "z", "broken")]
+
+    async def run(raise_errors):
+        async with compute:
+            return [result async for result in compute.instances().map_list_all(
+                zones, project="p", workers=2, raise_errors=raise_errors)]
+
+    results = dict((params["zone"], items) for params, items in asyncio.run(run(False)))
+    assert results["x"] == [{"name": "x-a"}, {"name": "x-b"}]
+    assert isinstance(results["broken"], errors.HttpError)
+    with pytest.raises(errors.HttpError):
+        asyncio.run(run(True))
+
+
+def test_sync_is_not_supported(stub):
+    compute = compute_api(stub)
+    with pytest.raises(TypeError):
+        compute.instances().sync()
+
+
+@pytest.mark.parametrize("http_pool", [None, HttpPool()], ids=["default", "http_pool"])
+def test_application_default_credentials(stub, monkeypatch, http_pool):
+    """without explicit credentials the requests are authorized like the sync client's"""
+    monkeypatch.setattr(google.auth, "default", lambda *args, **kwargs: (
+        oauth2_credentials.Credentials("adc-token"), "project"))
+    stub.route(INSTANCES.format("z"), list_instances)
+    compute = stub.google_api("compute", "v1", api_class=AsyncGoogleApi, credentials=None,
+                              http_pool=http_pool)
+    compute.service
+    assert compute.credentials is None
+
+    async def run():
+        async with compute:
+            return await compute.instances().list_all(project="p", zone="z")
+
+    assert len(asyncio.run(run())) == 2
+    assert [request.headers.get("authorization") for request in stub.requests
+            if request.route == INSTANCES.format("z")] == ["Bearer adc-token"] * 2
+
+
+def test_blocking_calls_are_not_supported(stub):
+    compute = compute_api(stub)
+    with pytest.raises(TypeError):
+        compute.operation_waiter()
+    with pytest.raises(TypeError):
+        compute.batch([compute.instances().get(project="p", zone="z", instance="a")])
@@ -0,0 +1,100 @@
+""" tests of GoogleApi.batch against a local stub server """
+
+import threading
+
+import pytest
+
+from googleapiclient import errors
+
+from googleapi.retry import RetryPolicy
+from stubserver import error
+
+INSTANCES = "/compute/v1/projects/p/zones/z/instances/"
+
+
+class Instances(object):
+    """instances.get, failing instances answer with errors"""
+
+    def __init__(self, stub, failures):
+        """
+        :param failures: dict instance -> list of (status, reason) answered before succeeding
+        """
+        self.stub = stub
+        self.failures = failures
+        self.lock = threading.Lock()
+        stub.route("/batch/compute/v1", stub.batch)
+        stub.route(INSTANCES, self.get)
+
+    def get(self, request):
+        """instances.get"""
+        name = request.route.rsplit("/", 1)[1]
+        with self.lock:
+            failures = self.failures.get(name)
+            if failures:
+                return error(*failures.pop(0))
+        return 200, {}, {"name": name}
+
+    def calls(self):
+        """names of the requested instances"""
+        return [request.route.rsplit("/", 1)[1] for request in self.stub.requests
+                if request.route.startswith(INSTANCES)]
+
+    def batches(self):
+        """number of batch requests"""
+        return len([request for request in self.stub.requests
+                    if request.route == "/batch/compute/v1"])
+
+
+def compute_api(stub):
+    """compute api of the stub server"""
+    return stub.google_api("compute", "v1",
+                           retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.002))
+
+
+def get_instances(compute, names):
+    """instances.get calls"""
+    return [compute.instances().get(project="p", zone="z", instance=name) for name in names]
+
+
+def test_only_failed_calls_are_retried(stub):
+    instances = Instances(stub, {"b": [(429, "rateLimitExceeded"), (503, "backendError")],
+                                 "d": [(404, "notFound")]})
+    compute = compute_api(stub)
+    names = ["a", "b", "c", "d", "e"]
+    results = compute.batch(get_instances(compute, names), raise_errors=False)
+
+    assert [result["name"] for result in results if isinstance(result, dict)] == [
+        "a", "b", "c", "e"]
+    assert isinstance(results[3], errors.HttpError)
+    assert results[3].resp.status == 404
+    # the first batch contains all calls, the retries only the rate limited call
+    assert instances.calls() == names + ["b", "b"]
+    assert instances.batches() == 3
+    assert compute.retry_policy.stats()["retries"] == 2
+
+
+def test_batch_size_and_raise_errors(stub):
+    instances = Instances(stub, {"c": [(404, "notFound")]})
+    compute = compute_api(stub)
+    names = ["a", "b", "c", "d", "e"]
+    with pytest.raises(errors.HttpError):
+        compute.batch(get_instances(compute, names), batch_size=2)
+    # the batch with the failed call is the last one sent
+    assert instances.batches() == 2
+    assert sorted(instances.calls()) == ["a", "b", "c", "d"]
+
+    stub.requests.clear()
+    results = list(compute.iter_batch(get_instances(compute, names), batch_size=2,
+                                      raise_errors=False))
+    assert len(results) == 5
+    assert instances.batches() == 3
+
+
+def test_calls_give_up_after_max_attempts(stub):
+    Instances(stub, {"b": [(503, "backendError")] * 10})
+    compute = compute_api(stub)
+    compute.retry_policy.max_attempts = 3
+    results = compute.batch(get_instances(compute, ["a", "b"]), raise_errors=False)
+    assert results[0] == {"name": "a"}
+    assert isinstance(results[1], errors.HttpError)
+    assert compute.retry_policy.stats()["gave_up"] == 1
@@ -0,0 +1,126 @@
+""" tests of googleapi.bulk against a local stub server """
+
+import base64
+import functools
+import json
+import urllib.parse
+
+import pytest
+
+from googleapiclient import errors
+
+from googleapi.api import GoogleApi
+from googleapi.bulk import BulkRunner
+from googleapi.cache import MemoryCache
+from googleapi.ratelimit import RateLimiter
+from stubserver import error, service_account_info
+
+FILTERS = "/gmail/v1/users/me/settings/filters"
+SCOPES = ["https://www.googleapis.com/auth/gmail.settings.basic"]
+
+
+def gmail_api(url, info):
+    """api factory of the worker processes"""
+    return GoogleApi("gmail",
+                     "v1",
+                     SCOPES,
+                     discovery_url=url + "discovery/{api}/{apiVersion}",
+                     discovery_cache=MemoryCache()).with_service_account(info)
+
+
+def token(request):
+    """token exchange, the access token names the delegated user"""
+    assertion = urllib.parse.parse_qs(request.body.decode("ascii"))["assertion"][0]
+    payload = assertion.split(".")[1]
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    return 200, {}, {"access_token": "token-" + claims.get("sub", ""), "expires_in": 3600}
+
+
+def create_filter(request):
+    """filters.create, filter 7 is invalid"""
+    body = request.json()
+    if body["n"] == 7:
+        return error(400, "invalidArgument", "invalid filter")
+    return 200, {}, {"id": str(body["n"])}
+
+
+@pytest.fixture
+def gmail(stub):
+    """stub server with the gmail api and a token endpoint"""
+    stub.serve_discovery("gmail", "v1")
+    stub.route("/token", token)
+    stub.route(FILTERS, create_filter)
+    return stub
+
+
+@pytest.fixture
+def runner_factory(gmail, tmp_path):
+    info = service_account_info(gmail.url + "token")
+    checkpoint_file = str(tmp_path / "checkpoint" / "filters.jsonl")
+
+    def runner(**kwargs):
+        kwargs.setdefault("processes", 2)
+        return BulkRunner(functools.partial(gmail_api, gmail.url, info), checkpoint_file,
+                          **kwargs)
+
+    return runner
+
+
+def items(count=12):
+    """filters.create of user i for filter i"""
+    return [("user{}@example.com".format(n), "users.settings.filters.create", {
+        "userId": "me",
+        "body": {
+            "n": n
+        }
+    }) for n in range(count)]
+
+
+def created(stub):
+    """filter numbers of the filters.create requests, by authorized user"""
+    return [(request.headers["authorization"], request.json()["n"]) for request in stub.requests
+            if request.route == FILTERS]
+
+
+def test_run(stub, runner_factory):
+    runner = runner_factory(rate_limiter=RateLimiter(1000, 10))
+    results = dict((item[2]["body"]["n"], result) for item, result in runner.run(items()))
+    assert sorted(results) == list(range(12))
+    assert results[0] == {"id": "0"}
+    assert isinstance(results[7], Exception)
+    assert runner.stats() == {"done": 11, "failed": 1, "skipped": 0}
+    # every item is executed once, with the credentials of its subject
+    assert sorted(created(stub), key=lambda call: call[1]) == [
+        ("Bearer token-user{}@example.com".format(n), n) for n in range(12)]
+
+
+def test_resume(stub, runner_factory):
+    runner = runner_factory()
+    for count, _ in enumerate(runner.run(items()), 1):
+        # interrupt the run
+        if count == 5:
+            break
+    first = set(n for _, n in created(stub))
+    stub.requests.clear()
+
+    resumed = runner_factory()
+    list(resumed.run(items()))
+    assert resumed.stats()["skipped"] >= 5
+    assert resumed.stats()["skipped"] + resumed.stats()["done"] + resumed.stats()["failed"] == 12
+    # items finished before the interruption are not executed again
+    second = set(n for _, n in created(stub))
+    assert first | second == set(range(12))
+    assert len(first & second) <= len(first) - 5
+
+    # failed items are only run again with retry_errors
+    stub.requests.clear()
+    assert list(runner_factory().run(items())) == []
+    retry = runner_factory(retry_errors=True)
+    assert [item[2]["body"]["n"] for item, _ in retry.run(items())] == [7]
+    assert retry.stats() == {"done": 0, "failed": 1, "skipped": 11}
+
+
+def test_raise_errors(runner_factory):
+    with pytest.raises(errors.HttpError) as raised:
+        list(runner_factory().run(items(), raise_errors=True))
+    assert "invalid filter" in str(raised.value)
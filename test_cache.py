@@ -0,0 +1,83 @@
+""" tests of googleapi.cache against a local stub server """
+
+from google.auth import credentials
+
+from googleapi.cache import ResponseCache
+from googleapi.credentials import CredentialCache
+from stubserver import service_account_info
+
+
+def list_instances(request):
+    """compute instances.list with two pages and an etag per page, unchanged pages get 304"""
+    page = request.query.get("pageToken", "1")
+    etag = '"page-{}"'.format(page)
+    if request.headers.get("if-none-match") == etag:
+        return 304, {"etag": etag}, b""
+    if page == "2":
+        return 200, {"etag": etag}, {"items": [{"name": "b"}]}
+    return 200, {"etag": etag}, {"items": [{"name": "a"}], "nextPageToken": "2"}
+
+
+def test_pages_revalidate_with_their_own_etag(stub):
+    stub.route("/compute/v1/projects/p/zones/z/instances", list_instances)
+    cache = ResponseCache(ttl=0)
+    compute = stub.google_api("compute", "v1").with_response_cache(cache)
+    compute.service
+    # only the first page is cached
+    next(compute.instances().iter_pages(project="p", zone="z"))
+
+    stub.requests.clear()
+    assert compute.instances().list_all(project="p", zone="z") == [{"name": "a"}, {"name": "b"}]
+    # the etag of the first page is not sent with the request of the second page
+    etags = [request.headers.get("if-none-match") for request in stub.requests]
+    assert etags == ['"page-1"', None]
+    stub.requests.clear()
+    compute.instances().list_all(project="p", zone="z")
+    etags = [request.headers.get("if-none-match") for request in stub.requests]
+    assert etags == ['"page-1"', '"page-2"']
+    assert cache.stats()["revalidated"] == 3
+
+
+def test_principals_do_not_share_responses(stub):
+    tokens = []
+    stub.route("/token", lambda request: (200, {}, {
+        "access_token": "token-{}".format(tokens.append(None) or len(tokens)),
+        "expires_in": 3600}))
+    stub.route("/compute/v1/projects/p/zones/z/instances", lambda request: (200, {}, {
+        "items": [{"name": request.headers["authorization"]}]}))
+    cache = ResponseCache(ttl=60)
+
+    def instances(client_email):
+        """instances listed with the credentials of a service account"""
+        info = dict(service_account_info(stub.url + "token"), client_email=client_email)
+        compute = stub.google_api("compute", "v1", credential_cache=CredentialCache(
+            background_refresh=False)).with_service_account(info).with_response_cache(cache)
+        return compute.instances().list_all(project="p", zone="z")
+
+    first = instances("first@project.iam.gserviceaccount.com")
+    assert instances("second@project.iam.gserviceaccount.com") != first
+    assert instances("first@project.iam.gserviceaccount.com") == first
+    assert cache.stats()["hits"] == 1
+
+
+def test_unknown_principals_are_not_cached(stub):
+    stub.route("/compute/v1/projects/p/zones/z/instances",
+               lambda request: (200, {}, {"items": [{"name": "a"}]}))
+
+    class Credentials(credentials.Credentials):
+        """credentials without an identity"""
+
+        def __init__(self):
+            super(Credentials, self).__init__()
+            self.token = "opaque"
+
+        def refresh(self, request):
+            pass
+
+    cache = ResponseCache(ttl=60)
+    compute = stub.google_api("compute", "v1", credentials=Credentials()).with_response_cache(
+        cache)
+    compute.instances().list_all(project="p", zone="z")
+    compute.instances().list_all(project="p", zone="z")
+    assert cache.stats()["misses"] == 0
+    assert len(stub.requests) == 3
@@ -0,0 +1,91 @@
+""" tests of googleapi.credentials against a local stub server """
+
+import atexit
+import datetime
+import os
+import time
+
+import pytest
+
+from googleapi.credentials import CredentialCache
+from stubserver import service_account_info
+
+
+@pytest.fixture
+def token_uri(stub):
+    """token endpoint of the stub server"""
+    stub.route("/token", lambda request: (200, {}, {
+        "access_token": "token-{}".format(len(stub.requests)), "expires_in": 3600}))
+    return stub.url + "token"
+
+
+def expire(credentials):
+    """let a token expire within the refresh margin"""
+    credentials.token = "old"
+    credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=10)
+
+
+def test_key_id_is_part_of_the_key(token_uri):
+    cache = CredentialCache(background_refresh=False)
+    first = cache.service_account(service_account_info(token_uri), ["scope"])
+    assert cache.service_account(service_account_info(token_uri), ["scope"]) is first
+    rotated = cache.service_account(service_account_info(token_uri, "key-2"), ["scope"])
+    assert rotated is not first
+    assert cache.delegated(first, "user@example.com") is not cache.delegated(
+        rotated, "user@example.com")
+
+
+def test_delegated_without_signer():
+
+    class Credentials(object):
+        service_account_email = "test@project.iam.gserviceaccount.com"
+        scopes = ["scope"]
+
+        def with_subject(self, subject):
+            return (self, subject)
+
+    cache = CredentialCache(background_refresh=False)
+    credentials = Credentials()
+    assert cache.delegated(credentials, "user@example.com") == (credentials, "user@example.com")
+
+
+def test_only_recently_used_tokens_are_refreshed(token_uri, monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = CredentialCache(background_refresh=False)
+    info = service_account_info(token_uri)
+    used = cache.service_account(info, subject="used@example.com")
+    idle = cache.service_account(info, subject="idle@example.com")
+    expire(used)
+    expire(idle)
+
+    # a one pass walk used idle a while ago, used still authorizes requests
+    now[0] += 1800
+    used.apply({})
+    cache.refresh_expiring()
+    assert cache.stats()["refreshes"] == 1
+    assert used.token.startswith("token-")
+    assert idle.token == "old"
+
+    # authorizing a request keeps the credentials fresh
+    headers = {}
+    idle.apply(headers)
+    assert headers["authorization"] == "Bearer old"
+    cache.refresh_expiring()
+    assert idle.token.startswith("token-")
+
+
+def test_tokens_are_persisted_at_exit(token_uri, tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr(atexit, "register", hooks.append)
+    cache = CredentialCache(background_refresh=False, cache_dir=str(tmp_path))
+    info = service_account_info(token_uri)
+    credentials = cache.service_account(info, ["scope"])
+    assert hooks == [cache.persist]
+
+    credentials.token = "token"
+    credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    hooks[0]()
+    assert len(os.listdir(str(tmp_path))) == 1
+    restarted = CredentialCache(background_refresh=False, cache_dir=str(tmp_path))
+    assert restarted.service_account(info, ["scope"]).token == "token"
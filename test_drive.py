@@ -0,0 +1,118 @@
+""" tests of googleapi.drive against a local stub server """
+
+import hashlib
+import os
+import re
+import threading
+
+import pytest
+
+from googleapi.drive import CHUNK_GRANULARITY, DriveTransfer
+from googleapi.retry import RetryPolicy
+from stubserver import error
+
+CHUNK_SIZE = 4 * CHUNK_GRANULARITY
+CONTENT = os.urandom(3 * CHUNK_SIZE + 1234)
+
+
+class DriveStub(object):
+    """drive files.get, get_media and resumable uploads, with injected errors"""
+
+    def __init__(self, server):
+        self.server = server
+        self.sessions = {}
+        self.ranges = []
+        self.content_ranges = []
+        self.fail_chunks = set()
+        self.fail_ranges = set()
+        self.lock = threading.Lock()
+        server.route("/drive/v3/files/", self.get)
+        server.route("/upload/drive/v3/files", self.start_upload)
+        server.route("/upload/session/", self.upload_chunk)
+
+    def get(self, request):
+        """files.get with alt=media for ranges of CONTENT"""
+        if request.query.get("alt") != "media":
+            return 200, {}, {"size": str(len(CONTENT))}
+        start, end = map(int, request.headers["range"].split("=")[1].split("-"))
+        with self.lock:
+            self.ranges.append((start, end))
+            if start in self.fail_ranges:
+                self.fail_ranges.discard(start)
+                return error(429, "rateLimitExceeded")
+        return 206, {"content-type": "application/octet-stream"}, CONTENT[start:end + 1]
+
+    def start_upload(self, request):
+        """start a resumable upload session"""
+        session = str(len(self.sessions))
+        self.sessions[session] = {"data": bytearray(), "metadata": request.json()}
+        return 200, {"location": self.server.url + "upload/session/" + session}, b""
+
+    def upload_chunk(self, request):
+        """
+        receive a chunk of an upload session
+
+        a failing chunk is stored only partially, the client has to ask for the stored range
+        """
+        session = self.sessions[request.route.rsplit("/", 1)[1]]
+        data = session["data"]
+        content_range = request.headers["content-range"]
+        self.content_ranges.append(content_range)
+        match = re.match(r"bytes (\*|(\d+)-(\d+))/(\d+|\*)", content_range)
+        if match.group(1) != "*":
+            start = int(match.group(2))
+            assert start == len(data)
+            if len(self.content_ranges) in self.fail_chunks:
+                data += request.body[:len(request.body) // 2]
+                return error(503, "backendError")
+            data += request.body
+            if len(data) == int(match.group(4)):
+                return 200, {}, {"id": "uploaded",
+                                 "name": session["metadata"].get("name"),
+                                 "md5Checksum": hashlib.md5(data).hexdigest()}
+        return 308, {"range": "bytes=0-{}".format(len(data) - 1)} if data else {}, b""
+
+
+@pytest.fixture
+def drive(stub):
+    return DriveStub(stub)
+
+
+@pytest.fixture
+def transfer(drive):
+    google_api = drive.server.google_api(
+        "drive", "v3", retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.002))
+    return DriveTransfer(google_api, chunk_size=CHUNK_SIZE, range_workers=3)
+
+
+def test_download_ranges(drive, transfer, tmp_path):
+    drive.fail_ranges.add(CHUNK_SIZE)
+    file_name = str(tmp_path / "download.bin")
+    assert transfer.download("file", file_name) == len(CONTENT)
+    with open(file_name, "rb") as downloaded:
+        assert downloaded.read() == CONTENT
+    assert not os.path.exists(file_name + ".part")
+    # every range is requested once, the rate limited range once more
+    expected = [(start, min(start + CHUNK_SIZE, len(CONTENT)) - 1)
+                for start in range(0, len(CONTENT), CHUNK_SIZE)]
+    assert sorted(drive.ranges) == sorted(expected + [expected[1]])
+
+
+def test_upload_resumes_after_server_error(drive, transfer, tmp_path):
+    # the second chunk fails after the server stored half of it
+    drive.fail_chunks.add(2)
+    file_name = str(tmp_path / "upload.bin")
+    with open(file_name, "wb") as source:
+        source.write(CONTENT)
+    uploaded = transfer.upload(file_name)
+    assert uploaded["name"] == "upload.bin"
+    assert uploaded["md5Checksum"] == hashlib.md5(CONTENT).hexdigest()
+    # the client asks for the stored range and resumes at the server's offset
+    half = CHUNK_SIZE + CHUNK_SIZE // 2
+    assert drive.content_ranges[:4] == [
+        "bytes 0-{}/{}".format(CHUNK_SIZE - 1, len(CONTENT)),
+        "bytes {}-{}/{}".format(CHUNK_SIZE, 2 * CHUNK_SIZE - 1, len(CONTENT)),
+        "bytes */{}".format(len(CONTENT)),
+        "bytes {}-{}/{}".format(half, half + CHUNK_SIZE - 1, len(CONTENT)),
+    ]
+    assert transfer.google_api.retry_policy.stats()["retries"] == 1
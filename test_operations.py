@@ -0,0 +1,106 @@
+""" tests of googleapi.operations against a local stub server """
+
+import concurrent.futures
+import threading
+
+import pytest
+
+from googleapiclient import errors
+
+from googleapi.operations import OperationError
+from stubserver import error
+
+OPERATIONS = "/compute/v1/projects/p/zones/z/operations/"
+
+
+class ZoneOperations(object):
+    """compute zoneOperations.get, an operation is done after a number of polls"""
+
+    def __init__(self, stub, polls):
+        """
+        :param polls: dict operation name -> polls until done, None for never
+        """
+        self.stub = stub
+        self.polls = polls
+        self.errors = {}
+        self.lock = threading.Lock()
+        stub.route("/batch/compute/v1", stub.batch)
+        stub.route(OPERATIONS, self.get)
+
+    def get(self, request):
+        """zoneOperations.get"""
+        name = request.route.rsplit("/", 1)[1]
+        if name not in self.polls:
+            return error(404, "notFound")
+        with self.lock:
+            remaining = self.polls[name]
+            if remaining is not None:
+                self.polls[name] = remaining - 1
+        operation = operation_of(name)
+        if remaining is not None and remaining <= 1:
+            operation["status"] = "DONE"
+            if name in self.errors:
+                operation["error"] = {"errors": [{"code": "QUOTA_EXCEEDED",
+                                                  "message": self.errors[name]}]}
+        return 200, {}, operation
+
+
+def operation_of(name):
+    """pending compute zone operation"""
+    return {"name": name, "status": "RUNNING",
+            "selfLink": "https://compute.googleapis.com/compute/v1/projects/p/zones/z/"
+                        "operations/" + name}
+
+
+@pytest.fixture
+def waiter(stub):
+    compute = stub.google_api("compute", "v1")
+    with compute.operation_waiter(min_interval=0.01, max_interval=0.05) as waiter:
+        yield waiter
+
+
+def test_futures_resolve(stub, waiter):
+    operations = ZoneOperations(stub, {"a": 1, "b": 3, "c": 2})
+    finished = waiter.wait([operation_of(name) for name in ("a", "b", "c")], timeout=10)
+    assert [(operation["name"], operation["status"]) for operation in finished] == [
+        ("a", "DONE"), ("b", "DONE"), ("c", "DONE")]
+    assert all(remaining == 0 for remaining in operations.polls.values())
+    assert waiter.pending() == 0
+    # due operations are polled together in batch requests
+    assert any(request.route == "/batch/compute/v1" for request in stub.requests)
+    # a finished operation resolves without polling
+    assert waiter.submit(finished[0]).result() is finished[0]
+
+
+def test_failed_operations(stub, waiter):
+    operations = ZoneOperations(stub, {"a": 2})
+    operations.errors["a"] = "quota exceeded"
+    with pytest.raises(OperationError) as raised:
+        waiter.submit(operation_of("a")).result(timeout=10)
+    assert "QUOTA_EXCEEDED: quota exceeded" in str(raised.value)
+    assert raised.value.operation["status"] == "DONE"
+    # operations which can not be polled fail with the http error
+    with pytest.raises(errors.HttpError) as raised:
+        waiter.submit(operation_of("missing")).result(timeout=10)
+    assert raised.value.resp.status == 404
+
+
+def test_timeout(stub, waiter):
+    ZoneOperations(stub, {"slow": None, "fast": 2})
+    slow = waiter.submit(operation_of("slow"), timeout=0.1)
+    fast = waiter.submit(operation_of("fast"), timeout=10)
+    assert fast.result(timeout=10)["status"] == "DONE"
+    with pytest.raises(TimeoutError):
+        slow.result(timeout=10)
+    assert waiter.pending() == 0
+
+
+def test_close_cancels_pending(stub):
+    ZoneOperations(stub, {"slow": None})
+    waiter = stub.google_api("compute", "v1").operation_waiter(min_interval=0.01)
+    future = waiter.submit(operation_of("slow"))
+    waiter.close()
+    with pytest.raises(concurrent.futures.CancelledError):
+        future.result(timeout=10)
+    with pytest.raises(RuntimeError):
+        waiter.submit(operation_of("slow"))
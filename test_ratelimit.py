@@ -0,0 +1,60 @@
+""" tests of googleapi.ratelimit """
+
+import multiprocessing
+import time
+
+from googleapi.ratelimit import FileTokenBucket, RateLimiter, TokenBucket
+
+# refill negligible within a test, only the capacity counts
+RATE = 0.001
+CAPACITY = 10
+
+
+def reserve_tokens(file_name, start, count):
+    """reserve count tokens one by one once start is set, return the delays"""
+    start.wait()
+    bucket = FileTokenBucket(file_name, RATE, CAPACITY)
+    return [bucket.reserve() for _ in range(count)]
+
+
+def test_file_bucket_is_shared_by_processes(tmp_path):
+    file_name = str(tmp_path / "bucket")
+    with multiprocessing.Manager() as manager:
+        start = manager.Event()
+        with multiprocessing.Pool(2) as pool:
+            results = [pool.apply_async(reserve_tokens, (file_name, start, CAPACITY))
+                       for _ in range(2)]
+            start.set()
+            delays = [delay for result in results for delay in result.get(timeout=30)]
+    # both processes took from one budget of CAPACITY tokens
+    assert len([delay for delay in delays if delay == 0]) == CAPACITY
+    waiting = sorted(delay for delay in delays if delay > 0)
+    assert len(waiting) == CAPACITY
+    # every further token takes 1 / RATE seconds longer
+    steps = [later - earlier for earlier, later in zip(waiting, waiting[1:])]
+    assert all(abs(step - 1 / RATE) < 1 for step in steps)
+
+
+def test_bucket_refills():
+    bucket = TokenBucket(rate=100, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0 < bucket.reserve() <= 0.01
+    time.sleep(0.05)
+    assert bucket.reserve() == 0
+
+
+def test_rate_limiter_buckets_per_project(stub, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    for project in ("p", "q"):
+        stub.route("/compute/v1/projects/{}/zones/z/instances".format(project),
+                   lambda request: (200, {}, {"items": []}))
+    limiter = RateLimiter(RATE, 2)
+    compute = stub.google_api("compute", "v1").with_rate_limiter(limiter)
+    for project in ("p", "q", "p", "q"):
+        compute.instances().list_all(project=project, zone="z")
+    assert sleeps == []
+    compute.instances().list_all(project="p", zone="z")
+    assert len(sleeps) == 1
+    assert limiter.waited == sleeps[0]
@@ -0,0 +1,95 @@
+""" tests of googleapi.replay against a local stub server """
+
+import base64
+import json
+
+import pytest
+
+from google.oauth2 import service_account
+
+from googleapi.pool import HttpPool
+from googleapi.replay import Cassette, ReplayMissError, is_credential, recording_pool, replay_pool
+from googleapi.retry import RetryPolicy
+from stubserver import service_account_info
+
+TOKEN = "ya29.stub-access-token"
+
+
+def service_account_credentials(token_uri):
+    """service account credentials refreshing their token at token_uri"""
+    return service_account.Credentials.from_service_account_info(
+        service_account_info(token_uri), scopes=["https://www.googleapis.com/auth/compute"])
+
+
+def list_instances(request):
+    """compute instances.list with two pages"""
+    if request.query.get("pageToken") == "2":
+        return 200, {}, {"items": [{"name": "b"}]}
+    return 200, {}, {"items": [{"name": "a"}], "nextPageToken": "2"}
+
+
+def test_record_and_replay(stub, tmp_path):
+    stub.route("/token", lambda request: (200, {}, {
+        "access_token": TOKEN, "expires_in": 3600, "token_type": "Bearer"}))
+    stub.route("/compute/v1/projects/p/zones/z/instances", list_instances)
+    cassette = Cassette(str(tmp_path / "compute.json"))
+
+    compute = stub.google_api("compute", "v1",
+                              credentials=service_account_credentials(stub.url + "token"))
+    recorders = []
+
+    def recording_http():
+        """recording http objects of the pool"""
+        recorders.append(cassette.recording_http())
+        return recorders[-1]
+
+    compute.with_http_pool(HttpPool(factory=recording_http))
+    assert compute.instances().list_all(project="p", zone="z") == [{"name": "a"}, {"name": "b"}]
+    assert any(request.route == "/token" for request in stub.requests)
+    assert sum(recorder.skipped for recorder in recorders) == 1
+    cassette.save()
+
+    # the token refresh went through the recording transport, but is not recorded
+    text = open(cassette.file_name).read()
+    assert TOKEN not in text
+    for entries in json.loads(text).values():
+        for entry in entries:
+            assert TOKEN.encode("ascii") not in base64.b64decode(entry["content"])
+    assert not any("/token" in key for key in json.loads(text))
+
+    stub.requests.clear()
+    replayed = stub.google_api("compute", "v1").with_http_pool(replay_pool(Cassette(
+        cassette.file_name)))
+    assert replayed.instances().list_all(project="p", zone="z") == [{"name": "a"}, {"name": "b"}]
+    assert stub.requests == []
+    with pytest.raises(ReplayMissError):
+        replayed.instances().get(project="p", zone="z", instance="a").execute()
+
+
+def test_injected_errors_are_retried(stub, tmp_path):
+    stub.route("/compute/v1/projects/p/zones/z/instances", list_instances)
+    cassette = Cassette(str(tmp_path / "compute.json"))
+    stub.google_api("compute", "v1").with_http_pool(recording_pool(cassette)).instances() \
+        .list_all(project="p", zone="z")
+
+    pool = replay_pool(cassette, seed=3)
+    compute = stub.google_api("compute", "v1",
+                              retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.002))
+    compute.with_http_pool(pool)
+    # the discovery document is not retried, inject errors once the service is built
+    compute.service
+    pool.factory().errors = {503: 0.3}
+    for _ in range(5):
+        assert len(compute.instances().list_all(project="p", zone="z")) == 2
+    assert compute.retry_policy.stats()["retries"] > 0
+
+
+def test_is_credential():
+    assert is_credential("http://metadata.google.internal/computeMetadata/v1/instance/"
+                         "service-accounts/default/token", b"")
+    assert is_credential("https://sts.googleapis.com/v1/token", b"{}")
+    assert is_credential("https://example.com/", b'{"accessToken": "x"}')
+    # discovery documents describe the access_token parameter
+    assert not is_credential("https://example.com/", b'{"parameters": {"access_token": {}}}')
+    assert not is_credential("https://compute.googleapis.com/compute/v1/projects/p",
+                             b'{"name": "p"}')
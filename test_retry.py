@@ -0,0 +1,81 @@
+""" tests of googleapi.retry against a local stub server """
+
+import email.utils
+import time
+
+import pytest
+
+from googleapiclient import errors
+
+from googleapi.retry import RetryPolicy
+from stubserver import error
+
+INSTANCE = "/compute/v1/projects/p/zones/z/instances/a"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """delays of time.sleep, which returns immediately"""
+    delays = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    return delays
+
+
+def get_instance(stub, retry_policy):
+    """execute instances.get on the stub server"""
+    compute = stub.google_api("compute", "v1", retry_policy=retry_policy)
+    return compute.instances().get(project="p", zone="z", instance="a").execute()
+
+
+def calls(stub):
+    """number of instances.get requests"""
+    return len([request for request in stub.requests if request.route == INSTANCE])
+
+
+def test_max_attempts(stub, sleeps):
+    stub.route(INSTANCE, lambda request: error(503, "backendError"))
+    policy = RetryPolicy(max_attempts=4, base_delay=0.01, max_delay=0.02)
+    with pytest.raises(errors.HttpError):
+        get_instance(stub, policy)
+    assert calls(stub) == 4
+    assert len(sleeps) == 3
+    assert policy.stats() == {"calls": 1, "retried_calls": 1, "retries": 3, "gave_up": 1,
+                              "sleep_time": sum(sleeps)}
+
+
+def test_deadline(stub, monkeypatch):
+    # time only passes while sleeping
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    monkeypatch.setattr(time, "sleep", lambda delay: now.__setitem__(0, now[0] + delay))
+    stub.route(INSTANCE, lambda request: error(429, "rateLimitExceeded"))
+    policy = RetryPolicy(deadline=10, base_delay=3, max_delay=3)
+    with pytest.raises(errors.HttpError):
+        get_instance(stub, policy)
+    # attempts at 0, 3, 6 and 9 seconds, the next one would exceed the deadline
+    assert calls(stub) == 4
+    assert policy.stats()["gave_up"] == 1
+
+
+def test_not_retryable(stub, sleeps):
+    stub.route(INSTANCE, lambda request: error(404, "notFound"))
+    policy = RetryPolicy()
+    with pytest.raises(errors.HttpError):
+        get_instance(stub, policy)
+    assert calls(stub) == 1
+    assert sleeps == []
+    assert policy.stats()["gave_up"] == 0
+
+
+@pytest.mark.parametrize("retry_after", [
+    lambda: "30",
+    lambda: email.utils.formatdate(time.time() + 30, usegmt=True),
+], ids=["seconds", "http_date"])
+def test_retry_after(stub, sleeps, retry_after):
+    responses = [(200, {}, {"name": "a"})]
+    status, headers, content = error(429, "rateLimitExceeded")
+    responses.append((status, {"retry-after": retry_after()}, content))
+    stub.route(INSTANCE, lambda request: responses.pop())
+    assert get_instance(stub, RetryPolicy(base_delay=0.01, max_delay=0.02)) == {"name": "a"}
+    assert len(sleeps) == 1
+    assert 28 <= sleeps[0] <= 30
@@ -0,0 +1,73 @@
+""" tests of googleapi.sync against a local stub server """
+
+from googleapi.sync import CHANGED, DELETED, RESET, SYNCS, EtagSync, TokenStore
+
+
+class DriveChanges(object):
+    """drive files.list, changes.getStartPageToken and changes.list"""
+
+    def __init__(self, server):
+        self.server = server
+        self.files = [{"id": "a", "name": "a.txt", "trashed": False},
+                      {"id": "b", "name": "b.txt", "trashed": True}]
+        self.changes = []
+        server.route("/drive/v3/files", self.list_files)
+        server.route("/drive/v3/changes/startPageToken",
+                     lambda request: (200, {}, {"startPageToken": "1"}))
+        server.route("/drive/v3/changes", self.list_changes)
+
+    def list_files(self, request):
+        """files.list, a file only contains the requested fields"""
+        return 200, {}, {"files": [self.select(request, drive_file)
+                                   for drive_file in self.files]}
+
+    def list_changes(self, request):
+        """changes.list"""
+        changes = [dict(change, file=self.select(request, change["file"]))
+                   if "file" in change else change for change in self.changes]
+        return 200, {}, {"changes": changes, "newStartPageToken": "2"}
+
+    @staticmethod
+    def select(request, drive_file):
+        """fields of a file requested in the fields parameter, id and name by default"""
+        fields = request.query.get("fields", "files(id,name)")
+        names = fields[fields.rindex("(") + 1:fields.index(")")].split(",")
+        return {name: value for name, value in drive_file.items() if name in names}
+
+
+def test_drive_sync(stub, tmp_path):
+    drive = DriveChanges(stub)
+    files = stub.google_api("drive", "v3").with_sync_store(
+        TokenStore(str(tmp_path / "tokens.json"))).files()
+
+    assert list(files.sync(fields="nextPageToken,files(id)")) == [
+        (RESET, None), (CHANGED, {"id": "a", "trashed": False}),
+        (DELETED, {"id": "b", "trashed": True})]
+    listing = [request for request in stub.requests if request.route == "/drive/v3/files"]
+    assert listing[0].query["fields"] == "nextPageToken,files(id,trashed)"
+
+    drive.changes = [{"fileId": "a", "changeType": "file",
+                      "file": {"id": "a", "name": "a.txt", "trashed": True}},
+                     {"fileId": "c", "changeType": "file", "removed": True},
+                     {"driveId": "d", "changeType": "drive"}]
+    assert list(files.sync(fields="nextPageToken,files(id)")) == [
+        (DELETED, {"id": "a", "trashed": True}), (DELETED, {"id": "c"})]
+    change_request = [request for request in stub.requests
+                      if request.route == "/drive/v3/changes"][0]
+    assert change_request.query["pageToken"] == "1"
+    assert change_request.query["fields"] == (
+        "nextPageToken,newStartPageToken,changes(fileId,removed,changeType,file(id,trashed))")
+
+
+def test_drive_sync_default_fields(stub, tmp_path):
+    DriveChanges(stub)
+    files = stub.google_api("drive", "v3").with_sync_store(
+        TokenStore(str(tmp_path / "tokens.json"))).files()
+    assert [kind for kind, _ in files.sync()] == [RESET, CHANGED, DELETED]
+
+
+def test_syncs_are_keyed_by_version():
+    assert ("drive", "v3", ("files", )) in SYNCS
+    # drive v2 lists items, it is synced by etags
+    assert not any(key[:2] == ("drive", "v2") for key in SYNCS)
+    assert isinstance(SYNCS.get(("admin", "directory_v1", ("users", ))), EtagSync)